@@ -37,7 +37,10 @@ from pyramid.config import Configurator
 from pyramid.settings import asbool
 from sqlalchemy import engine_from_config
 
-from netprofile.common import cache
+from netprofile.common import (
+    cache,
+    invalidation
+)
 from netprofile.common.modules import IModuleManager
 from netprofile.common.factory import RootFactory
 from netprofile.db.connection import DBSession
@@ -125,6 +128,7 @@ def setup_config(settings):
     engine = engine_from_config(settings, 'sqlalchemy.')
     DBSession.configure(bind=engine)
     cache.cache = cache.configure_cache(settings)
+    invalidation.bus = invalidation.configure_bus(settings)
 
     config = Configurator(settings=settings,
                           root_factory=RootFactory,
@@ -28,6 +28,7 @@ import logging
 import os
 import pkg_resources
 import re
+import transaction
 
 from cliff.lister import Lister
 from cliff.show import ShowOne
@@ -44,6 +45,7 @@ from netprofile.common.modules import (
 )
 from netprofile.common import rt
 from netprofile.common.crypto import get_salt_string
+from netprofile.ext import search
 
 _ = TranslationStringFactory('netprofile')
 
@@ -473,6 +475,55 @@ class DisableModule(Command):
         raise RuntimeError('Unknown result.')
 
 
+class BuildSearchIndex(Command):
+    """
+    Build quick search indexes.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def get_parser(self, prog_name):
+        parser = super(BuildSearchIndex, self).get_parser(prog_name)
+        parser.add_argument(
+            'name',
+            nargs='?',
+            default='all',
+            help='Name of the module to build indexes for '
+                 'or a special value "all".')
+        return parser
+
+    def take_action(self, args):
+        sess = self.app.db_session
+        mm = self.app.mm
+
+        if len(mm.modules) > 0:
+            mm.rescan()
+        else:
+            mm.scan()
+
+        if not mm.load('core'):
+            raise RuntimeError('Unable to proceed without core module.')
+        mm.load_enabled()
+
+        if args.name != 'all' and args.name not in mm.loaded:
+            raise RuntimeError('Module "%s" is not enabled.' % (args.name,))
+        for moddef, models in mm.models.items():
+            if args.name not in ('all', moddef):
+                continue
+            for mname, model in models.items():
+                if not search.is_indexed(model):
+                    continue
+                count = search.build_index(sess, model)
+                if count is None:
+                    self.log.warning('Skipped "%s.%s": index table '
+                                     'is missing.', moddef, mname)
+                    continue
+                self.log.info('Indexed %d objects of "%s.%s".',
+                              count, moddef, mname)
+        transaction.commit()
+        self.log.info('All done.')
+
+
 # Taken nearly verbatim from alembic.config:CommandLine
 class Alembic(Command):
     """
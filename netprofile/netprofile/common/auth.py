@@ -25,8 +25,12 @@ from __future__ import (unicode_literals, print_function,
 
 import hashlib
 import string
+import threading
 import time
 
+from collections import OrderedDict
+from dogpile.cache.api import NO_VALUE
+
 from zope.interface import implementer
 from pyramid.interfaces import IAuthenticationPolicy
 from pyramid.httpexceptions import HTTPFound
@@ -174,6 +178,9 @@ def _is_valid_nonce_timestamp(nonce, max_ahead_sec=5, max_behind_sec=120):
     return False
 
 
+_DIGEST_ENV_KEY = 'netprofile.auth.digest'
+
+
 def _generate_digest_challenge(ts, secret, realm, opaque, stale=False):
     nonce = _generate_nonce(ts, secret)
     return 'Digest %s' % (_format_kvpairs(
@@ -212,6 +219,95 @@ def _parse_authorization(request, secret, realm):
     return params
 
 
+# Number of nonce counts below the highest one that are tracked to allow
+# for requests arriving out of order.
+NONCE_COUNT_WINDOW = 64
+
+
+def _parse_nonce_count(nc):
+    try:
+        nc = int(nc, 16)
+    except (TypeError, ValueError):
+        return None
+    if nc <= 0:
+        return None
+    return nc
+
+
+def _update_nonce_window(state, nc):
+    """
+    Register nonce count in (highest count, seen bitmask) window.
+
+    Returns new window state, or None if this count was already used or
+    is too old to be checked.
+    """
+    if state is None:
+        return (nc, 1)
+    high, mask = state
+    if nc > high:
+        shift = nc - high
+        if shift >= NONCE_COUNT_WINDOW:
+            return (nc, 1)
+        mask = ((mask << shift) | 1) & ((1 << NONCE_COUNT_WINDOW) - 1)
+        return (nc, mask)
+    offset = high - nc
+    if offset >= NONCE_COUNT_WINDOW or mask & (1 << offset):
+        return None
+    return (high, mask | (1 << offset))
+
+
+class DigestNonceStore(object):
+    """
+    Bounded LRU of nonce counts used in authenticated HTTP Digest
+    requests, used for replay protection.
+    """
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._windows = OrderedDict()
+
+    def check(self, nonce, nc):
+        nc = _parse_nonce_count(nc)
+        if nc is None:
+            return False
+        with self._lock:
+            state = _update_nonce_window(self._windows.get(nonce), nc)
+            if state is None:
+                return False
+            self._windows.pop(nonce, None)
+            self._windows[nonce] = state
+            while len(self._windows) > self.max_size:
+                self._windows.popitem(last=False)
+        return True
+
+
+class CacheDigestNonceStore(DigestNonceStore):
+    """
+    Nonce counts shared between processes via a dogpile.cache region.
+
+    Updates are not atomic, so the same request replayed to different
+    processes at the very same moment might pass.
+    """
+    def __init__(self, region, expiration_time=None,
+                 prefix='auth.digest.nc:'):
+        self.region = region
+        self.expiration_time = expiration_time
+        self.prefix = prefix
+
+    def check(self, nonce, nc):
+        nc = _parse_nonce_count(nc)
+        if nc is None:
+            return False
+        key = self.prefix + nonce
+        state = self.region.get(key, expiration_time=self.expiration_time)
+        state = _update_nonce_window(None if state is NO_VALUE else state,
+                                     nc)
+        if state is None:
+            return False
+        self.region.set(key, state)
+        return True
+
+
 @implementer(IAuthenticationPolicy)
 class DigestAuthenticationPolicy(object):
     def __init__(self, secret, callback, **kwargs):
@@ -221,8 +317,9 @@ class DigestAuthenticationPolicy(object):
         self.check_ts = kwargs.get('check_timestamp', True)
         self.ts_max_ahead = kwargs.get('timestamp_max_ahead', 5)
         self.ts_max_behind = kwargs.get('timestamp_max_behind', 120)
+        self.nonce_store = kwargs.get('nonce_store')
 
-    def authenticated_userid(self, request):
+    def _get_params(self, request):
         params = _parse_authorization(request, self.secret, self.realm)
         if params is None:
             return None
@@ -234,45 +331,47 @@ class DigestAuthenticationPolicy(object):
                 nonce, self.ts_max_ahead, self.ts_max_behind):
             _add_www_authenticate(request, self.secret, self.realm, True)
             return None
-        userid = params['username']
-        if self.callback(params, request) is not None:
-            return 'u:%s' % userid
-        _add_www_authenticate(request, self.secret, self.realm)
+        return params
+
+    def _authenticate(self, request):
+        # Credentials and nonce count are checked only once per request.
+        if _DIGEST_ENV_KEY in request.environ:
+            return request.environ[_DIGEST_ENV_KEY]
+        ret = None
+        params = self._get_params(request)
+        if params is not None:
+            groups = self.callback(params, request)
+            if groups is None:
+                _add_www_authenticate(request, self.secret, self.realm)
+            elif (self.nonce_store is not None
+                  and not self.nonce_store.check(params['nonce'],
+                                                 params['nc'])):
+                # Replayed request, make client get a fresh nonce.
+                _add_www_authenticate(request, self.secret, self.realm, True)
+            else:
+                ret = (params['username'], groups)
+        request.environ[_DIGEST_ENV_KEY] = ret
+        return ret
+
+    def authenticated_userid(self, request):
+        auth = self._authenticate(request)
+        if auth is not None:
+            return 'u:%s' % auth[0]
 
     def unauthenticated_userid(self, request):
-        params = _parse_authorization(request, self.secret, self.realm)
+        params = self._get_params(request)
         if params is None:
             return None
-        nonce = params['nonce']
-        if not _is_valid_nonce(nonce, self.secret):
-            _add_www_authenticate(request, self.secret, self.realm)
-            return None
-        if self.check_ts and not _is_valid_nonce_timestamp(
-                nonce, self.ts_max_ahead, self.ts_max_behind):
-            _add_www_authenticate(request, self.secret, self.realm, True)
-            return None
         return 'u:%s' % params['username']
 
     def effective_principals(self, request):
         creds = [Everyone]
-        params = _parse_authorization(request, self.secret, self.realm)
-        if params is None:
-            return creds
-        nonce = params['nonce']
-        if not _is_valid_nonce(nonce, self.secret):
-            _add_www_authenticate(request, self.secret, self.realm)
-            return creds
-        if self.check_ts and not _is_valid_nonce_timestamp(
-                nonce, self.ts_max_ahead, self.ts_max_behind):
-            _add_www_authenticate(request, self.secret, self.realm, True)
-            return creds
-        groups = self.callback(params, request)
-        if groups is None:
-            _add_www_authenticate(request, self.secret, self.realm)
+        auth = self._authenticate(request)
+        if auth is None:
             return creds
         creds.append(Authenticated)
-        creds.append('u:%s' % params['username'])
-        creds.extend(groups)
+        creds.append('u:%s' % auth[0])
+        creds.extend(auth[1])
         return creds
 
     def remember(self, request, principal, *kw):
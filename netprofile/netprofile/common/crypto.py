@@ -27,10 +27,19 @@ import base64
 import crypt
 import hashlib
 import hmac
+import logging
+import os
 import random
 import scrypt
 import string
+import threading
+import time
 
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor
+)
+from concurrent.futures.process import BrokenProcessPool
 from six import PY3
 from pyramid.settings import aslist
 
@@ -42,6 +51,9 @@ __all__ = (
     'get_salt_string',
     'hash_password',
     'verify_password',
+    'get_hash_stats',
+    'HashExecutor',
+    'HashQueueFull',
     'PasswordHandler',
     'ScryptPasswordHandler',
     'DigestHA1PasswordHandler',
@@ -50,6 +62,8 @@ __all__ = (
     'PlainTextPasswordHandler'
 )
 
+logger = logging.getLogger(__name__)
+
 
 def get_random(system_rng=True):
     if system_rng:
@@ -88,6 +102,8 @@ def get_salt_string(length, chars=string.ascii_letters + string.digits):
 
 class PasswordHandler(object):
     elements = 1
+    # CPU-heavy handlers are run on hashing executor.
+    offload = False
 
     def _pack(self, *args):
         if len(args) != self.elements:
@@ -115,6 +131,7 @@ class PasswordHandler(object):
 
 class ScryptPasswordHandler(PasswordHandler):
     elements = 6
+    offload = True
 
     def __init__(self, cfg):
         PasswordHandler.__init__(self, cfg)
@@ -185,6 +202,7 @@ class NTLMPasswordHandler(PasswordHandler):
 
 class CryptPasswordHandler(PasswordHandler):
     elements = 3
+    offload = True
 
     def __init__(self, cfg):
         # TODO: use passlib module if native crypt doesn't know about
@@ -239,6 +257,179 @@ class PlainTextPasswordHandler(PasswordHandler):
         return hmac.compare_digest(password, hashed)
 
 
+class HashQueueFull(RuntimeError):
+    pass
+
+
+def _timed_call(handler, method, args):
+    start = time.monotonic()
+    ret = getattr(handler, method)(*args)
+    return ret, time.monotonic() - start
+
+
+class HashExecutor(object):
+    """
+    Bounded executor for CPU-heavy password hashing.
+
+    Work is run on a process pool, falling back to a thread pool if
+    processes can't be used. Inline mode runs everything synchronously
+    in the calling thread. At most workers + queue_size calls can be
+    pending, others wait up to queue_timeout seconds for a free slot.
+    """
+    modes = ('process', 'thread', 'inline')
+
+    def __init__(self, mode='process', workers=None, queue_size=None,
+                 queue_timeout=30):
+        if mode not in self.modes:
+            raise ValueError('Unknown hashing executor mode: %r' % (mode,))
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        if queue_size is None:
+            queue_size = self.workers * 4
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.workers + queue_size)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed':    0,
+            'rejected':  0,
+            'pending':   0,
+            'max_pending': 0,
+            'wait_time': 0.0,
+            'run_time':  0.0
+        }
+
+    def _make_pool(self):
+        if self.mode == 'process':
+            try:
+                return ProcessPoolExecutor(self.workers)
+            except (ImportError, NotImplementedError, OSError):
+                logger.warning('Process pool is not available, '
+                               'falling back to threads for hashing')
+                self.mode = 'thread'
+        return ThreadPoolExecutor(self.workers)
+
+    def _get_pool(self):
+        pid = os.getpid()
+        with self._lock:
+            # Pools inherited from parent process are unusable.
+            if self._pool is None or self._pid != pid:
+                self._pool = self._make_pool()
+                self._pid = pid
+            return self._pool
+
+    def _fall_back(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                logger.error('Process pool is broken, '
+                             'falling back to threads for hashing')
+                self.mode = 'thread'
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def _submit(self, handler, method, args):
+        pool = self._get_pool()
+        try:
+            future = pool.submit(_timed_call, handler, method, args)
+        except (BrokenProcessPool, OSError):
+            if not isinstance(pool, ProcessPoolExecutor):
+                raise
+            self._fall_back(pool)
+            future = self._get_pool().submit(_timed_call, handler,
+                                             method, args)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._fall_back(pool)
+            raise
+
+    def _update(self, **kwargs):
+        with self._lock:
+            for key, value in kwargs.items():
+                self._stats[key] += value
+            if self._stats['pending'] > self._stats['max_pending']:
+                self._stats['max_pending'] = self._stats['pending']
+
+    def run(self, handler, method, *args):
+        if self.mode == 'inline':
+            self._update(submitted=1)
+            try:
+                ret, elapsed = _timed_call(handler, method, args)
+            except Exception:
+                self._update(failed=1)
+                raise
+            self._update(completed=1, run_time=elapsed)
+            return ret
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._update(rejected=1)
+            raise HashQueueFull('Too many pending password hashing requests')
+        self._update(submitted=1, pending=1)
+        start = time.monotonic()
+        try:
+            try:
+                ret, elapsed = self._submit(handler, method, args)
+            except BrokenProcessPool:
+                ret, elapsed = self._submit(handler, method, args)
+        except Exception:
+            self._update(failed=1)
+            raise
+        finally:
+            self._update(pending=-1)
+            self._slots.release()
+        total = time.monotonic() - start
+        self._update(completed=1, run_time=elapsed,
+                     wait_time=max(total - elapsed, 0.0))
+        return ret
+
+    def stats(self):
+        with self._lock:
+            ret = dict(self._stats)
+        ret.update(mode=self.mode,
+                   workers=self.workers,
+                   queue_size=self.queue_size)
+        return ret
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+_EXECUTOR = HashExecutor('inline')
+
+
+def _run_handler(handler, method, *args):
+    if not handler.offload:
+        return getattr(handler, method)(*args)
+    return _EXECUTOR.run(handler, method, *args)
+
+
+def get_hash_stats():
+    """
+    Get queueing metrics of password hashing executor.
+    """
+    return _EXECUTOR.stats()
+
+
+def configure_executor(cfg):
+    global _EXECUTOR
+
+    opts = make_config_dict(cfg, 'netprofile.crypto.executor.')
+    _EXECUTOR.shutdown(wait=False)
+    _EXECUTOR = HashExecutor(opts.get('mode', 'process'),
+                             workers=opts.get('workers'),
+                             queue_size=opts.get('queue_size'),
+                             queue_timeout=opts.get('queue_timeout', 30))
+    return _EXECUTOR
+
+
 _HANDLERS = {
     'scrypt': ScryptPasswordHandler,
     'digest-ha1': DigestHA1PasswordHandler,
@@ -260,7 +451,8 @@ def hash_password(user, password, scheme=None, subject='users',
     if scheme not in _HANDLERS:
         raise ValueError('Unknown hash scheme: %r' % (scheme,))
     return ((scheme + '$') if prepend_scheme
-            else '') + _HANDLERS[scheme].hash(user, password)
+            else '') + _run_handler(_HANDLERS[scheme], 'hash',
+                                    user, password)
 
 
 def verify_password(user, password, hashed, scheme=None, subject='users'):
@@ -276,7 +468,8 @@ def verify_password(user, password, hashed, scheme=None, subject='users'):
         return False
     if scheme not in _HANDLERS:
         raise ValueError('Unknown hash scheme: %r' % (scheme,))
-    return _HANDLERS[scheme].verify(user, password, hashed)
+    return _run_handler(_HANDLERS[scheme], 'verify',
+                        user, password, hashed)
 
 
 def includeme(config):
@@ -295,3 +488,5 @@ def includeme(config):
 
     for scheme in _HANDLERS:
         _HANDLERS[scheme] = _HANDLERS[scheme](cfg)
+
+    configure_executor(cfg)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Cache invalidation message bus
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from netprofile.common.util import make_config_dict
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before reconnecting a broken subscription.
+RECONNECT_INTERVAL = 5
+
+bus = None
+
+
+class InvalidationBus(object):
+    """
+    Base class for cache invalidation message buses.
+
+    Messages consist of a channel name and an optional key. A key of
+    None means "everything in this channel".
+    """
+    def __init__(self):
+        self.handlers = {}
+
+    def subscribe(self, channel, callback):
+        cbs = self.handlers.setdefault(channel, [])
+        if callback not in cbs:
+            cbs.append(callback)
+
+    def unsubscribe(self, channel, callback):
+        cbs = self.handlers.get(channel, [])
+        if callback in cbs:
+            cbs.remove(callback)
+
+    def dispatch(self, channel, key=None):
+        for cb in self.handlers.get(channel, ()):
+            try:
+                cb(key)
+            except Exception:
+                logger.exception('Error in invalidation handler for %s',
+                                 channel)
+
+    def dispatch_all(self):
+        for channel in list(self.handlers):
+            self.dispatch(channel)
+
+    def publish(self, channel, key=None):
+        raise NotImplementedError
+
+    @property
+    def active(self):
+        """
+        True if invalidations from other processes are being received.
+        """
+        return True
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class LocalInvalidationBus(InvalidationBus):
+    """
+    In-process bus. Suitable for tests and single-process servers.
+    """
+    def publish(self, channel, key=None):
+        self.dispatch(channel, key)
+
+
+class RedisInvalidationBus(InvalidationBus):
+    """
+    Bus that broadcasts messages to all processes via redis pub/sub.
+
+    Each process runs a daemon listener thread, started lazily so that
+    it survives forking servers.
+    """
+    def __init__(self, channel='netprofile.invalidate', **conf):
+        super(RedisInvalidationBus, self).__init__()
+        self.channel = channel
+        self.conf = conf
+        self.origin = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._connected = False
+        self._closing = False
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            import redis
+
+            self._client = redis.Redis(**self.conf)
+        return self._client
+
+    @property
+    def active(self):
+        self.start()
+        return self._connected
+
+    def start(self):
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == pid and self._thread is not None:
+                return
+            # Any listener inherited from parent process is gone.
+            self._client = None
+            self._pid = pid
+            self._connected = False
+            self._closing = False
+            self._thread = threading.Thread(
+                    target=self._listen,
+                    name='InvalidationBus')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def close(self):
+        self._closing = True
+        self._connected = False
+
+    def publish(self, channel, key=None):
+        self.dispatch(channel, key)
+        try:
+            self.client.publish(self.channel, json.dumps(
+                    {'origin': self.origin, 'channel': channel, 'key': key}))
+        except Exception:
+            logger.exception('Unable to publish invalidation for %s',
+                             channel)
+
+    def handle_message(self, msg):
+        if msg.get('type') != 'message':
+            return
+        data = msg['data']
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        try:
+            data = json.loads(data)
+        except ValueError:
+            logger.warning('Malformed invalidation message: %r', data)
+            return
+        if data.get('origin') == self.origin:
+            return
+        self.dispatch(data.get('channel'), data.get('key'))
+
+    def _listen(self):
+        while not self._closing:
+            pubsub = None
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self._connected = True
+                # Messages might have been missed while disconnected.
+                self.dispatch_all()
+                while not self._closing:
+                    msg = pubsub.get_message(timeout=1.0)
+                    if msg is not None:
+                        self.handle_message(msg)
+            except Exception:
+                logger.exception('Invalidation bus subscription failed')
+            finally:
+                self._connected = False
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            if not self._closing:
+                time.sleep(RECONNECT_INTERVAL)
+
+
+def configure_bus(settings):
+    backend = settings.get('netprofile.invalidation.backend')
+    if not backend:
+        return None
+    if backend == 'local':
+        return LocalInvalidationBus()
+    if backend == 'redis':
+        return RedisInvalidationBus(
+                settings.get('netprofile.invalidation.channel',
+                             'netprofile.invalidate'),
+                **make_config_dict(settings, 'netprofile.invalidation.redis.'))
+    raise ValueError('Unknown invalidation bus backend: %s' % (backend,))
+
+
+def publish(channel, key=None):
+    """
+    Publish invalidation message, if the bus is configured.
+    """
+    if bus is not None:
+        bus.publish(channel, key)
+
+
+def subscribe(channel, callback):
+    """
+    Register invalidation handler on the configured bus.
+    """
+    if bus is not None:
+        bus.subscribe(channel, callback)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: JSON encoding helpers
+# Copyright © 2013-2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import binascii
+import datetime as dt
+import decimal
+import ipaddress
+import json
+import uuid
+from dateutil.tz import tzlocal
+from webob import Response
+
+
+def _encode_response(obj):
+    if obj.content_type == 'application/json':
+        # return decoded response body in case it's an already
+        # rendered exception view
+        return json.loads(obj.unicode_body)
+    raise TypeError('Object of type %s is not JSON serializable' % (
+                    type(obj).__name__,))
+
+
+def _encode_json_method(obj):
+    return obj.__json__()
+
+
+def _encode_datetime(obj):
+    if obj.tzinfo is None:
+        obj = obj.replace(tzinfo=tzlocal())
+    return obj.isoformat()
+
+
+def _encode_isoformat(obj):
+    return obj.isoformat()
+
+
+def _encode_ipv6(obj):
+    return tuple(obj.packed)
+
+
+def _encode_bytes(obj):
+    return binascii.hexlify(obj).decode()
+
+
+# Registered type handlers, used by JSON encoders for types not natively
+# supported by JSON. Subclasses are looked up via their MRO.
+_json_types = {
+    dt.datetime:           _encode_datetime,
+    dt.date:               _encode_isoformat,
+    dt.time:               _encode_isoformat,
+    ipaddress.IPv4Address: int,
+    ipaddress.IPv6Address: _encode_ipv6,
+    decimal.Decimal:       str,
+    bytes:                 _encode_bytes,
+    uuid.UUID:             str
+}
+
+# Resolved handlers, keyed by exact type.
+_json_dispatch = {}
+
+
+def register_json_type(cls, handler):
+    """
+    Register a callable used to convert objects of a given class
+    into something JSON-serializable.
+    """
+    _json_types[cls] = handler
+    _json_dispatch.clear()
+
+
+def _resolve_json_handler(cls):
+    if issubclass(cls, Response):
+        return _encode_response
+    if getattr(cls, '__json__', None) is not None:
+        return _encode_json_method
+    for base in cls.__mro__:
+        handler = _json_types.get(base)
+        if handler is not None:
+            return handler
+    return None
+
+
+def json_default(obj):
+    """
+    Convert an object that is not natively supported by JSON.
+    """
+    cls = type(obj)
+    try:
+        handler = _json_dispatch[cls]
+    except KeyError:
+        handler = _json_dispatch[cls] = _resolve_json_handler(cls)
+    if handler is None:
+        jr = getattr(obj, '__json__', None)
+        if jr is not None:
+            return jr()
+        raise TypeError('Object of type %s is not JSON serializable' % (
+                        cls.__name__,))
+    return handler(obj)
+
+
+class JsonReprEncoder(json.JSONEncoder):
+    """
+    A convenience wrapper for classes that support __json__().
+    """
+    def default(self, obj):
+        return json_default(obj)
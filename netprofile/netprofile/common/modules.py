@@ -48,7 +48,11 @@ from netprofile.db.connection import (
     Base,
     DBSession
 )
-from netprofile.ext.data import ExtBrowser
+from netprofile.ext.data import (
+    ExtBrowser,
+    clear_descriptors
+)
+from netprofile.ext.direct import IExtDirectRouter
 from netprofile.common.hooks import IHookManager
 from netprofile.db.migrations import get_alembic_config
 
@@ -234,6 +238,12 @@ class ModuleManager(object):
         else:
             self.vhost = vhost
 
+    def _api_changed(self):
+        clear_descriptors()
+        router = self.cfg.registry.queryUtility(IExtDirectRouter)
+        if router is not None:
+            router.invalidate_api()
+
     def scan(self):
         """
         Perform module discovery. Individual modules can't be loaded
@@ -338,6 +348,7 @@ class ModuleManager(object):
         mod = modcls(self)
         if activate:
             self.loaded[moddef] = mod
+            self._api_changed()
         self.cfg.include(lambda conf: mod.add_routes(conf),
                          route_prefix='/' + moddef)
         # TODO: make cache_max_age configurable
@@ -442,6 +453,7 @@ class ModuleManager(object):
             if not self.unload(moddef):  # pragma: no cover
                 logger.error('Can\'t unload module "%s".', moddef)
                 return False
+            self._api_changed()  # pragma: no cover
         sess = DBSession()
         try:
             mod = sess.query(NPModule).filter(NPModule.name == moddef).one()
@@ -123,6 +123,52 @@ def visit_interval_seconds_mysql(element, compiler, **kw):
         compiler.process(element.clauses.clauses[1]))
 
 
+class DateTrunc(FunctionElement):
+    type = DateTime()
+    name = 'datetrunc'
+
+    def __init__(self, unit, *clauses, **kwargs):
+        if unit not in _date_trunc_formats:
+            raise ValueError('Invalid date truncation unit: %s' % (unit,))
+        self.unit = unit
+        super(DateTrunc, self).__init__(*clauses, **kwargs)
+
+
+_date_trunc_formats = {
+    'hour':  '%Y-%m-%d %H:00:00',
+    'day':   '%Y-%m-%d 00:00:00',
+    'month': '%Y-%m-01 00:00:00'
+}
+
+
+@compiles(DateTrunc, 'mysql')
+def visit_date_trunc_mysql(element, compiler, **kw):
+    return 'CAST(DATE_FORMAT(%s, %s) AS DATETIME)' % (
+        compiler.process(element.clauses.clauses[0], **kw),
+        compiler.process(literal(_date_trunc_formats[element.unit]), **kw))
+
+
+@compiles(DateTrunc, 'postgresql')
+def visit_date_trunc_pgsql(element, compiler, **kw):
+    return 'date_trunc(%s, %s)' % (
+        compiler.process(literal(element.unit), **kw),
+        compiler.process(element.clauses.clauses[0], **kw))
+
+
+@compiles(DateTrunc, 'sqlite')
+def visit_date_trunc_sqlite(element, compiler, **kw):
+    # Match SQLAlchemy DATETIME storage format.
+    return 'strftime(%s, %s)' % (
+        compiler.process(
+            literal(_date_trunc_formats[element.unit] + '.000000'), **kw),
+        compiler.process(element.clauses.clauses[0], **kw))
+
+
+@compiles(DateTrunc)
+def visit_date_trunc(element, compiler, **kw):
+    raise NotImplementedError
+
+
 class Binary16ToDecimal(FunctionElement):
     type = Numeric(40, 0)
     name = 'binary16todecimal'
@@ -136,3 +182,18 @@ def visit_binary16_to_decimal(element, compiler, **kw):
             '* 18446744073709551616 '
             '+ CAST(CONV(SUBSTRING(%s FROM 17 FOR 16), 16, 10) '
             'AS DECIMAL(40))' % (proc, proc))
+
+
+class Explain(Executable, ClauseElement):
+    def __init__(self, stmt):
+        self.statement = stmt
+
+
+@compiles(Explain, 'mysql')
+def visit_explain_mysql(element, compiler, **kw):
+    return 'EXPLAIN ' + compiler.process(element.statement, **kw)
+
+
+@compiles(Explain)
+def visit_explain(element, compiler, **kw):
+    raise NotImplementedError
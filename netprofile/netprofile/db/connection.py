@@ -90,3 +90,13 @@ Base = declarative_base(metadata=DBMeta)
 
 event.listen(Base, 'instrument_class', _cb_instrument_class, propagate=True)
 event.listen(DBSession, 'before_flush', _cb_before_flush)
+
+
+def get_detached_session():
+    """
+    Create a session that is not managed by the request transaction.
+
+    This is useful for streaming data after the transaction has ended.
+    Caller is responsible for closing the session.
+    """
+    return sessionmaker(bind=DBSession().get_bind())()
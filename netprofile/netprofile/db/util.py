@@ -24,6 +24,7 @@ from __future__ import (unicode_literals, print_function,
                         absolute_import, division)
 
 from itertools import groupby
+from sqlalchemy import event
 from sqlalchemy.orm import attributes
 
 
@@ -65,3 +66,30 @@ def populate_related_list(parents, id_key, res_key, reltype, subq,
         keyval = getattr(p, id_key, None)
         if keyval:
             attributes.set_committed_value(p, res_key, ch.get(keyval, ()))
+
+
+class QueryCounter(object):
+    """
+    Count SQL statements executed on a connection.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.count = 0
+
+        def _cb_before_execute(*args):
+            self.count += 1
+        self._cb = _cb_before_execute
+
+    def start(self):
+        event.listen(self.conn, 'before_cursor_execute', self._cb)
+        return self
+
+    def stop(self):
+        event.remove(self.conn, 'before_cursor_execute', self._cb)
+        return self.count
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
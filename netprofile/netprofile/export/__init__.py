@@ -23,10 +23,76 @@
 from __future__ import (unicode_literals, print_function,
                         absolute_import, division)
 
+import datetime as dt
+from six import (
+    integer_types,
+    string_types
+)
 from pyramid.i18n import TranslationStringFactory
 
 _ = TranslationStringFactory('netprofile')
 
+_PLAIN_TYPES = string_types + integer_types + (float, bool, list, dict)
+
+
+def _to_date(value):
+    if isinstance(value, (dt.date, dt.datetime)):
+        return value
+    return str(value)
+
+
+def _to_plain(value):
+    if isinstance(value, _PLAIN_TYPES):
+        return value
+    return str(value)
+
+
+def _to_str(value):
+    if isinstance(value, string_types):
+        return value
+    return str(value)
+
+
+_CONVERTERS = {
+    'int':     int,
+    'float':   float,
+    'boolean': bool,
+    'date':    _to_date,
+    'auto':    _to_plain
+}
+
+
+def get_value_converter(js_type):
+    """
+    Get a function that converts exported field values to plain Python
+    types, according to ExtJS field type of a column.
+
+    Values of unknown types are converted to strings. Converters are
+    never called for None values.
+    """
+    return _CONVERTERS.get(js_type, _to_str)
+
+
+def close_after(gen, sess):
+    """
+    Wrap response body generator to close a database session when
+    the generator is exhausted or closed.
+    """
+    try:
+        for chunk in gen:
+            yield chunk
+    finally:
+        sess.close()
+
+
+class ExportLimitExceeded(ValueError):
+    """
+    Raised when requested export is too large for an export format.
+
+    Its message is meant to be shown to the user.
+    """
+    pass
+
 
 class ExportFormat(object):
     """
@@ -40,6 +106,16 @@ class ExportFormat(object):
     def icon(self):
         pass
 
+    @property
+    def background(self):
+        """
+        Whether this format can be exported by a background task.
+
+        Background exports run outside of HTTP requests, and their
+        response bodies are written to user's VFS.
+        """
+        return False
+
     def enabled(self, req):
         return True
 
@@ -51,7 +127,15 @@ class ExportFormat(object):
 
     def export_panel(self, req, name):
         loc = req.localizer
-        opt = self.options(req, name)
+        opt = tuple(self.options(req, name))
+        if self.background:
+            opt += ({
+                'name':           '__background',
+                'xtype':          'checkbox',
+                'fieldLabel':     loc.translate(_('In background')),
+                'inputValue':     'true',
+                'uncheckedValue': ''
+            },)
         return {
             'title':         loc.translate(self.name),
             'iconCls':       self.icon,
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Data export result cache
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import datetime as dt
+import errno
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from pyramid.response import (
+    FileIter,
+    Response
+)
+from sqlalchemy import func
+
+from netprofile.common.jsonutil import json_default
+from netprofile.db.connection import DBSession
+from netprofile.db.ddl import CurrentTimestampDefault
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 600
+
+# Parameters that don't affect exported data.
+_IGNORED_PARAMS = ('__page', '__start', '__limit', '__background')
+
+_change_columns = {}
+
+
+def get_change_columns(model):
+    """
+    Get attributes of a model that are updated by the database
+    on every change of a row.
+    """
+    attrs = _change_columns.get(model)
+    if attrs is not None:
+        return attrs
+    attrs = []
+    for prop in model.__mapper__.column_attrs:
+        default = prop.columns[0].server_default
+        if (isinstance(default, CurrentTimestampDefault)
+                and default.on_update):
+            attrs.append(getattr(model, prop.key))
+    _change_columns[model] = attrs
+    return attrs
+
+
+def get_change_token(sess, extm, params):
+    """
+    Get a value that changes whenever rows matching export filters
+    are inserted, updated or deleted.
+
+    Returns None for models without a modification timestamp column.
+    """
+    model = extm.model
+    if model.__table__.info.get('export_cache', True) is False:
+        return None
+    attrs = get_change_columns(model)
+    if len(attrs) == 0:
+        return None
+    pk = getattr(model, model.__mapper__.get_property_by_column(
+            model.__mapper__.primary_key[0]).key)
+    # Only rows that end up in the export are aggregated. Rows that
+    # stop matching the filters change the count, and rows that start
+    # matching change the latest modification time.
+    row = extm.get_filtered_query(sess, params,
+                                  func.count(pk), func.max(pk),
+                                  *(func.max(attr) for attr in attrs)).one()
+    return tuple(str(val) for val in row)
+
+
+def get_cache_key(extm, fmt_name, params, req, token):
+    ident = getattr(req, 'identity', None)
+    if ident is None:
+        ident = req.user
+        privs = ident.flat_privileges if ident else {}
+    else:
+        privs = ident.privileges
+    key = json.dumps((
+        extm.model.__module__,
+        extm.name,
+        fmt_name,
+        req.locale_name,
+        ident.id if ident else None,
+        sorted(privs.items()),
+        dict((k, v) for k, v in params.items() if k not in _IGNORED_PARAMS),
+        token
+    ), sort_keys=True, default=json_default)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _load(path, ttl):
+    try:
+        fd = open(path, 'rb')
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    try:
+        st = os.fstat(fd.fileno())
+        if st.st_mtime + ttl < time.time():
+            fd.close()
+            return None
+        with open(path + '.meta', 'r') as metafd:
+            meta = json.load(metafd)
+    except (IOError, ValueError):
+        fd.close()
+        return None
+    res = Response(content_type=meta['content_type'],
+                   charset=meta.get('charset'))
+    res.last_modified = dt.datetime.fromtimestamp(st.st_mtime)
+    res.content_disposition = meta.get('content_disposition')
+    res.cache_control.no_cache = True
+    res.cache_control.no_store = True
+    res.cache_control.private = True
+    res.cache_control.must_revalidate = True
+    res.headerlist.append(('X-Frame-Options', 'SAMEORIGIN'))
+    res.app_iter = FileIter(fd)
+    res.content_length = st.st_size
+    return res
+
+
+def _purge(directory, ttl):
+    oldest = time.time() - ttl
+    for fname in os.listdir(directory):
+        path = os.path.join(directory, fname)
+        try:
+            if os.stat(path).st_mtime < oldest:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+def _store(app_iter, directory, path, meta, ttl):
+    tmp = tempfile.NamedTemporaryFile(dir=directory, prefix='.tmp',
+                                      delete=False)
+    complete = False
+    try:
+        for chunk in app_iter:
+            tmp.write(chunk)
+            yield chunk
+        complete = True
+    finally:
+        close = getattr(app_iter, 'close', None)
+        if callable(close):
+            close()
+        tmp.close()
+        if complete:
+            with open(path + '.meta', 'w') as metafd:
+                json.dump(meta, metafd)
+            os.rename(tmp.name, path)
+            _purge(directory, ttl)
+        else:
+            os.unlink(tmp.name)
+
+
+def cached_export(fmt, fmt_name, extm, params, req):
+    """
+    Run export, or serve identical export result from cache.
+
+    Cache is enabled by setting netprofile.export.cache.directory.
+    Only models that have modification timestamp columns are cached.
+    """
+    cfg = req.registry.settings
+    directory = cfg.get('netprofile.export.cache.directory')
+    ttl = int(cfg.get('netprofile.export.cache.ttl', DEFAULT_TTL))
+    if not directory or ttl <= 0:
+        return fmt.export(extm, params, req)
+    token = get_change_token(DBSession(), extm, params)
+    if token is None:
+        return fmt.export(extm, params, req)
+    key = get_cache_key(extm, fmt_name, params, req, token)
+    path = os.path.join(directory, key)
+    res = _load(path, ttl)
+    if res is not None:
+        logger.debug('Serving export of %s from cache', extm.name)
+        return res
+    res = fmt.export(extm, params, req)
+    if res.status_int != 200:
+        return res
+    meta = {
+        'content_type':        res.content_type,
+        'charset':             res.charset,
+        'content_disposition': res.content_disposition
+    }
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    length = res.content_length
+    res.app_iter = _store(res.app_iter, directory, path, meta, ttl)
+    res.content_length = length
+    return res
@@ -23,14 +23,19 @@
 from __future__ import (unicode_literals, print_function,
                         absolute_import, division)
 
+import codecs
 import csv
 import datetime
 import io
 import urllib
 from six import PY3
 
+from netprofile.db.connection import get_detached_session
 from netprofile.ext.columns import PseudoColumn
-from netprofile.export import ExportFormat
+from netprofile.export import (
+    ExportFormat,
+    close_after
+)
 from pyramid.i18n import TranslationStringFactory
 from pyramid.response import Response
 
@@ -143,6 +148,10 @@ class CSVExportFormat(ExportFormat):
     def icon(self):
         return 'ico-csv'
 
+    @property
+    def background(self):
+        return True
+
     def options(self, req, name):
         loc = req.localizer
         return ({
@@ -238,18 +247,30 @@ class CSVExportFormat(ExportFormat):
         for prop in ('__page', '__start', '__limit'):
             if prop in params:
                 del params[prop]
-        data = extm.read(params, req)['records']
+        params['__fields'] = list(fields)
+        # Response body is generated after the request transaction has
+        # ended, so rows are streamed using a separate session.
+        sess = get_detached_session()
+        try:
+            # Query errors are raised here, before the response is sent.
+            data = extm.iter_read(params, req, sess=sess)
+        except Exception:
+            sess.close()
+            raise
 
-        res.app_iter = csv_generator(data, fields, csv_dialect,
-                                     encoding=csv_encoding,
-                                     localizer=loc,
-                                     model=extm)
+        res.app_iter = close_after(csv_generator(data, fields, csv_dialect,
+                                                 encoding=csv_encoding,
+                                                 localizer=loc,
+                                                 model=extm),
+                                   sess)
         return res
 
 
 def csv_generator(data, fields, dialect, encoding='utf_8',
                   localizer=None, model=None, batch=100, write_header=True):
     cnt = 0
+    # Incremental encoder emits BOM (if any) only once.
+    encoder = codecs.getincrementalencoder(encoding)()
     with io.StringIO() as buf:
         writer = csv.writer(buf, dialect)
         if model and localizer and write_header:
@@ -261,6 +282,7 @@ def csv_generator(data, fields, dialect, encoding='utf_8',
             writer.writerow(tuple(row[field] for field in fields))
             cnt += 1
             if (cnt % batch) == 0:
-                yield bytes(buf.getvalue(), encoding)
+                yield encoder.encode(buf.getvalue())
+                buf.seek(0)
                 buf.truncate(0)
-        yield bytes(buf.getvalue(), encoding)
+        yield encoder.encode(buf.getvalue(), True)
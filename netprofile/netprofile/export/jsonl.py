@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Data export support for JSON Lines files
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import datetime
+import json
+import urllib
+import zlib
+from six import PY3
+
+from netprofile.common.jsonutil import json_default
+from netprofile.db.connection import get_detached_session
+from netprofile.ext.columns import PseudoColumn
+from netprofile.export import (
+    ExportFormat,
+    close_after,
+    get_value_converter
+)
+from pyramid.i18n import TranslationStringFactory
+from pyramid.response import Response
+
+_ = TranslationStringFactory('netprofile')
+
+
+class JSONLinesExportFormat(ExportFormat):
+    """
+    Export data as JSON Lines files.
+    """
+    @property
+    def name(self):
+        return _('JSON Lines')
+
+    @property
+    def icon(self):
+        return 'ico-script-code'
+
+    @property
+    def background(self):
+        return True
+
+    def options(self, req, name):
+        loc = req.localizer
+        return ({
+            'name':           'jsonl_compression',
+            'fieldLabel':     loc.translate(_('Compression')),
+            'xtype':          'combobox',
+            'displayField':   'value',
+            'valueField':     'id',
+            'format':         'string',
+            'queryMode':      'local',
+            'grow':           True,
+            'shrinkWrap':     True,
+            'value':          'gzip',
+            'allowBlank':     False,
+            'forceSelection': True,
+            'editable':       False,
+            'store':          {
+                'xtype':   'simplestore',
+                'fields':  ('id', 'value'),
+                'data':    ({
+                    'id':    'gzip',
+                    'value': loc.translate(_('GZip'))
+                }, {
+                    'id':    'none',
+                    'value': loc.translate(_('None'))
+                })
+            }
+        },)
+
+    def export(self, extm, params, req):
+        compression = params.pop('jsonl_compression', 'gzip')
+        if compression not in ('gzip', 'none'):
+            raise ValueError('Unknown compression specified')
+        fields = []
+        converters = []
+        for field in extm.export_view:
+            if isinstance(field, PseudoColumn):
+                continue
+            fields.append(field)
+            converters.append(get_value_converter(
+                extm.get_column(field).js_type))
+
+        res = Response()
+        loc = req.localizer
+        now = datetime.datetime.now()
+        res.last_modified = now
+        ext = 'jsonl'
+        compress = compression == 'gzip'
+        if compress:
+            res.content_type = 'application/gzip'
+            ext += '.gz'
+        else:
+            res.content_type = 'application/x-ndjson'
+            res.charset = 'UTF-8'
+        res.cache_control.no_cache = True
+        res.cache_control.no_store = True
+        res.cache_control.private = True
+        res.cache_control.must_revalidate = True
+        res.headerlist.append(('X-Frame-Options', 'SAMEORIGIN'))
+        if PY3:
+            res.content_disposition = (
+                'attachment; filename*=UTF-8\'\'%s-%s.%s' % (
+                    urllib.parse.quote(loc.translate(extm.menu_name), ''),
+                    now.date().isoformat(), ext))
+        else:
+            res.content_disposition = (
+                'attachment; filename*=UTF-8\'\'%s-%s.%s' % (
+                    urllib.quote(loc.translate(extm.menu_name).encode(), ''),
+                    now.date().isoformat(), ext))
+
+        for prop in ('__page', '__start', '__limit'):
+            if prop in params:
+                del params[prop]
+        params['__fields'] = list(fields)
+        # Response body is generated after the request transaction has
+        # ended, so rows are streamed using a separate session.
+        sess = get_detached_session()
+        try:
+            # Query errors are raised here, before the response is sent.
+            data = extm.iter_read(params, req, sess=sess)
+        except Exception:
+            sess.close()
+            raise
+
+        res.app_iter = close_after(jsonl_generator(data, fields, converters,
+                                                   compress=compress),
+                                   sess)
+        return res
+
+
+def jsonl_generator(data, fields, converters, compress=False, batch=500):
+    buf = []
+    cnt = 0
+    if compress:
+        # wbits=31 makes zlib write gzip header and trailer.
+        comp = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for row in data:
+        obj = {}
+        for field, conv in zip(fields, converters):
+            value = row.get(field)
+            obj[field] = None if value is None else conv(value)
+        buf.append(json.dumps(obj, default=json_default,
+                              ensure_ascii=False, separators=(',', ':')))
+        cnt += 1
+        if (cnt % batch) == 0:
+            buf.append('')
+            chunk = '\n'.join(buf).encode('utf-8')
+            buf = []
+            if compress:
+                chunk = comp.compress(chunk)
+                if len(chunk) == 0:
+                    continue
+            yield chunk
+    if len(buf) > 0:
+        buf.append('')
+    chunk = '\n'.join(buf).encode('utf-8')
+    if compress:
+        chunk = comp.compress(chunk) + comp.flush()
+    if len(chunk) > 0:
+        yield chunk
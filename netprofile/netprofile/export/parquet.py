@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Data export support for Apache Parquet files
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import datetime
+import tempfile
+import urllib
+from six import PY3
+from sqlalchemy import (
+    Date,
+    DateTime
+)
+
+from netprofile.ext.columns import PseudoColumn
+from netprofile.export import (
+    ExportFormat,
+    get_value_converter
+)
+from pyramid.i18n import TranslationStringFactory
+from pyramid.response import (
+    FileIter,
+    Response
+)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+_ = TranslationStringFactory('netprofile')
+
+# Rows per Parquet row group.
+DEFAULT_BATCH_ROWS = 10000
+
+# Generated files larger than this are spooled to disk.
+_SPOOL_SIZE = 4 * 1024 * 1024
+
+_COMPRESSION_TYPES = ('snappy', 'zstd', 'gzip', 'none')
+
+_INT64_MAX = 9223372036854775807
+
+
+def arrow_type(col):
+    """
+    Get Arrow data type for an ExtColumn.
+    """
+    js_type = col.js_type
+    coltype = getattr(getattr(col, 'column', None), 'type', None)
+    if js_type == 'int':
+        if (getattr(coltype, 'MAX_VALUE', None) or 0) > _INT64_MAX:
+            return pyarrow.uint64()
+        return pyarrow.int64()
+    if js_type == 'float':
+        return pyarrow.float64()
+    if js_type == 'boolean':
+        return pyarrow.bool_()
+    if js_type == 'date':
+        if isinstance(coltype, Date) and not isinstance(coltype, DateTime):
+            return pyarrow.date32()
+        return pyarrow.timestamp('us')
+    return pyarrow.string()
+
+
+class ParquetExportFormat(ExportFormat):
+    """
+    Export data as Apache Parquet files.
+
+    Requires pyarrow to be installed.
+    """
+    @property
+    def name(self):
+        return _('Parquet')
+
+    @property
+    def icon(self):
+        return 'ico-db'
+
+    @property
+    def background(self):
+        return True
+
+    def enabled(self, req):
+        return pyarrow is not None
+
+    def options(self, req, name):
+        loc = req.localizer
+        return ({
+            'name':           'parquet_compression',
+            'fieldLabel':     loc.translate(_('Compression')),
+            'xtype':          'combobox',
+            'displayField':   'value',
+            'valueField':     'id',
+            'format':         'string',
+            'queryMode':      'local',
+            'grow':           True,
+            'shrinkWrap':     True,
+            'value':          'snappy',
+            'allowBlank':     False,
+            'forceSelection': True,
+            'editable':       False,
+            'store':          {
+                'xtype':   'simplestore',
+                'fields':  ('id', 'value'),
+                'data':    ({
+                    'id':    'snappy',
+                    'value': loc.translate(_('Snappy'))
+                }, {
+                    'id':    'zstd',
+                    'value': loc.translate(_('Zstandard'))
+                }, {
+                    'id':    'gzip',
+                    'value': loc.translate(_('GZip'))
+                }, {
+                    'id':    'none',
+                    'value': loc.translate(_('None'))
+                })
+            }
+        },)
+
+    def export(self, extm, params, req):
+        if pyarrow is None:
+            raise RuntimeError('Parquet export requires pyarrow.')
+        compression = params.pop('parquet_compression', 'snappy')
+        if compression not in _COMPRESSION_TYPES:
+            raise ValueError('Unknown compression specified')
+        fields = []
+        types = []
+        converters = []
+        for field in extm.export_view:
+            if isinstance(field, PseudoColumn):
+                continue
+            col = extm.get_column(field)
+            fields.append(field)
+            types.append(arrow_type(col))
+            converters.append(get_value_converter(
+                col.js_type if col.js_type != 'auto' else 'string'))
+        schema = pyarrow.schema(list(zip(fields, types)))
+
+        res = Response()
+        loc = req.localizer
+        now = datetime.datetime.now()
+        res.last_modified = now
+        res.content_type = 'application/vnd.apache.parquet'
+        res.cache_control.no_cache = True
+        res.cache_control.no_store = True
+        res.cache_control.private = True
+        res.cache_control.must_revalidate = True
+        res.headerlist.append(('X-Frame-Options', 'SAMEORIGIN'))
+        if PY3:
+            res.content_disposition = (
+                'attachment; filename*=UTF-8\'\'%s-%s.parquet' % (
+                    urllib.parse.quote(loc.translate(extm.menu_name), ''),
+                    now.date().isoformat()))
+        else:
+            res.content_disposition = (
+                'attachment; filename*=UTF-8\'\'%s-%s.parquet' % (
+                    urllib.quote(loc.translate(extm.menu_name).encode(), ''),
+                    now.date().isoformat()))
+
+        for prop in ('__page', '__start', '__limit'):
+            if prop in params:
+                del params[prop]
+        params['__fields'] = list(fields)
+        data = extm.iter_read(params, req)
+
+        outfile = tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE)
+        try:
+            writer = pyarrow.parquet.ParquetWriter(outfile, schema,
+                                                   compression=compression)
+            try:
+                for table in table_generator(data, schema, converters):
+                    writer.write_table(table)
+            finally:
+                writer.close()
+            size = outfile.tell()
+            outfile.seek(0)
+        except Exception:
+            outfile.close()
+            raise
+        res.app_iter = FileIter(outfile)
+        res.content_length = size
+        return res
+
+
+def _make_table(columns, schema):
+    return pyarrow.Table.from_arrays(
+        [pyarrow.array(col, type=ftype)
+         for col, ftype in zip(columns, schema.types)],
+        schema=schema)
+
+
+def table_generator(data, schema, converters, batch=DEFAULT_BATCH_ROWS):
+    fields = schema.names
+    columns = [[] for field in fields]
+    cnt = 0
+    for row in data:
+        for idx, field in enumerate(fields):
+            value = row.get(field)
+            columns[idx].append(None if value is None
+                                else converters[idx](value))
+        cnt += 1
+        if cnt >= batch:
+            yield _make_table(columns, schema)
+            columns = [[] for field in fields]
+            cnt = 0
+    if cnt > 0:
+        yield _make_table(columns, schema)
@@ -24,11 +24,16 @@ from __future__ import (unicode_literals, print_function,
                         absolute_import, division)
 
 import datetime
+import itertools
+import tempfile
 import urllib
 from six import PY3
 
 from netprofile.ext.columns import PseudoColumn
-from netprofile.export import ExportFormat
+from netprofile.export import (
+    ExportFormat,
+    ExportLimitExceeded
+)
 from netprofile.pdf import (
     DefaultDocTemplate,
     DefaultTableStyle,
@@ -36,7 +41,10 @@ from netprofile.pdf import (
     PAGE_SIZES
 )
 from pyramid.i18n import TranslationStringFactory
-from pyramid.response import Response
+from pyramid.response import (
+    FileIter,
+    Response
+)
 from reportlab.platypus import (
     Frame,
     PageTemplate,
@@ -51,6 +59,17 @@ from babel.dates import format_datetime
 
 _ = TranslationStringFactory('netprofile')
 
+# Data rows per single table. Each table gets its own header row and
+# is laid out independently, which keeps ReportLab from processing
+# huge tables all at once.
+DEFAULT_TABLE_ROWS = 50
+
+# Maximum number of data rows in an exported PDF. Zero means no limit.
+DEFAULT_MAX_ROWS = 20000
+
+# Generated documents larger than this are spooled to disk.
+_SPOOL_SIZE = 4 * 1024 * 1024
+
 
 class PDFExportFormat(ExportFormat):
     """
@@ -64,6 +83,10 @@ class PDFExportFormat(ExportFormat):
     def icon(self):
         return 'ico-pdf'
 
+    @property
+    def background(self):
+        return True
+
     def enabled(self, req):
         if req.pdf_styles is None:
             return False
@@ -206,10 +229,22 @@ class PDFExportFormat(ExportFormat):
         for prop in ('__page', '__start', '__limit'):
             if prop in params:
                 del params[prop]
-        data = extm.read(params, req)['records']
+        params['__fields'] = list(fields)
+        data = extm.iter_read(params, req)
+
+        ss = req.pdf_styles
+        if ss is None:
+            raise RuntimeError('PDF subsystem is not configured. '
+                               'See application .INI files.')
+        cfg = req.registry.settings
+        table_rows = int(cfg.get('netprofile.export.pdf.table_rows',
+                                 DEFAULT_TABLE_ROWS))
+        max_rows = int(cfg.get('netprofile.export.pdf.max_rows',
+                               DEFAULT_MAX_ROWS))
 
+        outfile = tempfile.SpooledTemporaryFile(max_size=_SPOOL_SIZE)
         doc = DefaultDocTemplate(
-            res,
+            outfile,
             request=req,
             pagesize=pdf_pagesz,
             orientation=pdf_orient,
@@ -242,24 +277,56 @@ class PDFExportFormat(ExportFormat):
             else:
                 table_widths.append(col_widths[idx])
 
-        ss = req.pdf_styles
-        if ss is None:
-            raise RuntimeError('PDF subsystem is not configured. '
-                               'See application .INI files.')
-        # TODO: add custom extmodel option to specify rowHeights, as an
-        # optimization measure. Otherwise reportlab takes +Inf time on huge
-        # tables.
-        # Crude hack: rowHeights=([0.5 * inch] * (len(data) + 1)
-        table = LongTable(tuple(storyteller(data, fields, flddef,
-                                            localizer=loc,
-                                            model=extm, styles=ss)),
-                          colWidths=table_widths,
+        try:
+            # Tables are laid out one at a time, as rows are fetched.
+            doc.build_iter(tablemaker(data, fields, flddef,
+                                      table_widths,
+                                      localizer=loc,
+                                      model=extm,
+                                      styles=ss,
+                                      table_rows=table_rows,
+                                      max_rows=max_rows))
+            size = outfile.tell()
+            outfile.seek(0)
+        except Exception:
+            outfile.close()
+            raise
+        res.app_iter = FileIter(outfile)
+        res.content_length = size
+        return res
+
+
+class RowLimitExceeded(ExportLimitExceeded):
+    pass
+
+
+def tablemaker(data, fields, flddef, col_widths, localizer=None, model=None,
+               styles=None, table_rows=DEFAULT_TABLE_ROWS, max_rows=None):
+    rows = storyteller(data, fields, flddef, styles=styles,
+                       write_header=False)
+    total = 0
+    while True:
+        chunk = list(itertools.islice(rows, max(table_rows, 1)))
+        if len(chunk) == 0:
+            break
+        total += len(chunk)
+        if max_rows and total > max_rows:
+            msg = _('Too many rows to export as PDF, the limit is '
+                    '${max_rows}. Narrow down your filter or use '
+                    'another export format.',
+                    mapping={'max_rows': max_rows})
+            if localizer is None:
+                raise RowLimitExceeded(msg.interpolate())
+            raise RowLimitExceeded(localizer.translate(msg))
+        header = tuple(storyteller((), fields, flddef,
+                                   localizer=localizer,
+                                   model=model,
+                                   styles=styles))
+        table = LongTable(header + tuple(chunk),
+                          colWidths=col_widths,
                           repeatRows=1)
         table.setStyle(DefaultTableStyle())
-        story = [table]
-
-        doc.build(story)
-        return res
+        yield table
 
 
 def storyteller(data, fields, flddef, localizer=None, model=None,
@@ -23,10 +23,13 @@
 from __future__ import (unicode_literals, print_function,
                         absolute_import, division)
 
+import base64
 import binascii
 import importlib
 import inspect
 import ipaddress
+import itertools
+import json
 import logging
 import decimal
 
@@ -61,11 +64,23 @@ from sqlalchemy import (
     UnicodeText,
     VARBINARY,
 
+    and_,
+    false,
     func,
-    or_
+    or_,
+    tuple_
 )
 
 from sqlalchemy.ext.associationproxy import AssociationProxy
+from sqlalchemy.orm import (
+    joinedload,
+    subqueryload
+)
+try:
+    from sqlalchemy.orm import selectinload
+except ImportError:
+    # SQLAlchemy < 1.2
+    selectinload = subqueryload
 from sqlalchemy.orm.interfaces import (
     ONETOMANY,
     MANYTOONE
@@ -103,14 +118,20 @@ from netprofile.db.fields import (
     UInt32,
     UInt64
 )
+from netprofile.common.hooks import IHookManager
+from netprofile.common.jsonutil import json_default
 from netprofile.db.connection import (
     Base,
-    DBSession
+    DBSession,
+    Versioned
 )
+from netprofile.db.util import QueryCounter
 from netprofile.ext.columns import (
     HybridColumn,
     PseudoColumn
 )
+from netprofile.ext import search
+from netprofile.ext.totals import get_total_strategy
 from netprofile.tpl import TemplateObject
 
 _ = TranslationStringFactory('netprofile')
@@ -325,6 +346,41 @@ def _table_to_class(tname):
     raise KeyError(tname)
 
 
+def _has_hook(request, name):
+    hm = request.registry.queryUtility(IHookManager)
+    return hm is not None and name in hm.hooks
+
+
+def _parse_column_param(col, colcls, value):
+    # Timestamps are stored as naive local time.
+    value = col.parse_param(value)
+    if (issubclass(colcls, _DATE_SET)
+            and getattr(value, 'tzinfo', None) is not None):
+        value = value.astimezone(tzlocal()).replace(tzinfo=None)
+    return value
+
+
+def _keyset_after(prop, desc, nullable, value):
+    # Condition for rows sorted strictly after a value, with NULLs last
+    # in ascending order. None means no rows can follow.
+    if value is None:
+        if desc:
+            return prop.isnot(None)
+        return None
+    if desc:
+        return prop < value
+    if nullable:
+        return or_(prop > value, prop.is_(None))
+    return prop > value
+
+
+def _cursor_default(obj):
+    # Keep timestamps naive, so that they round-trip exactly.
+    if isinstance(obj, (dt.datetime, dt.date, dt.time)):
+        return obj.isoformat()
+    return json_default(obj)
+
+
 def _recursive_update(dest, src, loc=None):
     for k, v in src.items():
         if isinstance(v, Mapping):
@@ -369,6 +425,10 @@ def _get_groupby_clause(dialect, gtype, field):
 
 
 class ExtColumn(object):
+    __slots__ = ('column', 'model', 'alias', 'value_attr',
+                 '_js_type', '_column_xtype', '_length',
+                 '_bit_length', '_pixels')
+
     MIN_PIXELS = 40
     MAX_PIXELS = 300
     DEFAULT_PIXELS = 200
@@ -377,6 +437,16 @@ class ExtColumn(object):
         self.column = sqla_column
         self.model = sqla_model
         self.alias = None
+        self.value_attr = None
+        self._init_derived()
+
+    def _init_derived(self):
+        # These depend only on column definition, so compute them once.
+        self._js_type = self._get_js_type()
+        self._column_xtype = self._get_column_xtype()
+        self._length = self._get_length()
+        self._bit_length = self._get_bit_length()
+        self._pixels = self._get_pixels()
 
     @property
     def name(self):
@@ -456,6 +526,9 @@ class ExtColumn(object):
 
     @property
     def length(self):
+        return self._length
+
+    def _get_length(self):
         typecls = self.column.type.__class__
         if typecls is MACAddress:
             return 17
@@ -500,6 +573,9 @@ class ExtColumn(object):
 
     @property
     def pixels(self):
+        return self._pixels
+
+    def _get_pixels(self):
         pix = self.length
         if isinstance(pix, int) and pix > 0:
             pix *= 10
@@ -511,6 +587,9 @@ class ExtColumn(object):
 
     @property
     def bit_length(self):
+        return self._bit_length
+
+    def _get_bit_length(self):
         typecls = self.column.type.__class__
         if issubclass(typecls, (Int8, UInt8)):
             return 8
@@ -541,6 +620,9 @@ class ExtColumn(object):
 
     @property
     def column_xtype(self):
+        return self._column_xtype
+
+    def _get_column_xtype(self):
         cls = self.column.info.get('column_xtype')
         if cls is not None:
             return cls
@@ -561,6 +643,9 @@ class ExtColumn(object):
 
     @property
     def js_type(self):
+        return self._js_type
+
+    def _get_js_type(self):
         if self.multivalue:
             return 'auto'
         cls = self.column.type.__class__
@@ -1134,6 +1219,8 @@ class ExtColumn(object):
 
 
 class ExtPseudoColumn(ExtColumn):
+    __slots__ = ()
+
     @property
     def reader(self):
         return None
@@ -1258,11 +1345,15 @@ class ExtPseudoColumn(ExtColumn):
 
 
 class ExtRelationshipColumn(ExtColumn):
+    __slots__ = ('prop',)
+
     def __init__(self, sqla_prop, sqla_model):
         self.prop = sqla_prop
         self.column = sqla_prop.local_columns.copy().pop()
         self.model = sqla_model
+        self.alias = None
         self.value_attr = None
+        self._init_derived()
 
     @property
     def filter_type(self):
@@ -1283,6 +1374,8 @@ class ExtRelationshipColumn(ExtColumn):
 
 
 class ExtManyToOneRelationshipColumn(ExtRelationshipColumn):
+    __slots__ = ()
+
     @property
     def column_xtype(self):
         return None
@@ -1383,6 +1476,8 @@ class ExtManyToOneRelationshipColumn(ExtRelationshipColumn):
 
 
 class ExtOneToManyRelationshipColumn(ExtRelationshipColumn):
+    __slots__ = ()
+
     @property
     def columns(self):
         return self.prop.info.get('columns', 2)
@@ -1474,9 +1569,51 @@ class ExtOneToManyRelationshipColumn(ExtRelationshipColumn):
         return self.get_related_by_value(param)
 
 
+# Column descriptors are shared between all ExtModel instances wrapping
+# the same SQLAlchemy model.
+_model_descriptors = {}
+
+# Read plan entry kinds.
+_READ_ATTR = 0
+_READ_HYBRID = 1
+_READ_RELATIONSHIP = 2
+_READ_READER = 3
+
+# Record batches of at least this size are written using bulk operations,
+# if model allows it. Models that rely on session flush hooks must set
+# 'bulk_write' to False in their table info.
+_BULK_THRESHOLD = 20
+
+# Maximum number of values in a single IN () clause.
+_IN_BATCH = 500
+
+_EAGER_LOADERS = {
+    'joined':   joinedload,
+    'selectin': selectinload,
+    'subquery': subqueryload
+}
+
+
+def clear_descriptors(models=None):
+    """
+    Drop cached column descriptors of some or all models.
+
+    Needs to be called whenever modules are loaded or unloaded, as
+    models might gain or lose columns and relationships.
+    """
+    if models is None:
+        _model_descriptors.clear()
+        return
+    for model in models:
+        _model_descriptors.pop(model, None)
+
+
 class ExtModel(object):
     def __init__(self, sqla_model):
         self.model = sqla_model
+        self._descr = _model_descriptors.setdefault(sqla_model, {
+            'column': {}
+        })
         self.u_idx = []
         for tbl in sqla_model.__mapper__.tables:
             for idx in tbl.indexes:
@@ -1532,6 +1669,14 @@ class ExtModel(object):
     def default_sort(self):
         return self.model.__table__.info.get('default_sort', ())
 
+    @property
+    def total_strategy(self):
+        return get_total_strategy(self.model.__table__.info)
+
+    @property
+    def rollups(self):
+        return self.model.__table__.info.get('rollups', ())
+
     @property
     def extra_search(self):
         return self.model.__table__.info.get('extra_search', ())
@@ -1624,13 +1769,26 @@ class ExtModel(object):
                      extra, req, self)
         return extra
 
+    def prepare(self):
+        self.get_columns()
+        self.get_read_columns()
+        self.get_form_columns()
+        self._get_read_trans()
+
     def get_column(self, colname):
+        cache = self._descr['column']
+        col = cache.get(colname)
+        if col is None:
+            col = cache[colname] = self._build_column(colname)
+        return col
+
+    def _build_column(self, colname):
         if isinstance(colname, PseudoColumn):
             return ExtPseudoColumn(colname, self.model)
         cols = self.model.__table__.columns
         o_prop = getattr(self.model, colname, None)
         if isinstance(o_prop, AssociationProxy):
-            ret = self.get_column(o_prop.local_attr.key)
+            ret = self._build_column(o_prop.local_attr.key)
             ret.alias = colname
             ret.value_attr = o_prop.value_attr
             return ret
@@ -1655,6 +1813,12 @@ class ExtModel(object):
         raise ValueError('Unknown type of column %s' % colname)
 
     def get_columns(self):
+        cols = self._descr.get('columns')
+        if cols is None:
+            cols = self._descr['columns'] = self._build_columns()
+        return cols
+
+    def _build_columns(self):
         ret = OrderedDict()
         for tbl in self.model.__mapper__.tables:
             for ck in tbl.columns.keys():
@@ -1662,6 +1826,12 @@ class ExtModel(object):
         return ret
 
     def get_read_columns(self):
+        cols = self._descr.get('read_columns')
+        if cols is None:
+            cols = self._descr['read_columns'] = self._build_read_columns()
+        return cols
+
+    def _build_read_columns(self):
         ret = OrderedDict()
         cols = []
         for tbl in self.model.__mapper__.tables:
@@ -1690,6 +1860,12 @@ class ExtModel(object):
         return ret
 
     def get_form_columns(self):
+        cols = self._descr.get('form_columns')
+        if cols is None:
+            cols = self._descr['form_columns'] = self._build_form_columns()
+        return cols
+
+    def _build_form_columns(self):
         ret = OrderedDict()
         fcols = self.form_view
         pk = self.pk
@@ -1809,7 +1985,7 @@ class ExtModel(object):
         return ret
 
     def _apply_pagination(self, query, trans, params):
-        if '__start' in params:
+        if '__start' in params and '__after' not in params:
             val = int(params['__start'])
             if val > 0:
                 query = query.offset(val)
@@ -1834,11 +2010,108 @@ class ExtModel(object):
             query = query.order_by(prop)
         return query
 
-    def _apply_sstr(self, query, trans, params):
+    def _get_keyset(self, trans, params):
+        # Client-supplied or default sort order, with PK as a tie-breaker.
+        # Returns (name, descending, attribute, column, nullable) tuples.
+        # Columns are resolved from the model, as PK might not be among
+        # read columns.
+        slist = params.get('__sort')
+        if not isinstance(slist, list) or len(slist) == 0:
+            slist = self.default_sort
+        keys = []
+        for sdef in slist:
+            if not isinstance(sdef, dict):
+                continue
+            cname = sdef.get('property')
+            if cname not in trans or cname in (k[0] for k in keys):
+                continue
+            keys.append((cname, sdef.get('direction') == 'DESC'))
+        pk = self.pk
+        if pk not in (k[0] for k in keys):
+            keys.append((pk, keys[-1][1] if len(keys) > 0 else False))
+        keyset = []
+        for cname, desc in keys:
+            col = self.get_column(cname)
+            prop = self.model.__mapper__.get_property_by_column(col.column)
+            keyset.append((cname, desc, getattr(self.model, prop.key), col,
+                           bool(col.column.nullable)))
+        return keyset
+
+    def _apply_keyset(self, query, keyset, params):
+        # NULLs are explicitly sorted last in ascending order and first
+        # in descending order, as databases disagree on their placement.
+        for cname, desc, prop, col, nullable in keyset:
+            if nullable:
+                isnull = prop.is_(None)
+                query = query.order_by(isnull.desc() if desc else isnull)
+            query = query.order_by(prop.desc() if desc else prop)
+        cursor = params['__after']
+        if not cursor:
+            return query
+        values = self._decode_cursor(cursor)
+        if len(values) != len(keyset):
+            raise ValueError('Invalid pagination cursor')
+        try:
+            values = [None
+                      if val is None
+                      else _parse_column_param(col, col.column.type.__class__,
+                                               val)
+                      for (cname, desc, prop, col, nullable), val
+                      in zip(keyset, values)]
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError('Invalid pagination cursor')
+        if (len(set(key[1] for key in keyset)) == 1
+                and not any(key[4] for key in keyset)):
+            # Uniform sort direction and no NULLs, use row value comparison.
+            lhs = tuple_(*(key[2] for key in keyset))
+            rhs = tuple_(*values)
+            if keyset[0][1]:
+                return query.filter(lhs < rhs)
+            return query.filter(lhs > rhs)
+        # Expand into (a > x) OR (a = x AND b > y)...
+        cond = []
+        for idx, (cname, desc, prop, col, nullable) in enumerate(keyset):
+            after = _keyset_after(prop, desc, nullable, values[idx])
+            if after is None:
+                continue
+            terms = [keyset[i][2].is_(None)
+                     if values[i] is None
+                     else keyset[i][2] == values[i]
+                     for i in range(idx)]
+            terms.append(after)
+            cond.append(and_(*terms))
+        if len(cond) == 0:
+            return query.filter(false())
+        return query.filter(or_(*cond))
+
+    def _make_cursor(self, obj, keyset):
+        values = [getattr(obj, key[2].key) for key in keyset]
+        data = json.dumps(values, default=_cursor_default,
+                          separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def _decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor.encode())
+            values = json.loads(data.decode())
+        except (AttributeError, TypeError, ValueError, binascii.Error):
+            raise ValueError('Invalid pagination cursor')
+        if not isinstance(values, list):
+            raise ValueError('Invalid pagination cursor')
+        return values
+
+    def _get_sstr_clause(self, trans, sstr):
         fields = self.easy_search
         if len(fields) == 0:
-            return query
-        sstr = params['__sstr']
+            return None
+        if search.is_indexed(self.model):
+            conn = DBSession().connection(mapper=self.model.__mapper__)
+            if search.is_ready(conn, self.model):
+                cond = search.get_search_clause(self.model, sstr)
+                # Search strings without any word characters are not
+                # indexed, look those up in the columns instead.
+                if cond is not None:
+                    return cond
         cond = []
         is_ascii = True
         try:
@@ -1855,7 +2128,13 @@ class ExtModel(object):
                     continue
                 cond.append(col.contains(sstr))
         if len(cond) > 0:
-            query = query.filter(or_(*cond))
+            return or_(*cond)
+        return None
+
+    def _apply_sstr(self, query, trans, params):
+        cond = self._get_sstr_clause(trans, params['__sstr'])
+        if cond is not None:
+            query = query.filter(cond)
         return query
 
     def _apply_xfilters(self, query, params, pname='__xfilter'):
@@ -1868,82 +2147,107 @@ class ExtModel(object):
                 query = xf.process(self.model, query, flist[xf.name])
         return query
 
-    def _apply_filters(self, query, trans, params, pname='__filter'):
-        flist = params[pname]
+    def _get_filter_clauses(self, cols, trans, flist, colmap=None):
+        clauses = []
         for fltr in flist:
             fcol = fltr.get('property', None)
             operator = fltr.get('operator', 'eq')
             value = fltr.get('value', None)
-            if fcol in trans:
-                prop = trans[fcol]
-                coldef = self.model.__mapper__.c[prop.key]
-                colcls = coldef.type.__class__
+            if fcol not in trans:
+                continue
+            prop = trans[fcol]
+            coldef = self.model.__mapper__.c[prop.key]
+            colcls = coldef.type.__class__
+            if colmap is None:
                 col = getattr(self.model, prop.key)
-                extcol = self.get_column(fcol)
+            else:
+                col = colmap[prop.key]
+
+            if isinstance(value, list):
+                if operator == 'in':
+                    clauses.append(col.in_(value))
+                elif operator == 'notin':
+                    clauses.append(~col.in_(value))
+                # FIXME: parse_param chokes on list values
+                continue
 
-                if isinstance(value, list):
-                    if operator == 'in':
-                        query = query.filter(col.in_(value))
-                        continue
-                    if operator == 'notin':
-                        query = query.filter(not col.in_(value))
-                        continue
-                    # FIXME: parse_param chokes on list values
-                    continue
+            value = _parse_column_param(cols[fcol], colcls, value)
+            if operator in ('eq', '=', '==', '==='):
+                clauses.append(col == value)
+                continue
+            if operator in ('ne', '!=', '!=='):
+                clauses.append(col != value)
+                continue
+            if value is None:
+                continue
+            if (issubclass(colcls, _DATE_SET)
+                    or issubclass(colcls, _INTEGER_SET)
+                    or issubclass(colcls, _DECIMAL_SET)
+                    or issubclass(colcls, _IPADDR_SET)):
+                if operator in ('gt', '>'):
+                    clauses.append(col > value)
+                elif operator in ('lt', '<'):
+                    clauses.append(col < value)
+                elif operator in ('ge', '>='):
+                    clauses.append(col >= value)
+                elif operator in ('le', '<='):
+                    clauses.append(col <= value)
+                continue
+            if issubclass(colcls, _STRING_SET):
+                if operator in ('contains', 'like'):
+                    clauses.append(col.contains(value))
+                elif operator in ('ncontains', 'notlike'):
+                    clauses.append(~col.contains(value))
+                elif operator == 'startswith':
+                    clauses.append(col.startswith(value))
+                elif operator == 'nstartswith':
+                    clauses.append(~col.startswith(value))
+                elif operator == 'endswith':
+                    clauses.append(col.endswith(value))
+                elif operator == 'nendswith':
+                    clauses.append(~col.endswith(value))
+        return clauses
 
-                value = extcol.parse_param(value)
-                if operator in ('eq', '=', '==', '==='):
-                    query = query.filter(col == value)
-                    continue
-                if operator in ('ne', '!=', '!=='):
-                    query = query.filter(col != value)
-                    continue
-                if issubclass(colcls, _DATE_SET):
-                    if value.tzinfo is not None:
-                        value = value.astimezone(tzlocal())
-                    if value is None:
-                        continue
-                    if operator in ('gt', '>'):
-                        query = query.filter(col > value)
-                    if operator in ('lt', '<'):
-                        query = query.filter(col < value)
-                    if operator in ('ge', '>='):
-                        query = query.filter(col >= value)
-                    if operator in ('le', '<='):
-                        query = query.filter(col <= value)
-                    continue
-                if (issubclass(colcls, _INTEGER_SET)
-                        or issubclass(colcls, _DECIMAL_SET)
-                        or issubclass(colcls, _IPADDR_SET)):
-                    if value is None:
-                        continue
-                    if operator in ('gt', '>'):
-                        query = query.filter(col > value)
-                    if operator in ('lt', '<'):
-                        query = query.filter(col < value)
-                    if operator in ('ge', '>='):
-                        query = query.filter(col >= value)
-                    if operator in ('le', '<='):
-                        query = query.filter(col <= value)
-                    continue
-                if issubclass(colcls, _STRING_SET):
-                    if value is None:
-                        continue
-                    if operator in ('contains', 'like'):
-                        query = query.filter(col.contains(value))
-                    if operator in ('ncontains', 'notlike'):
-                        query = query.filter(not col.contains(value))
-                    if operator == 'startswith':
-                        query = query.filter(col.startswith(value))
-                    if operator == 'nstartswith':
-                        query = query.filter(not col.startswith(value))
-                    if operator == 'endswith':
-                        query = query.filter(col.endswith(value))
-                    if operator == 'nendswith':
-                        query = query.filter(not col.endswith(value))
-                    continue
+    def _apply_filters(self, query, trans, params, pname='__filter'):
+        clauses = self._get_filter_clauses(self.get_read_columns(), trans,
+                                           params[pname])
+        if len(clauses) > 0:
+            query = query.filter(*clauses)
+        return query
+
+    def _compile_filters(self, cols, trans, params):
+        # Build filtering predicates once, so that they can be shared
+        # between count and data queries.
+        clauses = []
+        for pname in ('__ffilter', '__filter'):
+            if pname in params:
+                clauses.extend(self._get_filter_clauses(cols, trans,
+                                                        params[pname]))
+        if '__sstr' in params:
+            cond = self._get_sstr_clause(trans, params['__sstr'])
+            if cond is not None:
+                clauses.append(cond)
+        return clauses
+
+    def _apply_compiled_filters(self, query, clauses, params):
+        if len(clauses) > 0:
+            query = query.filter(*clauses)
+        # Extra search filters can add joins, so they are applied
+        # to each query separately.
+        if '__xfilter' in params:
+            query = self._apply_xfilters(query, params)
         return query
 
+    def get_filtered_query(self, sess, params, *entities):
+        """
+        Get query for arbitrary entities over rows that match filters
+        in API call parameters.
+        """
+        clauses = self._compile_filters(self.get_read_columns(),
+                                        self._get_read_trans(), params)
+        q = sess.query(*entities).select_from(self.model)
+        return self._apply_compiled_filters(q, clauses, params)
+
     def _get_trans(self, cols):
         trans = {}
         for cname, col in cols.items():
@@ -1953,116 +2257,297 @@ class ExtModel(object):
                     col.column)
         return trans
 
+    def _get_read_trans(self):
+        trans = self._descr.get('read_trans')
+        if trans is None:
+            trans = self._descr['read_trans'] = self._get_trans(
+                    self.get_read_columns())
+        return trans
+
+    def _get_read_caps(self):
+        caps = self._descr.get('read_caps')
+        if caps is None:
+            caps = set()
+            for col in self.get_read_columns().values():
+                if not col.secret_value and col.read_cap:
+                    caps.add(col.read_cap)
+            caps = self._descr['read_caps'] = tuple(sorted(caps))
+        return caps
+
+    def _get_read_plan(self, request, fields=None):
+        # Plans only depend on which column read privileges the user holds,
+        # so they are cached per model and privilege set.
+        granted = frozenset(cap
+                            for cap in self._get_read_caps()
+                            if request.has_permission(cap))
+        if fields is not None:
+            return self._build_read_plan(granted, fields)
+        plans = self._descr.setdefault('read_plans', {})
+        plan = plans.get(granted)
+        if plan is None:
+            plan = plans[granted] = self._build_read_plan(granted)
+        return plan
+
+    def _build_read_plan(self, granted, fields=None):
+        trans = self._get_read_trans()
+        plan = []
+        for cname, col in self.get_read_columns().items():
+            if col.secret_value:
+                continue
+            cap = col.read_cap
+            if cap and cap not in granted:
+                continue
+            if isinstance(cname, PseudoColumn):
+                if isinstance(cname, HybridColumn):
+                    if fields is None or cname.name in fields:
+                        plan.append((_READ_HYBRID, cname.name, None))
+                continue
+            if fields is not None and cname not in fields:
+                continue
+            prop = trans[cname]
+            if prop.deferred:
+                continue
+            if isinstance(col, ExtRelationshipColumn):
+                plan.append((_READ_RELATIONSHIP, cname, col))
+            elif col.reader:
+                plan.append((_READ_READER, cname, col))
+            else:
+                plan.append((_READ_ATTR, cname, prop.key))
+        return tuple(plan)
+
+    def _can_read_columnar(self, plan, fields, request):
+        if fields is None or '__str__' in fields or len(plan) == 0:
+            return False
+        if self.is_polymorphic or len(self.extra_data) > 0:
+            return False
+        if any(kind != _READ_ATTR for kind, cname, arg in plan):
+            return False
+        # Model query helpers might rely on full ORM entities.
+        for helper in ('__augment_query__',
+                       '__augment_pg_query__',
+                       '__augment_result__'):
+            if callable(getattr(self.model, helper, None)):
+                return False
+        return not _has_hook(request, 'np.object.read')
+
+    def _get_eager_options(self, plan, streaming=False):
+        # Per-model overrides: False disables eager loading altogether,
+        # a mapping of relationship name to loader strategy ('joined',
+        # 'selectin', 'subquery' or None for lazy) overrides the defaults.
+        # Streaming queries can't use subquery or joined loading of
+        # collections, so selectin is used for those.
+        override = self.model.__table__.info.get('eager_load', {})
+        if override is False:
+            return ()
+        mapper = self.model.__mapper__
+        opts = []
+        for kind, cname, col in plan:
+            if kind != _READ_RELATIONSHIP:
+                continue
+            key = col.prop.key
+            if not mapper.has_property(key):
+                continue
+            if key in override:
+                strategy = override[key]
+            elif isinstance(col, ExtManyToOneRelationshipColumn):
+                strategy = 'joined'
+            else:
+                strategy = 'selectin'
+            if (streaming
+                    and strategy is not None
+                    and (strategy == 'subquery'
+                         or not isinstance(
+                                col, ExtManyToOneRelationshipColumn))):
+                strategy = 'selectin'
+            loader = _EAGER_LOADERS.get(strategy)
+            if loader is not None:
+                opts.append(loader(getattr(self.model, key)))
+        return opts
+
+    def _augment_read_query(self, sess, q, trans, plan, columnar,
+                            params, request, streaming=False):
+        if not columnar:
+            opts = self._get_eager_options(plan, streaming)
+            if len(opts) > 0:
+                q = q.options(*opts)
+        helper = getattr(self.model, '__augment_query__', None)
+        if callable(helper):
+            q = helper(sess, q, params, request)
+        q = self._apply_pagination(q, trans, params)
+        helper = getattr(self.model, '__augment_pg_query__', None)
+        if callable(helper):
+            q = helper(sess, q, params, request)
+        return q
+
+    def _make_row(self, obj, plan, with_str, params, request):
+        obj.__req__ = request
+        row = {}
+        for kind, cname, arg in plan:
+            if kind == _READ_ATTR:
+                row[cname] = getattr(obj, arg)
+            elif kind == _READ_RELATIONSHIP:
+                extra = arg.append_data(obj)
+                if extra is not None:
+                    row.update(extra)
+            elif kind == _READ_HYBRID:
+                row[cname] = getattr(obj, cname)
+            else:
+                reader = getattr(obj, arg.reader, None)
+                if callable(reader):
+                    if arg.pass_request:
+                        row[cname] = reader(params, request)
+                    else:
+                        row[cname] = reader(params)
+                else:
+                    row[cname] = reader
+        if with_str:
+            row['__str__'] = str(obj)
+        if self.is_polymorphic:
+            row['__poly'] = (obj.__class__.__moddef__,
+                             obj.__class__.__name__)
+        for extra in self.extra_data:
+            edata = getattr(obj, extra, None)
+            if callable(edata):
+                row[extra] = edata(request)
+            else:
+                row[extra] = edata
+        request.run_hook('np.object.read', obj, row, params, request, self)
+        return row
+
     def read(self, params, request):
         logger.debug('Running API call, class:%s method:read params:%r',
                      self.name, params)
         res = {
-            'records': [],
-            'success': True,
-            'total':   0
+            'records':     [],
+            'success':     True,
+            'total':       0,
+            'total_exact': True
         }
         records = []
         tot = 0
         cols = self.get_read_columns()
-        trans = self._get_trans(cols)
+        trans = self._get_read_trans()
+        clauses = self._compile_filters(cols, trans, params)
+        fields = params.get('__fields')
+        if isinstance(fields, list):
+            fields = frozenset(fields)
+        else:
+            fields = None
+        plan = self._get_read_plan(request, fields)
+        columnar = self._can_read_columnar(plan, fields, request)
         sess = DBSession()
-        # Cache total?
+        counter = None
+        if logger.isEnabledFor(logging.DEBUG):
+            counter = QueryCounter(sess.connection(
+                mapper=self.model.__mapper__)).start()
         q = sess.query(func.count('*')).select_from(self.model)
-        if '__ffilter' in params:
-            q = self._apply_filters(q, trans, params, pname='__ffilter')
-        if '__filter' in params:
-            q = self._apply_filters(q, trans, params)
-        if '__xfilter' in params:
-            q = self._apply_xfilters(q, params)
-        if '__sstr' in params:
-            q = self._apply_sstr(q, trans, params)
-        tot = q.scalar()
+        q = self._apply_compiled_filters(q, clauses, params)
+        tot, tot_exact = self.total_strategy.get_total(self, q, params)
         q = sess.query(self.model)
-        if '__ffilter' in params:
-            q = self._apply_filters(q, trans, params, pname='__ffilter')
-        if '__filter' in params:
-            q = self._apply_filters(q, trans, params)
-        if '__xfilter' in params:
-            q = self._apply_xfilters(q, params)
-        if '__sstr' in params:
-            q = self._apply_sstr(q, trans, params)
-        if '__sort' in params:
+        q = self._apply_compiled_filters(q, clauses, params)
+        keyset = None
+        if '__after' in params:
+            keyset = self._get_keyset(trans, params)
+            q = self._apply_keyset(q, keyset, params)
+        elif '__sort' in params:
             q = self._apply_sorting(q, trans, params)
-        helper = getattr(self.model, '__augment_query__', None)
-        if callable(helper):
-            q = helper(sess, q, params, request)
-        q = self._apply_pagination(q, trans, params)
-        helper = getattr(self.model, '__augment_pg_query__', None)
-        if callable(helper):
-            q = helper(sess, q, params, request)
+        q = self._augment_read_query(sess, q, trans, plan, columnar,
+                                     params, request)
         helper = getattr(self.model, '__augment_result__', None)
         if callable(helper):
             q = helper(sess, q.all(), params, request)
         if params.get('__empty', False):
             row = {}
-            for cname, col in cols.items():
-                if isinstance(cname, PseudoColumn):
-                    if col.get_secret_value(request):
-                        continue
-                    if isinstance(cname, HybridColumn):
-                        row[cname.name] = None
-                    continue
-                if col.get_secret_value(request):
-                    continue
-                if trans[cname].deferred:
-                    continue
-                if isinstance(col, ExtRelationshipColumn):
-                    continue
-                row[cname] = ''
+            for kind, cname, arg in plan:
+                if kind == _READ_HYBRID:
+                    row[cname] = None
+                elif kind != _READ_RELATIONSHIP:
+                    row[cname] = ''
             row['__str__'] = ''
             records.append(row)
-        for obj in q:
-            obj.__req__ = request
-            row = {}
-            for cname, col in cols.items():
-                if isinstance(cname, PseudoColumn):
-                    if col.get_secret_value(request):
-                        continue
-                    if isinstance(cname, HybridColumn):
-                        row[cname.name] = getattr(obj, cname.name)
-                    continue
-                if col.get_secret_value(request):
-                    continue
-                if trans[cname].deferred:
-                    continue
-                if isinstance(col, ExtRelationshipColumn):
-                    extra = col.append_data(obj)
-                    if extra is not None:
-                        row.update(extra)
-                else:
-                    reader = col.reader
-                    if reader:
-                        reader = getattr(obj, reader, None)
-                        if callable(reader):
-                            if col.pass_request:
-                                row[cname] = reader(params, request)
-                            else:
-                                row[cname] = reader(params)
-                        else:
-                            row[cname] = reader
-                    else:
-                        row[cname] = getattr(obj, trans[cname].key)
-            row['__str__'] = str(obj)
-            if self.is_polymorphic:
-                row['__poly'] = (obj.__class__.__moddef__,
-                                 obj.__class__.__name__)
-            for extra in self.extra_data:
-                edata = getattr(obj, extra, None)
-                if callable(edata):
-                    row[extra] = edata(request)
-                else:
-                    row[extra] = edata
-            request.run_hook('np.object.read', obj, row, params, request, self)
-            records.append(row)
+        last_obj = None
+        num_objs = 0
+        if columnar:
+            # Fetch plain column tuples, skipping ORM object hydration.
+            ents = [getattr(self.model, arg) for kind, cname, arg in plan]
+            if keyset is not None:
+                ents.extend(key[2] for key in keyset)
+            names = tuple(cname for kind, cname, arg in plan)
+            for obj in q.with_entities(*ents):
+                records.append(dict(zip(names, obj)))
+                last_obj = obj
+                num_objs += 1
+        else:
+            with_str = fields is None or '__str__' in fields
+            for obj in q:
+                records.append(self._make_row(obj, plan, with_str,
+                                              params, request))
+                last_obj = obj
+                num_objs += 1
         res['records'] = records
         res['total'] = tot
+        res['total_exact'] = tot_exact
+        if keyset is not None:
+            res['after'] = None
+            limit = int(params.get('__limit', 0))
+            if num_objs > 0 and num_objs == limit:
+                res['after'] = self._make_cursor(last_obj, keyset)
+        if counter is not None:
+            logger.debug('API call class:%s method:read returned %d rows '
+                         'using %d queries',
+                         self.name, num_objs, counter.stop())
         return res
 
+    def iter_read(self, params, request, batch=500, sess=None):
+        # Streaming variant of read(), for server-side consumers. Rows are
+        # fetched in batches using server-side cursors where supported.
+        # Keyset pagination and totals are not supported.
+        # Privilege checks, filter compilation and the first fetch are
+        # done right away, so that errors surface before any output is
+        # sent. Only the conversion of rows is deferred.
+        cols = self.get_read_columns()
+        trans = self._get_read_trans()
+        clauses = self._compile_filters(cols, trans, params)
+        fields = params.get('__fields')
+        if isinstance(fields, list):
+            fields = frozenset(fields)
+        else:
+            fields = None
+        plan = self._get_read_plan(request, fields)
+        columnar = self._can_read_columnar(plan, fields, request)
+        if sess is None:
+            sess = DBSession()
+        q = sess.query(self.model)
+        q = self._apply_compiled_filters(q, clauses, params)
+        if '__sort' in params:
+            q = self._apply_sorting(q, trans, params)
+        q = self._augment_read_query(sess, q, trans, plan, columnar,
+                                     params, request, streaming=True)
+        helper = getattr(self.model, '__augment_result__', None)
+        names = None
+        if callable(helper):
+            columnar = False
+            q = helper(sess, q.all(), params, request)
+        elif columnar:
+            ents = [getattr(self.model, arg) for kind, cname, arg in plan]
+            names = tuple(cname for kind, cname, arg in plan)
+            q = q.with_entities(*ents).yield_per(batch)
+        else:
+            q = q.yield_per(batch)
+        objs = iter(q)
+        first = list(itertools.islice(objs, batch))
+        with_str = fields is None or '__str__' in fields
+        return self._iter_rows(itertools.chain(first, objs), plan, names,
+                               with_str, params, request)
+
+    def _iter_rows(self, objs, plan, names, with_str, params, request):
+        if names is not None:
+            for obj in objs:
+                yield dict(zip(names, obj))
+            return
+        for obj in objs:
+            yield self._make_row(obj, plan, with_str, params, request)
+
     def read_one(self, params, request):
         logger.debug('Running API call, class:%s method:read_one params:%r',
                      self.name, params)
@@ -2070,9 +2555,9 @@ class ExtModel(object):
 
     def set_values(self, obj, values, request, is_create=False):
         obj.__req__ = request
-        cols = self.get_columns()
+        cols = OrderedDict(self.get_columns())
         rcols = self.get_read_columns()
-        trans = self._get_trans(rcols)
+        trans = self._get_read_trans()
         helper = None
         if is_create:
             helper = getattr(self.model, '__augment_create__', None)
@@ -2117,11 +2602,17 @@ class ExtModel(object):
             'success': True,
             'total':   0
         }
-        cols = self.get_columns()
+        cols = OrderedDict(self.get_columns())
         rcols = self.get_read_columns()
-        trans = self._get_trans(rcols)
+        trans = self._get_read_trans()
 
         sess = DBSession()
+        if self._can_bulk_write(params['records'], request,
+                                'np.object.create'):
+            failed = self._check_records(params['records'], request)
+            if failed is not None:
+                return failed
+            return self._bulk_create(sess, params['records'], request)
 
         for pt in params['records']:
             p = self.pk
@@ -2232,16 +2723,28 @@ class ExtModel(object):
             'success': True,
             'total':   0
         }
-        cols = self.get_columns()
+        cols = OrderedDict(self.get_columns())
         rcols = self.get_read_columns()
-        trans = self._get_trans(rcols)
+        trans = self._get_read_trans()
 
         sess = DBSession()
-
-        for pt in params['records']:
-            if self.pk not in pt:
-                raise Exception('Can\'t find primary key in record parameters')
-            obj = sess.query(self.model).get(pt[self.pk])
+        bulk = self._can_bulk_write(params['records'], request,
+                                    'np.object.update')
+        if bulk:
+            ids = self._get_record_ids(params['records'])
+            objs = self._get_existing_ids(sess, ids)
+            failed = self._check_records(params['records'], request,
+                                         ids, objs)
+            if failed is not None:
+                return failed
+            return self._bulk_update(sess, params['records'], request, ids)
+
+        ids, objs = self._get_objects(sess, params['records'])
+        for pkey, pt in zip(ids, params['records']):
+            obj = objs.get(pkey)
+            if obj is None:
+                raise Exception('Can\'t find object with primary key %r' %
+                                (pkey,))
             obj.__req__ = request
             helper = getattr(self.model, '__augment_update__', None)
             if callable(helper) and not helper(sess, obj, pt, request):
@@ -2324,10 +2827,15 @@ class ExtModel(object):
             'total':   0
         }
         sess = DBSession()
-        for pt in params['records']:
-            if self.pk not in pt:
-                raise Exception('Can\'t find primary key in record parameters')
-            obj = sess.query(self.model).get(pt[self.pk])
+        if self._can_bulk_delete(params['records'], request):
+            return self._bulk_delete(sess, params['records'], request)
+
+        ids, objs = self._get_objects(sess, params['records'])
+        for pkey, pt in zip(ids, params['records']):
+            obj = objs.get(pkey)
+            if obj is None:
+                raise Exception('Can\'t find object with primary key %r' %
+                                (pkey,))
             obj.__req__ = request
             helper = getattr(self.model, '__augment_delete__', None)
             if callable(helper) and not helper(sess, obj, pt, request):
@@ -2337,6 +2845,217 @@ class ExtModel(object):
             request.run_hook('np.object.delete', res, obj, pt, request, self)
         return res
 
+    def _get_record_ids(self, records):
+        pkcol = self.get_column(self.pk)
+        ids = []
+        for pt in records:
+            if self.pk not in pt:
+                raise Exception('Can\'t find primary key in record parameters')
+            ids.append(pkcol.parse_param(pt[self.pk]))
+        return ids
+
+    def _get_objects(self, sess, records):
+        ids = self._get_record_ids(records)
+        prop = getattr(self.model, self.object_pk)
+        objs = {}
+        for idx in range(0, len(ids), _IN_BATCH):
+            for obj in sess.query(self.model).filter(
+                    prop.in_(ids[idx:idx + _IN_BATCH])):
+                objs[getattr(obj, self.object_pk)] = obj
+        return ids, objs
+
+    def _get_existing_ids(self, sess, ids):
+        prop = getattr(self.model, self.object_pk)
+        found = set()
+        for idx in range(0, len(ids), _IN_BATCH):
+            found.update(row[0] for row in sess.query(prop).filter(
+                    prop.in_(ids[idx:idx + _IN_BATCH])))
+        return found
+
+    def _can_bulk_write(self, records, request, hook):
+        if len(records) < _BULK_THRESHOLD:
+            return False
+        model = self.model
+        if (not model.__table__.info.get('bulk_write', True)
+                or self.is_polymorphic
+                or issubclass(model, Versioned)
+                or search.is_indexed(model)):
+            return False
+        for helper in ('__augment_create__', '__augment_update__'):
+            if callable(getattr(model, helper, None)):
+                return False
+        dispatch = model.__mapper__.dispatch
+        if (dispatch.before_insert or dispatch.after_insert
+                or dispatch.before_update or dispatch.after_update):
+            return False
+        if (_has_hook(request, hook)
+                or _has_hook(request, 'np.object.set_values')):
+            return False
+        rcols = self.get_read_columns()
+        for name, col in self.get_columns().items():
+            if col.writer:
+                return False
+        for pt in records:
+            for p in pt:
+                if (p in rcols
+                        and isinstance(rcols[p],
+                                       ExtOneToManyRelationshipColumn)):
+                    return False
+        return True
+
+    def _can_bulk_delete(self, records, request):
+        if len(records) < _BULK_THRESHOLD:
+            return False
+        model = self.model
+        if (not model.__table__.info.get('bulk_write', True)
+                or self.is_polymorphic
+                or issubclass(model, Versioned)
+                or callable(getattr(model, '__augment_delete__', None))
+                or _has_hook(request, 'np.object.delete')):
+            return False
+        mapper = model.__mapper__
+        if mapper.dispatch.before_delete or mapper.dispatch.after_delete:
+            return False
+        for rel in mapper.relationships:
+            if rel.cascade.delete:
+                return False
+        return True
+
+    def _get_mapping(self, values, request):
+        cols = self.get_columns()
+        trans = self._get_read_trans()
+        mapping = {}
+        for p, val in values.items():
+            if p in (self.pk, self.object_pk) or p not in cols:
+                continue
+            col = cols[p]
+            if col.get_read_only(request):
+                continue
+            val = col.parse_param(val)
+            choices = col.get_choices(request)
+            if choices and val not in choices:
+                continue
+            mapping[trans[p].key] = val
+        return mapping
+
+    def _read_records(self, ids, request):
+        rows = {}
+        for idx in range(0, len(ids), _IN_BATCH):
+            res = self.read({'__filter': [{
+                'property': self.pk,
+                'operator': 'in',
+                'value':    ids[idx:idx + _IN_BATCH]
+            }]}, request)
+            for row in res['records']:
+                rows[row[self.pk]] = row
+        return rows
+
+    def _make_error(self, values, errors):
+        err = {'errors': errors}
+        for p in ('_clid', self.pk):
+            if p in values:
+                err[p] = values[p]
+        return err
+
+    def _check_records(self, records, request, pkeys=None, found=None):
+        # Batches are written all-or-nothing. Returns failed API call
+        # result if any of the records doesn't pass validation, or
+        # refers to a missing object.
+        loc = request.localizer
+        errors = []
+        for idx, verr in enumerate(self._validate_batch(records, request,
+                                                        pkeys)):
+            values = records[idx]
+            if found is not None and pkeys[idx] not in found:
+                verr[self.pk] = [loc.translate(_('Object not found.'))]
+            if verr:
+                errors.append(self._make_error(values, verr))
+        if len(errors) == 0:
+            return None
+        return {
+            'records': [],
+            'success': False,
+            'total':   0,
+            'errors':  errors
+        }
+
+    def _bulk_create(self, sess, records, request):
+        res = {
+            'records': [],
+            'success': True,
+            'total':   0
+        }
+        mappings = []
+        clids = []
+        for values in records:
+            mappings.append(self._get_mapping(values, request))
+            clids.append(values.get('_clid'))
+        if len(mappings) > 0:
+            sess.bulk_insert_mappings(self.model, mappings,
+                                      return_defaults=True)
+        ids = [mapping[self.object_pk] for mapping in mappings]
+        rows = self._read_records(ids, request)
+        for pkey, clid in zip(ids, clids):
+            row = rows.get(pkey)
+            if row is None:
+                continue
+            if clid is not None:
+                row['_clid'] = clid
+            res['records'].append(row)
+            res['total'] += 1
+        return res
+
+    def _bulk_update(self, sess, records, request, ids):
+        res = {
+            'records': [],
+            'success': True,
+            'total':   0
+        }
+        mappings = []
+        for pkey, values in zip(ids, records):
+            mapping = self._get_mapping(values, request)
+            mapping[self.object_pk] = pkey
+            mappings.append(mapping)
+        if len(mappings) > 0:
+            sess.bulk_update_mappings(self.model, mappings)
+            self._detach_objects(sess, (mapping[self.object_pk]
+                                        for mapping in mappings))
+        rows = self._read_records([m[self.object_pk] for m in mappings],
+                                  request)
+        for mapping in mappings:
+            row = rows.get(mapping[self.object_pk])
+            if row is None:
+                continue
+            res['records'].append(row)
+            res['total'] += 1
+        return res
+
+    def _bulk_delete(self, sess, records, request):
+        res = {
+            'success': True,
+            'total':   0
+        }
+        ids = self._get_record_ids(records)
+        prop = getattr(self.model, self.object_pk)
+        for idx in range(0, len(ids), _IN_BATCH):
+            res['total'] += sess.query(self.model).filter(
+                    prop.in_(ids[idx:idx + _IN_BATCH])).delete(
+                            synchronize_session=False)
+        self._detach_objects(sess, ids, True)
+        return res
+
+    def _detach_objects(self, sess, ids, expunge=False):
+        # Bulk operations bypass the session, so objects already present
+        # in the identity map would be stale.
+        ids = set(ids)
+        for obj in list(sess.identity_map.values()):
+            if (isinstance(obj, self.model)
+                    and getattr(obj, self.object_pk) in ids):
+                if expunge:
+                    sess.expunge(obj)
+                else:
+                    sess.expire(obj)
+
     def get_fields(self, request):
         logger.debug('Running API call, class:%s method:get_fields', self.name)
         fields = []
@@ -2421,6 +3140,69 @@ class ExtModel(object):
             'errors':  fields
         }
 
+    def _validate_batch(self, records, request, pkeys=None):
+        # Same checks as validate_fields(), but unique indexes are checked
+        # for the whole batch at once.
+        loc = request.localizer
+        cols = self.get_columns()
+        trans = self._get_trans(cols)
+        sess = DBSession()
+        if pkeys is None:
+            pkeys = [None] * len(records)
+        errors = [defaultdict(list) for values in records]
+        for values, fields in zip(records, errors):
+            for name, col in cols.items():
+                valid = col.validator
+                if callable(valid) and name in values:
+                    vres = valid(self, name, values, request)
+                    if vres:
+                        if isinstance(vres, Iterable):
+                            fields[name].extend(vres)
+                        else:
+                            fields[name].append(vres)
+        for index in self.u_idx:
+            if any(ifld not in cols or ifld not in trans for ifld in index):
+                continue
+            keys = defaultdict(list)
+            for idx, values in enumerate(records):
+                has_all = True
+                has_defined = False
+                for ifld in index:
+                    colval = values.get(ifld)
+                    if colval is not None:
+                        has_defined = True
+                    elif not cols[ifld].nullable:
+                        has_all = False
+                        break
+                if not has_all or not has_defined:
+                    continue
+                keys[tuple(cols[ifld].parse_param(values.get(ifld))
+                           for ifld in index)].append(idx)
+            dupes = set()
+            for key, idxs in keys.items():
+                if len(idxs) > 1:
+                    dupes.update(idxs)
+            props = [getattr(self.model, trans[ifld].key) for ifld in index]
+            pkprop = getattr(self.model, self.object_pk)
+            klist = list(keys)
+            for kidx in range(0, len(klist), _IN_BATCH):
+                cond = or_(*(and_(*(prop == val
+                                    for prop, val
+                                    in zip(props, key)))
+                             for key in klist[kidx:kidx + _IN_BATCH]))
+                for row in sess.query(pkprop, *props).filter(cond):
+                    for idx in keys.get(tuple(row[1:]), ()):
+                        if pkeys[idx] != row[0]:
+                            dupes.add(idx)
+            for idx in dupes:
+                for ifld in index:
+                    errors[idx][ifld].append(
+                            loc.translate(_('This field must be unique.')))
+        for values, fields in zip(records, errors):
+            request.run_hook('np.fields.validate', fields, values,
+                             request, self)
+        return [dict(fields) for fields in errors]
+
     def get_create_wizard(self, request):
         logger.debug('Running API call, class:%s method:get_create_wizard',
                      self.name)
@@ -2551,22 +3333,40 @@ class ExtModel(object):
         if callable(dpview):
             return dpview(self, req)
 
-    def report(self, params, request):
-        logger.debug('Running API call, class:%s method:report params:%r',
-                     self.name, params)
-        res = {
-            'records': [],
-            'success': True,
-            'total':   0
-        }
+    def _get_having_clauses(self, aggregates, flist):
+        clauses = []
+        for fltr in flist:
+            expr = aggregates.get(fltr.get('property', None))
+            if expr is None:
+                continue
+            operator = fltr.get('operator', 'eq')
+            value = fltr.get('value', None)
+            if operator in ('eq', '=', '==', '==='):
+                clauses.append(expr == value)
+                continue
+            if operator in ('ne', '!=', '!=='):
+                clauses.append(expr != value)
+                continue
+            if value is None:
+                continue
+            if operator in ('gt', '>'):
+                clauses.append(expr > value)
+            elif operator in ('lt', '<'):
+                clauses.append(expr < value)
+            elif operator in ('ge', '>='):
+                clauses.append(expr >= value)
+            elif operator in ('le', '<='):
+                clauses.append(expr <= value)
+        return clauses
+
+    def _get_raw_report_query(self, sess, params):
         q_colnames = []
         q_columns = []
+        q_labels = {}
+        q_aggregates = {}
         q_groupby = []
-        records = []
-        tot = 0
         cols = self.get_read_columns()
-        trans = self._get_trans(cols)
-        sess = DBSession()
+        trans = self._get_read_trans()
         engine = sess.get_bind(self.model)
 
         if '__aggregates' in params:
@@ -2574,61 +3374,125 @@ class ExtModel(object):
                 if qcol[1] not in trans:
                     continue
                 prop = getattr(self.model, trans[qcol[1]].key)
+                label = _get_aggregate_column(engine.dialect,
+                                              qcol[0], prop, qcol[2])
                 q_colnames.append(qcol[2])
-                q_columns.append(_get_aggregate_column(engine.dialect,
-                                                       qcol[0],
-                                                       prop, qcol[2]))
+                q_columns.append(label)
+                q_labels[qcol[2]] = label
+                q_aggregates[qcol[2]] = label.element
         if len(q_columns) == 0:
+            label = func.count('*').label('cnt')
             q_colnames.append('cnt')
-            q_columns.append(func.count('*').label('cnt'))
+            q_columns.append(label)
+            q_labels['cnt'] = label
+            q_aggregates['cnt'] = label.element
         if '__groupby' in params:
             for gbcol in params['__groupby']:
                 if isinstance(gbcol, str):
                     if gbcol not in trans:
                         continue
                     prop = getattr(self.model, trans[gbcol].key)
-                    q_colnames.append(gbcol)
-                    q_columns.append(prop.label(gbcol))
-                    q_groupby.append(prop)
-                    continue
-                if gbcol[1] not in trans:
-                    continue
-                prop = getattr(self.model, trans[gbcol[1]].key)
-                colname = '_'.join((gbcol[1], gbcol[0]))
+                    colname = gbcol
+                else:
+                    if gbcol[1] not in trans:
+                        continue
+                    prop = _get_groupby_clause(
+                            engine.dialect, gbcol[0],
+                            getattr(self.model, trans[gbcol[1]].key))
+                    colname = '_'.join((gbcol[1], gbcol[0]))
+                label = prop.label(colname)
                 q_colnames.append(colname)
-                q_columns.append(_get_groupby_clause(engine.dialect,
-                                                     gbcol[0],
-                                                     prop).label(colname))
-                q_groupby.append(_get_groupby_clause(engine.dialect,
-                                                     gbcol[0], prop))
+                q_columns.append(label)
+                q_labels[colname] = label
+                q_groupby.append(prop)
 
         q = sess.query(*q_columns).select_from(self.model)
-        if '__ffilter' in params:
-            q = self._apply_filters(q, trans, params, pname='__ffilter')
-        if '__filter' in params:
-            q = self._apply_filters(q, trans, params)
-        if '__xfilter' in params:
-            q = self._apply_xfilters(q, params)
-        if '__sstr' in params:
-            q = self._apply_sstr(q, trans, params)
-        # TODO: __sort
+        q = self._apply_compiled_filters(
+                q, self._compile_filters(cols, trans, params), params)
         if len(q_groupby) > 0:
-            q = q.group_by(*q_groupby).order_by(*q_groupby)
+            q = q.group_by(*q_groupby)
+        return q, q_colnames, q_labels, q_aggregates, q_groupby
+
+    def _get_report_query(self, params, request, sess=None):
+        if sess is None:
+            sess = DBSession()
+        rq = None
         helper = getattr(self.model, '__augment_query__', None)
+        if not callable(helper) and not params.get('__raw', False):
+            for rollup in self.rollups:
+                rq = rollup.get_report_query(sess, self, params)
+                if rq is not None:
+                    break
+        if rq is None:
+            rq = self._get_raw_report_query(sess, params)
+        q, q_colnames, q_labels, q_aggregates, q_groupby = rq
+        if isinstance(params.get('__having'), list):
+            clauses = self._get_having_clauses(q_aggregates,
+                                               params['__having'])
+            if len(clauses) > 0:
+                q = q.having(and_(*clauses))
+        order = []
+        if isinstance(params.get('__sort'), list):
+            for sdef in params['__sort']:
+                if not isinstance(sdef, dict):
+                    continue
+                label = q_labels.get(sdef.get('property'))
+                if label is None:
+                    continue
+                if sdef.get('direction') == 'DESC':
+                    label = label.desc()
+                order.append(label)
+        if len(order) > 0:
+            q = q.order_by(*order)
+        elif len(q_groupby) > 0:
+            q = q.order_by(*q_groupby)
         if callable(helper):
             q = helper(sess, q, params, request)
         # TODO: need additional augment-style hook to filter report resultset
+        return q, q_colnames
 
-        for obj in q:
-            tot += 1
-            records.append(dict((colname, getattr(obj, colname))
-                                for colname
-                                in q_colnames))
+    def report(self, params, request):
+        logger.debug('Running API call, class:%s method:report params:%r',
+                     self.name, params)
+        res = {
+            'records': [],
+            'success': True,
+            'total':   0
+        }
+        q, q_colnames = self._get_report_query(params, request)
+        # Total is the number of rows in the whole report, whether
+        # paginated or not.
+        tot = DBSession().query(func.count('*')).select_from(
+                q.order_by(None).subquery()).scalar()
+        q = self._apply_pagination(q, None, params)
+
+        records = [dict((colname, getattr(obj, colname))
+                        for colname
+                        in q_colnames)
+                   for obj in q]
 
         res['records'] = records
         res['total'] = tot
         return res
 
+    def iter_report(self, params, request, batch=500, sess=None):
+        # Streaming variant of report(), for server-side consumers and
+        # streamed report responses. Rows are fetched in batches using
+        # server-side cursors where supported. Totals are not computed.
+        # Query errors are raised right away, before any output is sent.
+        q, q_colnames = self._get_report_query(params, request, sess=sess)
+        q = self._apply_pagination(q, None, params)
+        objs = iter(q.yield_per(batch))
+        first = list(itertools.islice(objs, batch))
+        return self._iter_report_rows(itertools.chain(first, objs),
+                                      q_colnames)
+
+    def _iter_report_rows(self, objs, colnames):
+        for obj in objs:
+            yield OrderedDict((colname, getattr(obj, colname))
+                              for colname
+                              in colnames)
+
 
 class ExtModuleBrowser(object):
     def __init__(self, mmgr, moddef):
@@ -27,24 +27,33 @@ from __future__ import (unicode_literals, print_function,
                         absolute_import, division)
 
 from collections import defaultdict
-import binascii
-import ipaddress
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
 import traceback
-import datetime as dt
-import decimal
 import sys
-import uuid
-from dateutil.tz import tzlocal
 
+from pyramid.events import ContextFound
+from pyramid.request import (
+    Request,
+    apply_request_extensions
+)
+from pyramid.threadlocal import manager as threadlocal_manager
 from pyramid.view import render_view_to_response
 from webob import Response
 from zope.interface import implementer
 from zope.interface import Interface
 from zope.interface.interfaces import ComponentLookupError
+import transaction
 import venusian
 
 from netprofile.common.hooks import register_hook
+from netprofile.common.jsonutil import (  # noqa: F401
+    JsonReprEncoder,
+    json_default,
+    register_json_type
+)
+from netprofile.db.connection import DBSession
 
 # form parameters sent by ExtDirect when using a form-submit
 # see http://www.sencha.com/products/js/direct.php
@@ -67,44 +76,72 @@ def get_ext_csrf(request):
     return request.headers.get('X-CSRFToken', '')
 
 
+def _get_session_timeout(request):
+    # Use cached identity if available, to avoid loading user object
+    # on every call.
+    ident = getattr(request, 'identity', None)
+    if ident is not None:
+        return ident.sess_timeout
+    user = request.user
+    return user.sess_timeout if user else None
+
+
 def _mk_cb_key(action_name, method_name):
     """ helper function to create a unique actions dict key """
     return action_name + '#' + method_name
 
 
-class JsonReprEncoder(json.JSONEncoder):
+def _stdlib_dumps(obj):
+    return json.dumps(obj, cls=JsonReprEncoder)
+
+
+def _get_orjson_dumps():
+    import orjson
+
+    opts = (orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_PASSTHROUGH_SUBCLASS
+            | orjson.OPT_NON_STR_KEYS)
+
+    def _orjson_dumps(obj):
+        try:
+            return orjson.dumps(obj, default=json_default,
+                                option=opts).decode()
+        except (orjson.JSONEncodeError, TypeError):
+            # Things like integers wider than 64 bits.
+            return _stdlib_dumps(obj)
+    return _orjson_dumps
+
+
+_json_backends = {
+    'stdlib': lambda: _stdlib_dumps,
+    'orjson': _get_orjson_dumps
+}
+
+_json_backend = [_stdlib_dumps]
+
+
+def json_dumps(obj):
     """
-    A convenience wrapper for classes that support __json__().
+    Serialize an object to JSON string using current backend.
     """
-    def default(self, obj):
-        if (isinstance(obj, Response)
-                and obj.content_type == 'application/json'):
-            # return decoded response body in case it's an already
-            # rendered exception view
-            return json.loads(obj.unicode_body)
-        jr = getattr(obj, '__json__', None)
-        if jr is not None:
-            return jr()
-        if isinstance(obj, dt.datetime):
-            if obj.tzinfo is None:
-                obj = obj.replace(tzinfo=tzlocal())
-            return obj.isoformat()
-        if isinstance(obj, dt.date):
-            return obj.isoformat()
-        if isinstance(obj, dt.time):
-            return obj.isoformat()
-        if isinstance(obj, ipaddress.IPv4Address):
-            return int(obj)
-        if isinstance(obj, ipaddress.IPv6Address):
-            return tuple(obj.packed)
-        if isinstance(obj, decimal.Decimal):
-            return str(obj)
-        if isinstance(obj, bytes):
-            return binascii.hexlify(obj).decode()
-        if isinstance(obj, uuid.UUID):
-            return str(obj)
-
-        return super(JsonReprEncoder, self).default(obj)
+    return _json_backend[0](obj)
+
+
+def set_json_backend(name='auto'):
+    """
+    Select a library used by json_dumps().
+
+    Use 'auto' to pick the fastest available one.
+    """
+    if name == 'auto':
+        for backend in ('orjson', 'stdlib'):
+            try:
+                _json_backend[0] = _json_backends[backend]()
+            except ImportError:
+                continue
+            return backend
+    _json_backend[0] = _json_backends[name]()
+    return name
 
 
 class IExtDirectRouter(Interface):
@@ -121,6 +158,18 @@ class AccessDeniedException(Exception):
     pass
 
 
+# Request attributes which are safe to share with worker threads running
+# parallel ExtDirect calls.
+_WORKER_REQUEST_ATTRS = ('context',
+                         'root',
+                         'matchdict',
+                         'matched_route',
+                         'locale_name',
+                         'identity',
+                         'session',
+                         'np_session')
+
+
 @implementer(IExtDirectRouter)
 class ExtDirectRouter(object):
     """
@@ -145,6 +194,14 @@ class ExtDirectRouter(object):
     If the ``descriptor`` argument is passed it's used as ExtDirect
     API descriptor name (default is Ext.app.REMOTING_API).
 
+    If the ``parallel_workers`` argument is greater than zero, methods
+    registered with ``parallel`` setting that are batched in a single
+    request are run concurrently on a thread pool of that size. Each of
+    them gets its own copy of the request and its own database session,
+    which is set up by re-sending ContextFound event in the worker thread.
+    Other methods in the batch run in the request thread, after all
+    parallel calls before them have finished.
+
     If ``expose_exceptions`` argument is set to True the exception
     traceback will be exposed in the response object. WARNING this
     is potentially dangeerous, do not use in production environments.
@@ -167,7 +224,8 @@ class ExtDirectRouter(object):
                  descriptor='NetProfile.api.REMOTING',
                  provider_id='netprofile-provider',
                  expose_exceptions=True,
-                 debug_mode=False):
+                 debug_mode=False,
+                 parallel_workers=0):
         self.api_path = api_path
         self.router_path = router_path
         self.namespace = namespace
@@ -176,6 +234,11 @@ class ExtDirectRouter(object):
         self.expose_exceptions = expose_exceptions
         self.debug_mode = debug_mode
         self.actions = defaultdict(dict)
+        self.generation = 0
+        self._api_cache = {}
+        self.executor = None
+        if parallel_workers > 0:
+            self.executor = ThreadPoolExecutor(parallel_workers)
 
     def add_action(self, action_name, **settings):
         """
@@ -195,9 +258,20 @@ class ExtDirectRouter(object):
         ``permission``: The permission needed to execute the wrapped callable
         ``request_as_last_param``: If true, the wrapped callable will receive
                                    a request object as last argument
+        ``parallel``: If true, the wrapped callable doesn't modify any data
+                      and can be run concurrently with other such calls
         """
         callback_key = _mk_cb_key(action_name, settings['method_name'])
         self.actions[action_name][callback_key] = settings
+        self.invalidate_api()
+
+    def invalidate_api(self):
+        """
+        Drop cached API descriptors. Called whenever registered actions
+        or the set of loaded modules change.
+        """
+        self.generation += 1
+        self._api_cache = {}
 
     def add_model(self, name, model):
         self.add_action(name,
@@ -206,6 +280,7 @@ class ExtDirectRouter(object):
                         numargs=1,
                         accepts_files=False,
                         request_as_last_param=True,
+                        parallel=True,
                         permission=model.cap_read)
         self.add_action(name,
                         method_name='read_one',
@@ -241,6 +316,7 @@ class ExtDirectRouter(object):
                         numargs=0,
                         request_as_last_param=True,
                         accepts_files=False,
+                        parallel=True,
                         permission=model.cap_read)
         self.add_action(name,
                         method_name='validate_fields',
@@ -285,6 +361,7 @@ class ExtDirectRouter(object):
                         numargs=1,
                         accepts_files=False,
                         request_as_last_param=True,
+                        parallel=True,
                         permission=model.cap_read)
 
     def get_actions(self):
@@ -330,43 +407,69 @@ class ExtDirectRouter(object):
                 self.descriptor,
                 json.dumps(self._get_api_dict(request)))
 
-    def _do_route(self, action_name, method_name, params, trans_id, request):
+    def get_api(self, request, modules=()):
+        """
+        Return a tuple of API descriptor script and its ETag.
+
+        Both are cached until the set of registered actions or loaded
+        modules changes. ``modules`` is an iterable of (name, version)
+        pairs of loaded modules, used to derive the ETag.
+        """
+        modules = tuple(sorted(modules))
+        key = (request.application_url, self.generation, modules)
+        cached = self._api_cache.get(key)
+        if cached is not None:
+            return cached
+        body = self.dump_api(request)
+        etag = hashlib.sha1()
+        etag.update(('%d;' % (self.generation,)).encode())
+        for name, version in modules:
+            etag.update(('%s=%s;' % (name, version)).encode())
+        etag.update(body.encode())
+        cached = self._api_cache[key] = (body, etag.hexdigest())
+        return cached
+
+    def _check_access(self, settings, request):
+        permission = settings.get('permission', None)
+        if permission is not None:
+            permission_ok = request.has_permission(permission)
+        else:
+            permission_ok = request.has_permission('USAGE')
+        if not permission_ok:
+            return False
+        if settings.get('session_checks', True):
+            if request.session.get('sess.pwage') in {'force', 'drop'}:
+                return False
+        return True
+
+    def _do_route(self, action_name, method_name, params, trans_id, request,
+                  access_ok=None):
         """
         Perform routing, i.e. calls decorated methods/functions.
         """
         if params is None:
             params = list()
         settings = self.get_method(action_name, method_name)
-        permission = settings.get('permission', None)
-        session_checks = settings.get('session_checks', True)
         ret = {
             'type':   'rpc',
             'tid':    trans_id,
             'action': action_name,
             'method': method_name,
-            'sto':    request.user.sess_timeout if request.user else None,
+            'sto':    _get_session_timeout(request),
             'result': None
         }
 
         callback = settings['callback']
 
         append_request = settings.get('request_as_last_param', False)
-        session_ok = True
-
-        if permission is not None:
-            permission_ok = request.has_permission(permission)
-        else:
-            permission_ok = request.has_permission('USAGE')
-
-        if session_checks:
-            if request.session.get('sess.pwage') in {'force', 'drop'}:
-                session_ok = False
+        if access_ok is None:
+            access_ok = self._check_access(settings, request)
 
         if append_request:
             params.append(request)
 
         try:
-            if not permission_ok or not session_ok:
+            if not access_ok:
                 raise AccessDeniedException('Access denied')
             ret['result'] = callback(*params)
         except Exception as e:
@@ -405,6 +508,86 @@ class ExtDirectRouter(object):
 
         return ret
 
+    def _make_worker_request(self, request, registry):
+        """
+        Make a copy of request for use in a worker thread.
+
+        Lazily evaluated request properties are not shared with workers,
+        except for those which are safe to read concurrently. Notably,
+        ORM user object is loaded by worker's own database session, if
+        the method asks for it.
+        """
+        wreq = Request(dict(request.environ))
+        wreq.registry = registry
+        apply_request_extensions(wreq)
+        for attr in _WORKER_REQUEST_ATTRS:
+            if attr in request.__dict__:
+                setattr(wreq, attr, request.__dict__[attr])
+        return wreq
+
+    def _do_route_isolated(self, action_name, method_name, params,
+                           trans_id, request, registry, access_ok):
+        """
+        Perform routing in a worker thread, using a separate request
+        object, database session and transaction.
+
+        Access checks must be already done in the request thread.
+        """
+        request = self._make_worker_request(request, registry)
+        threadlocal_manager.push({'request':  request,
+                                  'registry': registry})
+        try:
+            # Let subscribers set up worker's database session, like they
+            # did for the request thread.
+            registry.notify(ContextFound(request))
+            return self._do_route(action_name, method_name, params,
+                                  trans_id, request, access_ok)
+        finally:
+            transaction.abort()
+            DBSession.remove()
+            threadlocal_manager.pop()
+
+    def _is_parallel(self, action_name, method_name):
+        try:
+            settings = self.get_method(action_name, method_name)
+        except KeyError:
+            return False
+        return settings.get('parallel', False)
+
+    def _route_parallel(self, calls, request):
+        # Parallel calls are run concurrently, others are run in order
+        # in the request thread, after all parallel calls before them
+        # have finished. Once some call that can modify data has been
+        # run, remaining calls are run in the request thread too, so
+        # that they see its changes.
+        ret = [None] * len(calls)
+        futures = []
+        sequential = False
+        # Shared request state is computed here, before worker requests
+        # are made.
+        request.session
+        if hasattr(request, 'identity'):
+            request.identity
+        registry = request.registry
+        for idx, (act, meth, params, tid) in enumerate(calls):
+            if not sequential and self._is_parallel(act, meth):
+                access_ok = self._check_access(self.get_method(act, meth),
+                                               request)
+                futures.append((idx, self.executor.submit(
+                        self._do_route_isolated,
+                        act, meth, params, tid, request, registry,
+                        access_ok)))
+                continue
+            if not sequential:
+                sequential = True
+                for fidx, future in futures:
+                    ret[fidx] = future.result()
+                futures = []
+            ret[idx] = self._do_route(act, meth, params, tid, request)
+        for idx, future in futures:
+            ret[idx] = future.result()
+        return ret
+
     def route(self, request):
         token = request.get_csrf()
         if token != request.ext_csrf:
@@ -414,15 +597,18 @@ class ExtDirectRouter(object):
             params = parse_extdirect_form_submit(request)
         else:
             params = parse_extdirect_request(request)
-        ret = []
-        for (act, meth, params, tid) in params:
-            ret.append(self._do_route(act, meth, params, tid, request))
+        if self.executor is not None and not is_form_data and len(params) > 1:
+            ret = self._route_parallel(params, request)
+        else:
+            ret = []
+            for (act, meth, params, tid) in params:
+                ret.append(self._do_route(act, meth, params, tid, request))
         if not is_form_data:
             if len(ret) == 1:
                 ret = ret[0]
-            return (json.dumps(ret, cls=JsonReprEncoder), False)
+            return (json_dumps(ret), False)
         ret = ret[0]  # form data cannot be batched
-        s = json.dumps(ret, cls=JsonReprEncoder).replace('&quot;', r'\&quot;')
+        s = json_dumps(ret).replace('&quot;', r'\&quot;')
         return (s, True)
 
 
@@ -547,11 +733,23 @@ def api_view(request):
     """
     Renders the API.
     """
+    from netprofile.common.modules import IModuleManager
+
     extdirect = request.registry.getUtility(IExtDirectRouter)
-    body = extdirect.dump_api(request)
-    return Response(body,
+    mmgr = request.registry.queryUtility(IModuleManager)
+    modules = ()
+    if mmgr is not None:
+        modules = ((name, str(mod.version()))
+                   for name, mod in mmgr.loaded.items())
+    body, etag = extdirect.get_api(request, modules)
+    resp = Response(body,
                     content_type=str('text/javascript'),
-                    charset=str('UTF-8'))
+                    charset=str('UTF-8'),
+                    conditional_response=True)
+    # Allow caching, but always revalidate using ETag.
+    resp.etag = etag
+    resp.cache_control = 'no-cache'
+    return resp
 
 
 def router_view(request):
@@ -566,6 +764,8 @@ def router_view(request):
 
 @register_hook('np.model.load')
 def _proc_model(mmgr, model):
+    # Build shared column descriptors once, while the model is loading.
+    model.prepare()
     extd = mmgr.cfg.registry.getUtility(IExtDirectRouter)
     extd.add_model(model.__name__, model)
 
@@ -583,15 +783,21 @@ def includeme(config):
              'descriptor',
              'provider_id',
              'expose_exceptions',
-             'debug_mode')
+             'debug_mode',
+             'parallel_workers')
     for name in names:
         qname = 'netprofile.ext.direct.%s' % name
         value = settings.get(qname, None)
         if name == 'expose_exceptions' or name == 'debug_mode':
             value = (value == 'true')
+        elif name == 'parallel_workers' and value is not None:
+            value = int(value)
         if value is not None:
             extdirect_config[name] = value
 
+    set_json_backend(settings.get('netprofile.ext.direct.json_backend',
+                                  'auto'))
+
     extd = ExtDirectRouter(**extdirect_config)
     config.registry.registerUtility(extd, IExtDirectRouter)
 
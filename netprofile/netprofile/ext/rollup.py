@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Pre-aggregated rollup tables for ExtJS report API
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import datetime as dt
+import logging
+
+from dateutil.tz import tzlocal
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    Table,
+    func,
+    select
+)
+
+from netprofile.db.clauses import DateTrunc
+from netprofile.db.fields import UInt64
+
+logger = logging.getLogger(__name__)
+
+# Group-by units that can be answered from a rollup of given granularity.
+_COVERED_UNITS = {
+    'hour':  ('year', 'month', 'week', 'day', 'hour'),
+    'day':   ('year', 'month', 'week', 'day'),
+    'month': ('year', 'month')
+}
+
+_MEASURE_FUNCTIONS = ('count', 'sum', 'min', 'max')
+
+
+def truncate_datetime(value, unit):
+    value = value.replace(minute=0, second=0, microsecond=0)
+    if unit in ('day', 'month'):
+        value = value.replace(hour=0)
+    if unit == 'month':
+        value = value.replace(day=1)
+    return value
+
+
+def _next_period(value, unit):
+    if unit == 'hour':
+        return value + dt.timedelta(hours=1)
+    if unit == 'day':
+        return value + dt.timedelta(days=1)
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+class Rollup(object):
+    """
+    Declaration of a summary table, maintained incrementally from
+    the rows of a source model.
+
+    Rollups are declared in the 'rollups' key of model's __table__.info.
+    Measures are (function, column) pairs, where function is one of
+    count, sum, min or max. Use ('count', '*') to store row counts.
+
+    Rollup tables are created by migrations of the module owning
+    the source model. Source rows arriving later than late_window
+    behind the newest rolled up period are not picked up until
+    the rollup is rebuilt.
+    """
+    def __init__(self, time, granularity='day', dimensions=(),
+                 measures=(('count', '*'),), name=None,
+                 late_window=dt.timedelta(days=1)):
+        if granularity not in _COVERED_UNITS:
+            raise ValueError('Invalid rollup granularity: %s' %
+                             (granularity,))
+        for fname, colname in measures:
+            if fname not in _MEASURE_FUNCTIONS:
+                raise ValueError('Invalid rollup measure function: %s' %
+                                 (fname,))
+        self.time = time
+        self.granularity = granularity
+        self.dimensions = tuple(dimensions)
+        self.measures = tuple(measures)
+        self.name = name or granularity
+        self.late_window = late_window
+        self._tables = {}
+        self._ready = set()
+
+    @staticmethod
+    def measure_name(fname, colname):
+        if colname == '*':
+            return '%s_all' % (fname,)
+        return '%s_%s' % (fname, colname)
+
+    def get_table(self, model):
+        src = model.__table__
+        tbl = self._tables.get(src)
+        if tbl is not None:
+            return tbl
+        name = '%s_rollup_%s' % (src.name, self.name)
+        tbl = src.metadata.tables.get(name)
+        if tbl is None:
+            cols = [Column('period', DateTime(), nullable=False)]
+            for colname in self.dimensions:
+                cols.append(Column(colname, src.c[colname].type,
+                                   nullable=True))
+            for fname, colname in self.measures:
+                mname = self.measure_name(fname, colname)
+                if fname == 'count':
+                    ctype = UInt64()
+                elif (fname == 'sum'
+                      and isinstance(src.c[colname].type, Integer)):
+                    ctype = UInt64()
+                else:
+                    ctype = src.c[colname].type
+                cols.append(Column(mname, ctype, nullable=True))
+            cols.append(Index('%s_i_period' % (name,), 'period'))
+            tbl = Table(name, src.metadata, *cols,
+                        mysql_engine='InnoDB',
+                        mysql_charset='utf8')
+        self._tables[src] = tbl
+        return tbl
+
+    def _table_exists(self, sess, model):
+        conn = sess.connection(mapper=model.__mapper__)
+        return conn.dialect.has_table(conn, self.get_table(model).name)
+
+    def is_ready(self, sess, model):
+        """
+        Check if rollup table exists and has been refreshed at least once.
+        """
+        tbl = self.get_table(model)
+        if tbl in self._ready:
+            return True
+        if not self._table_exists(sess, model):
+            return False
+        if sess.execute(select([func.max(tbl.c.period)])).scalar() is None:
+            return False
+        self._ready.add(tbl)
+        return True
+
+    def refresh(self, sess, model):
+        """
+        Bring rollup table up to date with its source.
+
+        Everything starting from late_window before the latest rolled
+        up period is recalculated, so that both the possibly incomplete
+        last period and rows that were added out of order are accounted
+        for. Returns False if rollup table has not been created yet.
+        """
+        src = model.__table__
+        tbl = self.get_table(model)
+        if not self._table_exists(sess, model):
+            logger.warning('Rollup table %s does not exist, '
+                           'run database migrations to create it', tbl.name)
+            return False
+
+        timecol = src.c[self.time]
+        period = DateTrunc(self.granularity, timecol)
+        names = ['period']
+        sel_cols = [period.label('period')]
+        for colname in self.dimensions:
+            names.append(colname)
+            sel_cols.append(src.c[colname])
+        for fname, colname in self.measures:
+            names.append(self.measure_name(fname, colname))
+            if colname == '*':
+                sel_cols.append(getattr(func, fname)('*'))
+            else:
+                sel_cols.append(getattr(func, fname)(src.c[colname]))
+        sel = select(sel_cols).where(timecol.isnot(None)).group_by(
+                period, *(src.c[colname] for colname in self.dimensions))
+
+        start = sess.execute(select([func.max(tbl.c.period)])).scalar()
+        if start is not None:
+            if self.late_window:
+                start = truncate_datetime(start - self.late_window,
+                                          self.granularity)
+            sess.execute(tbl.delete().where(tbl.c.period >= start))
+            sel = sel.where(timecol >= start)
+        sess.execute(tbl.insert().from_select(names, sel))
+        logger.debug('Refreshed rollup %s starting from %s',
+                     tbl.name, start)
+        return True
+
+    def _aggregate(self, tbl, fname, colname):
+        if fname == 'count':
+            mname = self.measure_name('count', colname)
+            if mname in tbl.c:
+                return func.sum(tbl.c[mname])
+            return None
+        if fname in ('sum', 'min', 'max'):
+            mname = self.measure_name(fname, colname)
+            if mname in tbl.c:
+                return getattr(func, fname)(tbl.c[mname])
+            return None
+        if fname == 'avg':
+            smeasure = self.measure_name('sum', colname)
+            cmeasure = self.measure_name('count', colname)
+            if smeasure in tbl.c and cmeasure in tbl.c:
+                return func.sum(tbl.c[smeasure]) / func.sum(tbl.c[cmeasure])
+        return None
+
+    def _is_aligned(self, operator, value):
+        if not isinstance(value, dt.datetime):
+            return False
+        if value.tzinfo is not None:
+            value = value.astimezone(tzlocal())
+        value = value.replace(tzinfo=None)
+        if operator in ('ge', '>=', 'lt', '<'):
+            return truncate_datetime(value, self.granularity) == value
+        if operator in ('le', '<=', 'gt', '>'):
+            start = truncate_datetime(value, self.granularity)
+            end = _next_period(start, self.granularity)
+            return (end - value) <= dt.timedelta(seconds=1)
+        return False
+
+    def get_report_query(self, sess, extm, params):
+        """
+        Build a report query against this rollup.
+
+        Returns None if requested aggregates, grouping or filters are
+        not covered by this rollup.
+        """
+        for pname in ('__sstr', '__xfilter'):
+            if params.get(pname):
+                return None
+        if not self.is_ready(sess, extm.model):
+            return None
+        cols = extm.get_read_columns()
+        trans = extm._get_read_trans()
+        tbl = self.get_table(extm.model)
+
+        def _source_name(name):
+            return trans[name].columns[0].name
+
+        q_colnames = []
+        q_columns = []
+        q_labels = {}
+        q_aggregates = {}
+        q_groupby = []
+
+        aggregates = []
+        for qcol in params.get('__aggregates', ()):
+            if qcol[1] not in trans:
+                continue
+            colname = _source_name(qcol[1])
+            if qcol[0] == 'count' and colname == self.time:
+                # Source rows with NULL time are not rolled up.
+                colname = '*'
+            aggregates.append((qcol[0], colname, qcol[2]))
+        if len(aggregates) == 0:
+            aggregates.append(('count', '*', 'cnt'))
+        for fname, colname, labelname in aggregates:
+            expr = self._aggregate(tbl, fname, colname)
+            if expr is None:
+                return None
+            label = expr.label(labelname)
+            q_colnames.append(labelname)
+            q_columns.append(label)
+            q_labels[labelname] = label
+            q_aggregates[labelname] = expr
+        for gbcol in params.get('__groupby', ()):
+            if isinstance(gbcol, str):
+                if gbcol not in trans:
+                    continue
+                colname = _source_name(gbcol)
+                if colname not in self.dimensions:
+                    return None
+                prop = tbl.c[colname]
+                labelname = gbcol
+            else:
+                if gbcol[1] not in trans:
+                    continue
+                if _source_name(gbcol[1]) != self.time:
+                    return None
+                if gbcol[0] not in _COVERED_UNITS[self.granularity]:
+                    return None
+                prop = func.extract(gbcol[0], tbl.c.period)
+                labelname = '_'.join((gbcol[1], gbcol[0]))
+            label = prop.label(labelname)
+            q_colnames.append(labelname)
+            q_columns.append(label)
+            q_labels[labelname] = label
+            q_groupby.append(prop)
+
+        colmap = {}
+        flist = []
+        for pname in ('__ffilter', '__filter'):
+            if pname not in params:
+                continue
+            for fltr in params[pname]:
+                fcol = fltr.get('property', None)
+                if fcol not in trans:
+                    continue
+                colname = _source_name(fcol)
+                if colname in self.dimensions:
+                    colmap[trans[fcol].key] = tbl.c[colname]
+                elif colname == self.time:
+                    value = fltr.get('value', None)
+                    if isinstance(value, list):
+                        return None
+                    operator = fltr.get('operator', 'eq')
+                    if not self._is_aligned(operator,
+                                            cols[fcol].parse_param(value)):
+                        return None
+                    colmap[trans[fcol].key] = tbl.c.period
+                else:
+                    return None
+                flist.append(fltr)
+
+        q = sess.query(*q_columns).select_from(tbl)
+        clauses = extm._get_filter_clauses(cols, trans, flist, colmap)
+        if len(clauses) > 0:
+            q = q.filter(*clauses)
+        if len(q_groupby) > 0:
+            q = q.group_by(*q_groupby)
+        logger.debug('Answering report for %s from rollup %s',
+                     extm.name, tbl.name)
+        return q, q_colnames, q_labels, q_aggregates, q_groupby
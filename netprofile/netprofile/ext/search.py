@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Token index for ExtJS data API quick search
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import logging
+import re
+import time
+
+from sqlalchemy import (
+    Column,
+    Index,
+    PrimaryKeyConstraint,
+    Table,
+    Unicode,
+    and_,
+    event,
+    select
+)
+from sqlalchemy.orm import (
+    Mapper,
+    attributes
+)
+
+logger = logging.getLogger(__name__)
+
+TOKEN_LENGTH = 64
+
+# Seconds to wait before re-checking for a missing index table.
+RECHECK_INTERVAL = 60
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_tables = {}
+_ready = {}
+
+
+def tokenize(value):
+    if value is None:
+        return set()
+    return set(tok[:TOKEN_LENGTH]
+               for tok
+               in _TOKEN_RE.findall(str(value).lower()))
+
+
+def is_indexed(model):
+    return bool(model.__table__.info.get('search_index', False))
+
+
+def get_index_table(model):
+    tbl = _tables.get(model)
+    if tbl is not None:
+        return tbl
+    src = model.__table__
+    pkcol = model.__mapper__.primary_key[0]
+    name = '%s_search' % (src.name,)
+    tbl = src.metadata.tables.get(name)
+    if tbl is None:
+        tbl = Table(name, src.metadata,
+                    Column('objid', pkcol.type, nullable=False),
+                    Column('token', Unicode(TOKEN_LENGTH), nullable=False),
+                    PrimaryKeyConstraint('token', 'objid'),
+                    Index('%s_i_objid' % (name,), 'objid'),
+                    mysql_engine='InnoDB',
+                    mysql_charset='utf8')
+    _tables[model] = tbl
+    return tbl
+
+
+def _get_search_props(model):
+    mapper = model.__mapper__
+    props = []
+    for name in model.__table__.info.get('easy_search', ()):
+        for tbl in mapper.tables:
+            if name in tbl.c:
+                props.append(mapper.get_property_by_column(tbl.c[name]))
+                break
+    return props
+
+
+def _is_built(conn, model):
+    tbl = get_index_table(model)
+    if not conn.dialect.has_table(conn, tbl.name):
+        return False
+    # Migrations only create empty index tables, these get filled
+    # by "search index" command.
+    if conn.execute(select([tbl.c.objid]).limit(1)).first() is not None:
+        return True
+    src = model.__table__
+    return conn.execute(select([src]).limit(1)).first() is None
+
+
+def is_ready(conn, model):
+    """
+    Check if search index table has been built for a model.
+    """
+    if not is_indexed(model):
+        return False
+    state = _ready.get(model)
+    now = time.monotonic()
+    if state is True or (state is not None and now < state):
+        return state is True
+    if _is_built(conn, model):
+        _ready[model] = True
+        return True
+    _ready[model] = now + RECHECK_INTERVAL
+    return False
+
+
+def _get_tokens(obj, props):
+    tokens = set()
+    for prop in props:
+        tokens.update(tokenize(getattr(obj, prop.key, None)))
+    return tokens
+
+
+def _index_object(conn, model, obj, props):
+    tbl = get_index_table(model)
+    objid = model.__mapper__.primary_key_from_instance(obj)[0]
+    conn.execute(tbl.delete().where(tbl.c.objid == objid))
+    tokens = _get_tokens(obj, props)
+    if len(tokens) > 0:
+        conn.execute(tbl.insert(), [{'objid': objid, 'token': tok}
+                                    for tok in tokens])
+
+
+def _cb_after_insert(mapper, conn, target):
+    model = mapper.base_mapper.class_
+    if is_ready(conn, model):
+        _index_object(conn, model, target, _get_search_props(model))
+
+
+def _cb_after_update(mapper, conn, target):
+    model = mapper.base_mapper.class_
+    if not is_ready(conn, model):
+        return
+    props = _get_search_props(model)
+    for prop in props:
+        if attributes.get_history(target, prop.key).has_changes():
+            _index_object(conn, model, target, props)
+            break
+
+
+def _cb_after_delete(mapper, conn, target):
+    model = mapper.base_mapper.class_
+    if is_ready(conn, model):
+        tbl = get_index_table(model)
+        objid = mapper.primary_key_from_instance(target)[0]
+        conn.execute(tbl.delete().where(tbl.c.objid == objid))
+
+
+def _cb_mapper_configured(mapper, cls):
+    if mapper.inherits is not None or not is_indexed(cls):
+        return
+    event.listen(mapper, 'after_insert', _cb_after_insert, propagate=True)
+    event.listen(mapper, 'after_update', _cb_after_update, propagate=True)
+    event.listen(mapper, 'after_delete', _cb_after_delete, propagate=True)
+
+
+event.listen(Mapper, 'mapper_configured', _cb_mapper_configured)
+
+
+def build_index(sess, model, batch=1000):
+    """
+    (Re)build search index table for a model.
+
+    Index tables are created by migrations of the module owning
+    the model. Returns None if index table does not exist yet.
+    """
+    conn = sess.connection(mapper=model.__mapper__)
+    tbl = get_index_table(model)
+    if not conn.dialect.has_table(conn, tbl.name):
+        logger.warning('Search index table %s does not exist, '
+                       'run database migrations to create it', tbl.name)
+        return None
+    conn.execute(tbl.delete())
+    props = _get_search_props(model)
+    pk = getattr(model, model.__mapper__.get_property_by_column(
+            model.__mapper__.primary_key[0]).key)
+    q = sess.query(pk, *(getattr(model, prop.key) for prop in props))
+    rows = []
+    count = 0
+    for row in q.yield_per(batch):
+        tokens = set()
+        for value in row[1:]:
+            tokens.update(tokenize(value))
+        rows.extend({'objid': row[0], 'token': tok} for tok in tokens)
+        count += 1
+        if len(rows) >= batch:
+            conn.execute(tbl.insert(), rows)
+            rows = []
+    if len(rows) > 0:
+        conn.execute(tbl.insert(), rows)
+    _ready[model] = True
+    logger.info('Indexed %d objects of %s', count, model.__name__)
+    return count
+
+
+def get_search_clause(model, sstr):
+    """
+    Get filter clause for an indexed prefix search.
+
+    Every search term must be a prefix of some indexed token.
+    """
+    tokens = tokenize(sstr)
+    if len(tokens) == 0:
+        return None
+    tbl = get_index_table(model)
+    pk = getattr(model, model.__mapper__.get_property_by_column(
+            model.__mapper__.primary_key[0]).key)
+    cond = []
+    for tok in sorted(tokens):
+        tok = tok.replace('/', '//').replace('_', '/_')
+        cond.append(pk.in_(select([tbl.c.objid]).where(
+                tbl.c.token.like(tok + '%', escape='/'))))
+    return and_(*cond)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Total row count strategies for ExtJS data API
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import hashlib
+import json
+import logging
+
+from dogpile.cache.api import NO_VALUE
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from netprofile.common import cache
+from netprofile.db.clauses import Explain
+
+FILTER_PARAMS = ('__ffilter', '__filter', '__xfilter', '__sstr')
+
+logger = logging.getLogger(__name__)
+
+
+def filter_fingerprint(params):
+    """
+    Get a stable hash of all filtering parameters of a read() request.
+    Ordering of individual filters does not affect the result.
+    """
+    fp = {}
+    for pname in FILTER_PARAMS:
+        if pname not in params:
+            continue
+        val = params[pname]
+        if isinstance(val, list):
+            val = sorted(json.dumps(v, sort_keys=True, default=str)
+                         for v in val)
+        fp[pname] = val
+    fp = json.dumps(fp, sort_keys=True, default=str)
+    return hashlib.sha1(fp.encode()).hexdigest()
+
+
+class TotalStrategy(object):
+    """
+    Base class for strategies used to get total row count in read().
+    """
+    def get_total(self, extm, query, params):
+        """
+        Return a tuple of total number of rows and a flag which
+        is True if this number is exact.
+        """
+        raise NotImplementedError('Abstract total strategy can\'t '
+                                  'count anything.')
+
+
+class ExactTotal(TotalStrategy):
+    """
+    Always run a full count query.
+    """
+    def get_total(self, extm, query, params):
+        return (query.scalar(), True)
+
+
+class CachedTotal(ExactTotal):
+    """
+    Cache count query results in a dogpile region for a short time.
+    """
+    def __init__(self, ttl=30):
+        self.ttl = int(ttl)
+
+    def cache_key(self, extm, params):
+        return 'np:total:%s:%s' % (extm.model.__table__.name,
+                                   filter_fingerprint(params))
+
+    def get_total(self, extm, query, params):
+        region = cache.cache
+        if region is None:
+            return super(CachedTotal, self).get_total(extm, query, params)
+        key = self.cache_key(extm, params)
+        ret = region.get(key, expiration_time=self.ttl)
+        if ret is not NO_VALUE:
+            return tuple(ret)
+        ret = super(CachedTotal, self).get_total(extm, query, params)
+        region.set(key, ret)
+        return ret
+
+
+class EstimatedTotal(ExactTotal):
+    """
+    Use table statistics and query plan row estimates for big tables.
+    Falls back to exact count on small tables and unsupported databases.
+    """
+    def __init__(self, threshold=100000):
+        self.threshold = int(threshold)
+
+    def table_estimate(self, sess, extm):
+        return sess.execute(text(
+            'SELECT TABLE_ROWS FROM information_schema.TABLES '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :tname'
+        ), {'tname': extm.model.__table__.name}).scalar()
+
+    def query_estimate(self, sess, query):
+        """
+        Estimate number of rows matched by a query from its plan.
+
+        Only plan rows of the outermost SELECT are used, subqueries are
+        ignored. Estimates of tables joined in the outermost SELECT
+        are multiplied, as they would be in a nested loop.
+        """
+        est = None
+        for row in sess.execute(Explain(query.statement)):
+            row = dict(row.items())
+            if row.get('select_type') not in ('SIMPLE', 'PRIMARY'):
+                continue
+            rows = row.get('rows')
+            if rows is None:
+                return None
+            rows = float(rows)
+            filtered = row.get('filtered')
+            if filtered is not None:
+                rows = rows * float(filtered) / 100
+            est = rows if est is None else est * rows
+        if est is None:
+            return None
+        return int(est)
+
+    def get_total(self, extm, query, params):
+        sess = query.session
+        bind = sess.get_bind(extm.model)
+        if bind.dialect.name == 'mysql':
+            try:
+                est = self.table_estimate(sess, extm)
+                if (est is not None
+                        and est >= self.threshold
+                        and any(p in params for p in FILTER_PARAMS)):
+                    est = self.query_estimate(sess, query)
+            except DBAPIError:
+                logger.warning('Unable to estimate row count for %s',
+                               extm.name, exc_info=True)
+                est = None
+            if est is not None and est >= self.threshold:
+                return (est, False)
+        return super(EstimatedTotal, self).get_total(extm, query, params)
+
+
+TOTAL_STRATEGIES = {
+    'exact':    ExactTotal,
+    'cached':   CachedTotal,
+    'estimate': EstimatedTotal
+}
+
+
+def get_total_strategy(info):
+    """
+    Create total strategy object from model's table info dictionary.
+    """
+    strategy = info.get('total_strategy', 'exact')
+    if isinstance(strategy, TotalStrategy):
+        return strategy
+    if strategy not in TOTAL_STRATEGIES:
+        raise ValueError('Unknown total strategy: %s' % (strategy,))
+    if strategy == 'cached':
+        return CachedTotal(ttl=info.get('total_cache_ttl', 30))
+    if strategy == 'estimate':
+        return EstimatedTotal(
+            threshold=info.get('total_estimate_threshold', 100000))
+    return TOTAL_STRATEGIES[strategy]()
@@ -331,6 +331,27 @@ class DefaultDocTemplate(BaseDocTemplate):
 
         super(DefaultDocTemplate, self).__init__(filename, **kwargs)
 
+    def build_iter(self, flowables):
+        """
+        Build the document from an iterable of flowables.
+
+        Unlike build(), flowables are laid out as soon as they are
+        generated, so the whole story never needs to be in memory.
+        """
+        self._startBuild()
+        canv = self.canv
+        canv._doctemplate = self
+        try:
+            for flowable in flowables:
+                story = [flowable]
+                # Flowables split across pages are put back into the story.
+                while len(story):
+                    self.clean_hanging()
+                    self.handle_flowable(story)
+        finally:
+            del canv._doctemplate
+        self._endBuild()
+
 
 def _register_fonts(settings):
     global DEFAULT_FONT
@@ -36,7 +36,7 @@ from babel.dates import (
 from babel.numbers import format_decimal
 from pyramid.i18n import TranslationStringFactory
 
-from netprofile.ext.direct import JsonReprEncoder
+from netprofile.common.jsonutil import JsonReprEncoder
 
 _ = TranslationStringFactory('netprofile')
 
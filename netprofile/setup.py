@@ -76,6 +76,12 @@ extras_require = {
     ],
     ':python_version<"3.3"': [
         'ipaddress'
+    ],
+    'fastjson': [
+        'orjson'
+    ],
+    'parquet': [
+        'pyarrow'
     ]
 }
 
@@ -155,12 +161,16 @@ setup(
             'alembic = netprofile.cli:Alembic',
             'db revision = netprofile.cli:DBRevision',
 
+            'search index = netprofile.cli:BuildSearchIndex',
+
             'deploy = netprofile.cli:Deploy',
 
             'rt = netprofile.cli:RTServer'
         ],
         'netprofile.export.formats': [
             'csv = netprofile.export.csv:CSVExportFormat',
+            'jsonl = netprofile.export.jsonl:JSONLinesExportFormat',
+            'parquet = netprofile.export.parquet:ParquetExportFormat',
             'pdf = netprofile.export.pdf:PDFExportFormat'
         ]
     }
@@ -31,6 +31,8 @@ from pyramid import testing
 
 import time
 from collections import OrderedDict
+from dogpile.cache import make_region
+from dogpile.cache.api import NO_VALUE
 from pyramid.security import (
     Authenticated,
     Everyone
@@ -40,7 +42,9 @@ from pyramid.httpexceptions import HTTPFound
 from netprofile.common.auth import (
     auth_add,
     auth_remove,
+    CacheDigestNonceStore,
     DigestAuthenticationPolicy,
+    DigestNonceStore,
     PluginAuthenticationPolicy,
     _add_www_authenticate,
     _filter_token,
@@ -549,6 +553,80 @@ class TestDigestAuthenticationPolicy(unittest.TestCase):
         self.callback.assert_called_once_with(self.req.authorization[1],
                                               self.req)
 
+    def _auth_request(self, nonce, nc):
+        req = testing.DummyRequest()
+        req.authorization = ('Digest',
+                             {'username': 'testuser',
+                              'realm': 'realm',
+                              'nonce': nonce,
+                              'uri': '/index.html',
+                              'response': 'fe6636cdb8b1733ecca83dcb14b13323',
+                              'cnonce': '1f3f713c',
+                              'nc': nc,
+                              'opaque': 'NPDIGEST',
+                              'algorithm': 'MD5'})
+        return req
+
+    def test_callback_once_per_request(self):
+        self.callback.return_value = ['g:testgroup1']
+        self.pol.nonce_store = DigestNonceStore()
+        req = self._auth_request(_generate_nonce(self.ts, 'secret'),
+                                 '00000001')
+
+        self.assertEqual(self.pol.authenticated_userid(req), 'u:testuser')
+        self.assertEqual(self.pol.effective_principals(req),
+                         [Everyone, Authenticated,
+                          'u:testuser', 'g:testgroup1'])
+        self.callback.assert_called_once_with(req.authorization[1], req)
+
+    def test_replay(self):
+        self.callback.return_value = ['g:testgroup1']
+        self.pol.nonce_store = DigestNonceStore()
+        nonce = _generate_nonce(self.ts, 'secret')
+
+        req = self._auth_request(nonce, '00000002')
+        self.assertEqual(self.pol.authenticated_userid(req), 'u:testuser')
+        # Out of order requests are fine.
+        req = self._auth_request(nonce, '00000001')
+        self.assertEqual(self.pol.authenticated_userid(req), 'u:testuser')
+
+        req = self._auth_request(nonce, '00000002')
+        self.assertIsNone(self.pol.authenticated_userid(req))
+        self.assertEqual(req.response.www_authenticate[1]['stale'], 'true')
+
+
+class TestDigestNonceStore(unittest.TestCase):
+    def _check_store(self, store):
+        self.assertTrue(store.check('n1', '00000001'))
+        self.assertFalse(store.check('n1', '00000001'))
+        self.assertTrue(store.check('n1', '00000003'))
+        self.assertTrue(store.check('n1', '00000002'))
+        self.assertFalse(store.check('n1', '00000002'))
+        self.assertFalse(store.check('n1', '00000003'))
+        self.assertTrue(store.check('n2', '00000001'))
+        self.assertFalse(store.check('n1', 'garbage'))
+        self.assertFalse(store.check('n1', '00000000'))
+        # Counts fallen out of tracking window are rejected.
+        self.assertTrue(store.check('n1', '00000100'))
+        self.assertFalse(store.check('n1', '00000004'))
+
+    def test_memory(self):
+        self._check_store(DigestNonceStore())
+
+    def test_memory_bounded(self):
+        store = DigestNonceStore(max_size=2)
+        store.check('n1', '1')
+        store.check('n2', '1')
+        store.check('n1', '2')
+        store.check('n3', '1')
+        self.assertEqual(list(store._windows), ['n1', 'n3'])
+
+    def test_cache(self):
+        region = make_region().configure('dogpile.cache.memory')
+        store = CacheDigestNonceStore(region, expiration_time=60)
+        self._check_store(store)
+        self.assertIsNot(region.get('auth.digest.nc:n1'), NO_VALUE)
+
 
 class TestPluginAuthenticationPolicy(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for password hashing
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+import threading
+
+from netprofile.common import crypto
+from netprofile.common.crypto import (
+    HashExecutor,
+    HashQueueFull,
+    ScryptPasswordHandler,
+    get_hash_stats,
+    hash_password,
+    verify_password
+)
+
+_SETTINGS = {
+    'netprofile.auth.enabled_for.users': 'scrypt plain',
+    'netprofile.auth.default_hash.users': 'scrypt',
+    'netprofile.crypto.scrypt.n_exponent': '4',
+    'netprofile.crypto.executor.mode': 'thread',
+    'netprofile.crypto.executor.workers': '2'
+}
+
+
+class BlockingHandler(object):
+    offload = True
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def hash(self, user, password):
+        self.event.wait(5)
+        return password
+
+
+class TestHashExecutor(unittest.TestCase):
+    def test_inline(self):
+        ex = HashExecutor('inline')
+        handler = ScryptPasswordHandler({
+            'netprofile.crypto.scrypt.n_exponent': '4'})
+        hashed = ex.run(handler, 'hash', 'user', 'secret')
+        self.assertTrue(ex.run(handler, 'verify', 'user', 'secret', hashed))
+        self.assertFalse(ex.run(handler, 'verify', 'user', 'bad', hashed))
+        stats = ex.stats()
+        self.assertEqual(stats['mode'], 'inline')
+        self.assertEqual(stats['submitted'], 3)
+        self.assertEqual(stats['completed'], 3)
+        self.assertEqual(stats['pending'], 0)
+
+    def test_thread(self):
+        ex = HashExecutor('thread', workers=2)
+        self.addCleanup(ex.shutdown)
+        handler = ScryptPasswordHandler({
+            'netprofile.crypto.scrypt.n_exponent': '4'})
+        hashed = ex.run(handler, 'hash', 'user', 'secret')
+        self.assertTrue(ex.run(handler, 'verify', 'user', 'secret', hashed))
+        with self.assertRaises(ValueError):
+            ex.run(handler, 'verify', 'user', 'secret', 'garbage')
+        stats = ex.stats()
+        self.assertEqual(stats['submitted'], 3)
+        self.assertEqual(stats['completed'], 2)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['max_pending'], 1)
+
+    def test_queue_full(self):
+        ex = HashExecutor('thread', workers=1, queue_size=0,
+                          queue_timeout=0.05)
+        self.addCleanup(ex.shutdown)
+        handler = BlockingHandler()
+        thr = threading.Thread(target=ex.run,
+                               args=(handler, 'hash', 'user', 'pw'))
+        thr.start()
+        try:
+            with self.assertRaises(HashQueueFull):
+                ex.run(handler, 'hash', 'user', 'pw2')
+        finally:
+            handler.event.set()
+            thr.join()
+        self.assertEqual(ex.stats()['rejected'], 1)
+        self.assertEqual(ex.run(handler, 'hash', 'user', 'pw3'), 'pw3')
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            HashExecutor('bogus')
+
+    def test_process_fallback(self):
+        with mock.patch('netprofile.common.crypto.ProcessPoolExecutor',
+                        side_effect=NotImplementedError):
+            ex = HashExecutor('process', workers=1)
+            self.addCleanup(ex.shutdown)
+            handler = BlockingHandler()
+            handler.event.set()
+            self.assertEqual(ex.run(handler, 'hash', 'user', 'pw'), 'pw')
+        self.assertEqual(ex.stats()['mode'], 'thread')
+
+
+class TestPasswordHashing(unittest.TestCase):
+    def setUp(self):
+        self.handlers = dict(crypto._HANDLERS)
+        self.enabled = dict(crypto._ENABLED_HANDLERS)
+        self.defaults = dict(crypto._DEFAULT_HANDLERS)
+        self.executor = crypto._EXECUTOR
+        self.config = testing.setUp(settings=_SETTINGS)
+        crypto.includeme(self.config)
+
+    def tearDown(self):
+        crypto._EXECUTOR.shutdown()
+        crypto._EXECUTOR = self.executor
+        crypto._HANDLERS.clear()
+        crypto._HANDLERS.update(self.handlers)
+        crypto._ENABLED_HANDLERS.clear()
+        crypto._ENABLED_HANDLERS.update(self.enabled)
+        crypto._DEFAULT_HANDLERS.clear()
+        crypto._DEFAULT_HANDLERS.update(self.defaults)
+        testing.tearDown()
+
+    def test_offloaded(self):
+        hashed = hash_password('user', 'secret')
+        self.assertTrue(hashed.startswith('scrypt$'))
+        self.assertTrue(verify_password('user', 'secret', hashed))
+        self.assertFalse(verify_password('user', 'wrong', hashed))
+        stats = get_hash_stats()
+        self.assertEqual(stats['mode'], 'thread')
+        self.assertEqual(stats['workers'], 2)
+        self.assertEqual(stats['completed'], 3)
+
+    def test_cheap_inline(self):
+        hashed = hash_password('user', 'secret', scheme='plain')
+        self.assertEqual(hashed, 'secret')
+        self.assertTrue(verify_password('user', 'secret', hashed,
+                                        scheme='plain'))
+        self.assertEqual(get_hash_stats()['submitted'], 0)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for cache invalidation bus
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+
+# Test body begins here
+
+import json
+import os
+
+from netprofile.common import invalidation
+from netprofile.common.invalidation import (
+    LocalInvalidationBus,
+    RedisInvalidationBus,
+    configure_bus
+)
+
+
+class TestLocalInvalidationBus(unittest.TestCase):
+    def setUp(self):
+        self.bus = LocalInvalidationBus()
+        self.calls = []
+        self.bus.subscribe('ch1', self.calls.append)
+
+    def test_publish(self):
+        self.bus.publish('ch1', 42)
+        self.bus.publish('ch1')
+        self.bus.publish('ch2', 1)
+        self.assertEqual(self.calls, [42, None])
+        self.assertTrue(self.bus.active)
+
+    def test_subscribe_once(self):
+        self.bus.subscribe('ch1', self.calls.append)
+        self.bus.publish('ch1', 1)
+        self.assertEqual(self.calls, [1])
+        self.bus.unsubscribe('ch1', self.calls.append)
+        self.bus.publish('ch1', 2)
+        self.assertEqual(self.calls, [1])
+
+    def test_handler_error(self):
+        failing = mock.MagicMock(side_effect=RuntimeError)
+        self.bus.subscribe('ch1', failing)
+        self.bus.subscribe('ch1', self.calls.append)
+        self.bus.publish('ch1', 3)
+        failing.assert_called_once_with(3)
+        self.assertEqual(self.calls, [3])
+
+    def test_dispatch_all(self):
+        other = []
+        self.bus.subscribe('ch2', other.append)
+        self.bus.dispatch_all()
+        self.assertEqual(self.calls, [None])
+        self.assertEqual(other, [None])
+
+    def test_module_functions(self):
+        with mock.patch.object(invalidation, 'bus', None):
+            invalidation.subscribe('ch1', self.calls.append)
+            invalidation.publish('ch1', 1)
+        with mock.patch.object(invalidation, 'bus', self.bus):
+            invalidation.publish('ch1', 2)
+        self.assertEqual(self.calls, [2])
+
+
+class TestRedisInvalidationBus(unittest.TestCase):
+    def setUp(self):
+        self.bus = RedisInvalidationBus('test.chan', host='localhost')
+        self.bus._client = mock.MagicMock()
+        self.bus._pid = os.getpid()
+        self.calls = []
+        self.bus.subscribe('ch1', self.calls.append)
+
+    def _message(self, **kwargs):
+        return {'type': 'message',
+                'data': json.dumps(kwargs).encode('utf-8')}
+
+    def test_publish(self):
+        self.bus.publish('ch1', 5)
+        self.assertEqual(self.calls, [5])
+        chan, data = self.bus._client.publish.call_args[0]
+        self.assertEqual(chan, 'test.chan')
+        self.assertEqual(json.loads(data), {'origin': self.bus.origin,
+                                            'channel': 'ch1',
+                                            'key': 5})
+
+    def test_handle_message(self):
+        self.bus.handle_message(self._message(origin='other',
+                                              channel='ch1',
+                                              key=7))
+        self.bus.handle_message(self._message(origin=self.bus.origin,
+                                              channel='ch1',
+                                              key=8))
+        self.bus.handle_message({'type': 'message', 'data': b'garbage'})
+        self.bus.handle_message({'type': 'subscribe', 'data': 1})
+        self.assertEqual(self.calls, [7])
+
+    def test_inactive_without_listener(self):
+        with mock.patch('threading.Thread') as thr:
+            self.assertFalse(self.bus.active)
+            self.assertFalse(self.bus.active)
+        thr.return_value.start.assert_called_once_with()
+
+
+class TestConfigureBus(unittest.TestCase):
+    def test_backends(self):
+        self.assertIsNone(configure_bus({}))
+        self.assertIsInstance(
+                configure_bus({'netprofile.invalidation.backend': 'local'}),
+                LocalInvalidationBus)
+        bus = configure_bus({
+            'netprofile.invalidation.backend': 'redis',
+            'netprofile.invalidation.redis.host': 'example.com',
+            'netprofile.invalidation.redis.port': '6380'
+        })
+        self.assertIsInstance(bus, RedisInvalidationBus)
+        self.assertEqual(bus.channel, 'netprofile.invalidate')
+        self.assertEqual(bus.conf, {'host': 'example.com', 'port': 6380})
+        with self.assertRaises(ValueError):
+            configure_bus({'netprofile.invalidation.backend': 'bogus'})
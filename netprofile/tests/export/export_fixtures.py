@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Shared fixtures for export tests
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+from sqlalchemy import (
+    Column,
+    create_engine
+)
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from netprofile.db.fields import (
+    ASCIIString,
+    UInt32
+)
+
+
+def _row_str(self):
+    return self.name
+
+
+def make_row_model(grid_view=('rowid', 'name'), **columns):
+    """
+    Declare a model for test_export_rows table with its own metadata.
+
+    Every row has an ID and a name, other columns are passed as keyword
+    arguments.
+    """
+    attrs = {
+        '__tablename__':  'test_export_rows',
+        '__table_args__': ({
+            'info': {
+                'grid_view': grid_view
+            }
+        },),
+        'id':             Column('rowid', UInt32(), primary_key=True),
+        'name':           Column(ASCIIString(32), nullable=False),
+        '__str__':        _row_str
+    }
+    attrs.update(columns)
+    return type(str('Row'), (declarative_base(),), attrs)
+
+
+class ExportTestCase(unittest.TestCase):
+    """
+    Fills model table in an in-memory SQLite database, and prepares
+    a request which passes all permission checks.
+    """
+    model = None
+    rows = 250
+    settings = None
+
+    def row_values(self, idx):
+        return {}
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        self.model.metadata.create_all(engine)
+        self.sess = sessionmaker(bind=engine)()
+        self.sess.add_all(self.model(id=idx,
+                                     name='row%03d' % idx,
+                                     **self.row_values(idx))
+                          for idx in range(1, self.rows + 1))
+        self.sess.flush()
+        self.config = testing.setUp(settings=self.settings)
+        self.addCleanup(testing.tearDown)
+        self.req = testing.DummyRequest()
+        self.req.run_hook = mock.MagicMock()
+        self.req.has_permission = mock.MagicMock(return_value=True)
+
+    def tearDown(self):
+        self.sess.close()
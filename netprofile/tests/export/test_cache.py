@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for export result cache
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+import datetime as dt
+import shutil
+import tempfile
+
+from pyramid.response import Response
+from sqlalchemy import (
+    Column,
+    TIMESTAMP
+)
+from sqlalchemy.ext.declarative import declarative_base
+
+from export_fixtures import (
+    ExportTestCase,
+    make_row_model
+)
+from netprofile.db.ddl import CurrentTimestampDefault
+from netprofile.db.fields import UInt32
+from netprofile.export import ExportFormat
+from netprofile.export.cache import (
+    cached_export,
+    get_change_token
+)
+from netprofile.ext.data import ExtModel
+
+Row = make_row_model(mtime=Column(TIMESTAMP(),
+                                  CurrentTimestampDefault(on_update=True),
+                                  nullable=False))
+
+
+class Plain(declarative_base()):
+    __tablename__ = 'test_export_plain'
+    id = Column('rowid', UInt32(), primary_key=True)
+
+
+class DummyFormat(ExportFormat):
+    def __init__(self):
+        self.calls = 0
+
+    def export(self, extm, params, req):
+        self.calls += 1
+        res = Response(content_type='text/plain', charset='UTF-8')
+        res.content_disposition = 'attachment; filename=rows.txt'
+        res.app_iter = iter((b'call ', str(self.calls).encode()))
+        return res
+
+
+class TestExportCache(ExportTestCase):
+    model = Row
+    rows = 1
+
+    def row_values(self, idx):
+        return {'mtime': dt.datetime(2017, 1, 1)}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.settings = {
+            'netprofile.export.cache.directory': self.directory
+        }
+        super(TestExportCache, self).setUp()
+        self.req.user = mock.MagicMock(id=1, flat_privileges={'A': True})
+        patcher = mock.patch('netprofile.export.cache.DBSession',
+                             return_value=self.sess)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fmt = DummyFormat()
+
+    def _export(self, model=Row, params=None):
+        res = cached_export(self.fmt, 'dummy', ExtModel(model),
+                            params or {'__start': 0}, self.req)
+        body = b''.join(res.app_iter)
+        close = getattr(res.app_iter, 'close', None)
+        if callable(close):
+            close()
+        return res, body
+
+    def test_change_token(self):
+        self.assertIsNone(get_change_token(self.sess, ExtModel(Plain), {}))
+        token = get_change_token(self.sess, ExtModel(Row), {})
+        self.sess.query(Row).get(1).mtime = dt.datetime(2017, 1, 2)
+        self.assertNotEqual(get_change_token(self.sess, ExtModel(Row), {}),
+                            token)
+
+    def test_filtered_change_token(self):
+        params = {'__filter': [{'property': 'name', 'value': 'row001'}]}
+        token = get_change_token(self.sess, ExtModel(Row), params)
+        # Rows outside of the filter don't matter.
+        self.sess.add(Row(id=2, name='other', mtime=dt.datetime(2017, 1, 3)))
+        self.assertEqual(get_change_token(self.sess, ExtModel(Row), params),
+                         token)
+        self.sess.query(Row).get(2).name = 'row001'
+        self.assertNotEqual(
+                get_change_token(self.sess, ExtModel(Row), params), token)
+
+    def test_cached(self):
+        self.assertEqual(self._export()[1], b'call 1')
+        # Paging parameters are ignored.
+        res, body = self._export(params={'__start': 25})
+        self.assertEqual(body, b'call 1')
+        self.assertEqual(res.content_type, 'text/plain')
+        self.assertEqual(res.content_disposition,
+                         'attachment; filename=rows.txt')
+        self.assertEqual(self.fmt.calls, 1)
+        # Different parameters and privileges get separate entries.
+        self.assertEqual(self._export(params={'x': 1})[1], b'call 2')
+        self.req.user.flat_privileges = {'A': True, 'B': True}
+        self.assertEqual(self._export()[1], b'call 3')
+        # Data changes invalidate cached results.
+        self.sess.add(Row(id=2, name='second',
+                          mtime=dt.datetime(2017, 1, 1)))
+        self.assertEqual(self._export()[1], b'call 4')
+
+    def test_not_cached(self):
+        self.assertEqual(self._export(Plain)[1], b'call 1')
+        self.assertEqual(self._export(Plain)[1], b'call 2')
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for CSV export
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+from export_fixtures import (
+    ExportTestCase,
+    make_row_model
+)
+from netprofile.export import ExportFormat
+from netprofile.export.csv import (
+    CSVExportFormat,
+    csv_generator
+)
+from netprofile.ext.data import ExtModel
+
+Row = make_row_model()
+
+
+class TestCSVExport(ExportTestCase):
+    model = Row
+
+    def test_generator_batches(self):
+        rows = ({'a': idx, 'b': 'x'} for idx in range(250))
+        chunks = list(csv_generator(rows, ('a', 'b'), 'unix',
+                                    encoding='utf_16', batch=100))
+        self.assertEqual(len(chunks), 3)
+        text = b''.join(chunks).decode('utf_16')
+        self.assertNotIn('\0', text)
+        self.assertEqual(text.splitlines()[-1], '"249","x"')
+
+    def test_export_streams(self):
+        self.sess.close = mock.MagicMock()
+        with mock.patch('netprofile.export.csv.get_detached_session',
+                        return_value=self.sess):
+            res = CSVExportFormat().export(ExtModel(Row), {
+                'csv_dialect': 'unix',
+                '__start':     0,
+                '__limit':     10
+            }, self.req)
+            self.assertEqual(res.content_type, 'text/csv')
+            it = iter(res.app_iter)
+            first = next(it)
+            self.sess.close.assert_not_called()
+            body = first + b''.join(it)
+        self.sess.close.assert_called_once_with()
+        lines = body.decode().splitlines()
+        self.assertEqual(len(lines), 251)
+        self.assertEqual(lines[-1], '"250","row250"')
+
+    def test_export_fails_early(self):
+        self.sess.close = mock.MagicMock()
+        extm = ExtModel(Row)
+        with mock.patch('netprofile.export.csv.get_detached_session',
+                        return_value=self.sess), \
+                mock.patch.object(extm, '_compile_filters',
+                                  side_effect=ValueError('Bad filter')):
+            with self.assertRaises(ValueError):
+                CSVExportFormat().export(extm, {'csv_dialect': 'unix'},
+                                         self.req)
+        self.sess.close.assert_called_once_with()
+
+    def test_background_option(self):
+        self.req.settings = {}
+
+        def _names(fmt):
+            panel = fmt.export_panel(self.req, 'csv')
+            return [item['name'] for item in panel['items']]
+
+        self.assertIn('__background', _names(CSVExportFormat()))
+        self.assertNotIn('__background', _names(ExportFormat()))
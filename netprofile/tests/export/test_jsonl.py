@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for JSON Lines export
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+import datetime as dt
+import decimal
+import gzip
+import json
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Numeric
+)
+
+from export_fixtures import (
+    ExportTestCase,
+    make_row_model
+)
+from netprofile.db.fields import IPv4Address
+from netprofile.export.jsonl import (
+    JSONLinesExportFormat,
+    jsonl_generator
+)
+from netprofile.ext.data import ExtModel
+
+Row = make_row_model(('rowid', 'name', 'addr', 'amount', 'ctime'),
+                     addr=Column(IPv4Address(), nullable=True),
+                     amount=Column(Numeric(20, 8), nullable=False),
+                     ctime=Column(DateTime(), nullable=False))
+
+
+class TestJSONLinesExport(ExportTestCase):
+    model = Row
+
+    def row_values(self, idx):
+        return {
+            'addr':   0x0a000000 + idx if idx % 2 else None,
+            'amount': decimal.Decimal(idx) / 4,
+            'ctime':  dt.datetime(2017, 1, 1, 0, idx % 60)
+        }
+
+    def _export(self, params):
+        self.sess.close = mock.MagicMock()
+        with mock.patch('netprofile.export.jsonl.get_detached_session',
+                        return_value=self.sess):
+            res = JSONLinesExportFormat().export(ExtModel(Row), params,
+                                                 self.req)
+            body = b''.join(res.app_iter)
+        self.sess.close.assert_called_once_with()
+        return res, body
+
+    def test_generator_batches(self):
+        rows = ({'a': idx} for idx in range(250))
+        chunks = list(jsonl_generator(rows, ('a',), (int,), batch=100))
+        self.assertEqual(len(chunks), 3)
+        lines = b''.join(chunks).decode().splitlines()
+        self.assertEqual(len(lines), 250)
+        self.assertEqual(lines[-1], '{"a":249}')
+
+    def test_export_typed(self):
+        res, body = self._export({'jsonl_compression': 'none'})
+        self.assertEqual(res.content_type, 'application/x-ndjson')
+        lines = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(len(lines), 250)
+        ctime = lines[0].pop('ctime')
+        self.assertTrue(ctime.startswith('2017-01-01T00:01:00'))
+        self.assertEqual(lines[0], {
+            'rowid':  1,
+            'name':   'row001',
+            'addr':   '10.0.0.1',
+            'amount': 0.25
+        })
+        self.assertIsNone(lines[1]['addr'])
+
+    def test_export_gzip(self):
+        res, body = self._export({})
+        self.assertEqual(res.content_type, 'application/gzip')
+        self.assertIn('.jsonl.gz', res.content_disposition)
+        lines = gzip.decompress(body).decode().splitlines()
+        self.assertEqual(len(lines), 250)
+        self.assertEqual(json.loads(lines[-1])['name'], 'row250')
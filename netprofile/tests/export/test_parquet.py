@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for Parquet export
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+import datetime as dt
+import io
+
+from sqlalchemy import (
+    Column,
+    DateTime
+)
+
+from export_fixtures import (
+    ExportTestCase,
+    make_row_model
+)
+from netprofile.export.parquet import (
+    ParquetExportFormat,
+    pyarrow
+)
+from netprofile.ext.data import ExtModel
+
+Row = make_row_model(('rowid', 'name', 'ctime'),
+                     ctime=Column(DateTime(), nullable=True))
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestParquetExport(ExportTestCase):
+    model = Row
+
+    def row_values(self, idx):
+        if idx % 2:
+            return {'ctime': dt.datetime(2017, 1, 1, 0, idx % 60)}
+        return {'ctime': None}
+
+    def test_export(self):
+        with mock.patch('netprofile.ext.data.DBSession',
+                        return_value=self.sess), \
+                mock.patch('netprofile.export.parquet.DEFAULT_BATCH_ROWS',
+                           100):
+            res = ParquetExportFormat().export(ExtModel(Row), {
+                'parquet_compression': 'gzip'
+            }, self.req)
+        body = b''.join(res.app_iter)
+        self.assertEqual(len(body), res.content_length)
+        pqfile = pyarrow.parquet.ParquetFile(io.BytesIO(body))
+        self.assertEqual(pqfile.metadata.num_rows, 250)
+        self.assertEqual(pqfile.schema.to_arrow_schema().types, [
+            pyarrow.int64(), pyarrow.string(), pyarrow.timestamp('us')])
+        table = pqfile.read()
+        self.assertEqual(table.column('name')[249].as_py(), 'row250')
+        self.assertIsNone(table.column('ctime')[1].as_py())
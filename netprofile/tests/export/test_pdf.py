@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for PDF export
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+from pyramid.i18n import TranslationString
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import LongTable
+from export_fixtures import (
+    ExportTestCase,
+    make_row_model
+)
+from netprofile.export.pdf import (
+    PDFExportFormat,
+    RowLimitExceeded,
+    tablemaker
+)
+from netprofile.ext.data import ExtModel
+from netprofile.pdf import DefaultDocTemplate
+
+Row = make_row_model()
+
+
+def _get_styles():
+    ss = getSampleStyleSheet()
+    return {
+        'body':         ss['Normal'],
+        'table_header': ss['Heading6']
+    }
+
+
+class TestPDFExport(ExportTestCase):
+    model = Row
+    settings = {
+        'netprofile.export.pdf.table_rows': '40'
+    }
+
+    def setUp(self):
+        super(TestPDFExport, self).setUp()
+        self.req.current_locale = 'en'
+        self.req.pdf_styles = _get_styles()
+        self.req.user = None
+
+    def test_tablemaker(self):
+        rows = ({'a': idx, 'b': 'x'} for idx in range(250))
+        flddef = (mock.MagicMock(header_string='A'),
+                  mock.MagicMock(header_string='B'))
+        tables = list(tablemaker(rows, ('a', 'b'), flddef, (100, 100),
+                                 localizer=self.req.localizer,
+                                 model=mock.MagicMock(),
+                                 styles=self.req.pdf_styles,
+                                 table_rows=100))
+        self.assertEqual([len(tbl._cellvalues) for tbl in tables],
+                         [101, 101, 51])
+        rows = ({'a': idx, 'b': 'x'} for idx in range(250))
+        with self.assertRaises(RowLimitExceeded):
+            list(tablemaker(rows, ('a', 'b'), flddef, (100, 100),
+                            styles=self.req.pdf_styles,
+                            table_rows=100, max_rows=200))
+
+    def test_export(self):
+        with mock.patch('netprofile.ext.data.DBSession',
+                        return_value=self.sess), \
+                mock.patch('netprofile.pdf.DEFAULT_FONT', 'Helvetica'), \
+                mock.patch('netprofile.export.pdf.LongTable',
+                           wraps=LongTable) as table:
+            res = PDFExportFormat().export(ExtModel(Row), {
+                '__start': 0,
+                '__limit': 10
+            }, self.req)
+        self.assertEqual(res.content_type, 'application/pdf')
+        self.assertEqual(table.call_count, 7)
+        body = b''.join(res.app_iter)
+        self.assertEqual(len(body), res.content_length)
+        self.assertTrue(body.startswith(b'%PDF-'))
+
+    def test_row_limit(self):
+        self.req.registry.settings['netprofile.export.pdf.max_rows'] = '100'
+        with mock.patch('netprofile.ext.data.DBSession',
+                        return_value=self.sess), \
+                mock.patch('netprofile.pdf.DEFAULT_FONT', 'Helvetica'), \
+                mock.patch.object(self.req, 'localizer') as loc:
+            loc.translate.side_effect = (
+                    lambda ts: '*' + TranslationString(ts).interpolate())
+            with self.assertRaisesRegex(RowLimitExceeded,
+                                        r'^\*Too many .* limit is 100\.'):
+                PDFExportFormat().export(ExtModel(Row), {}, self.req)
+
+    def test_incremental_build(self):
+        events = []
+        handle = DefaultDocTemplate.handle_flowable
+
+        def _table(*args, **kwargs):
+            events.append('table')
+            return LongTable(*args, **kwargs)
+
+        def _handle(doc, flowables):
+            events.append('layout')
+            return handle(doc, flowables)
+
+        with mock.patch('netprofile.ext.data.DBSession',
+                        return_value=self.sess), \
+                mock.patch('netprofile.pdf.DEFAULT_FONT', 'Helvetica'), \
+                mock.patch('netprofile.export.pdf.LongTable',
+                           side_effect=_table), \
+                mock.patch.object(DefaultDocTemplate, 'handle_flowable',
+                                  _handle):
+            PDFExportFormat().export(ExtModel(Row), {}, self.req)
+        self.assertEqual(events.count('table'), 7)
+        # First table is laid out before the next one is generated.
+        self.assertLess(events.index('layout'), events.index('table', 1))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Benchmark for ExtDirect response encoding
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+# Run from the distribution root as:
+#   PYTHONPATH=. python tests/ext/bench_direct.py [rows] [repeat]
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import datetime as dt
+import decimal
+import ipaddress
+import json
+import sys
+import timeit
+
+import mock
+from pyramid import testing
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Numeric,
+    create_engine
+)
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from netprofile.db.fields import (
+    ASCIIString,
+    DeclEnum,
+    IPv4Address,
+    UInt32
+)
+from netprofile.ext.data import ExtModel
+from netprofile.ext.direct import (
+    JsonReprEncoder,
+    json_dumps,
+    set_json_backend
+)
+
+ModelBase = declarative_base()
+
+
+class BenchState(DeclEnum):
+    active = 'A', 'Active', 10
+    blocked = 'B', 'Blocked', 20
+
+
+class BenchRow(ModelBase):
+    __tablename__ = 'bench_rows'
+    id = Column('rowid', UInt32(), primary_key=True)
+    name = Column(ASCIIString(32), nullable=False)
+    state = Column(BenchState.db_type(), nullable=False)
+    addr = Column(IPv4Address(), nullable=False)
+    amount = Column(Numeric(20, 8), nullable=False)
+    ctime = Column(DateTime(), nullable=False)
+
+    def __str__(self):
+        return self.name
+
+
+def get_read_result(rows):
+    engine = create_engine('sqlite://')
+    ModelBase.metadata.create_all(engine)
+    sess = sessionmaker(bind=engine)()
+    now = dt.datetime(2017, 1, 1)
+    sess.add_all(BenchRow(id=idx,
+                          name='row%05d' % idx,
+                          state=BenchState.active,
+                          addr=ipaddress.IPv4Address(0x0a000000 + idx),
+                          amount=decimal.Decimal(idx) / 100,
+                          ctime=now + dt.timedelta(minutes=idx))
+                 for idx in range(1, rows + 1))
+    sess.flush()
+    req = testing.DummyRequest()
+    req.run_hook = mock.MagicMock()
+    req.has_permission = mock.MagicMock(return_value=True)
+    with mock.patch('netprofile.ext.data.DBSession', return_value=sess):
+        res = ExtModel(BenchRow).read({'__start': 0, '__limit': rows}, req)
+    return {
+        'type':   'rpc',
+        'tid':    1,
+        'action': 'BenchRow',
+        'method': 'read',
+        'result': res
+    }
+
+
+def main(rows=5000, repeat=10):
+    ret = get_read_result(rows)
+    print('Encoding read() result of %d rows, best of %d runs:' % (
+          len(ret['result']['records']), repeat))
+    timer = timeit.Timer(lambda: json.dumps(ret, cls=JsonReprEncoder))
+    print('  %-20s %8.2f ms' % ('JsonReprEncoder',
+                               min(timer.repeat(repeat, 1)) * 1000))
+    for backend in ('stdlib', 'orjson'):
+        try:
+            set_json_backend(backend)
+        except ImportError:
+            print('  %-20s %11s' % (backend, 'unavailable'))
+            continue
+        timer = timeit.Timer(lambda: json_dumps(ret))
+        print('  %-20s %8.2f ms' % ('json_dumps/' + backend,
+                                   min(timer.repeat(repeat, 1)) * 1000))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,475 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for ExtJS data API
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+import datetime as dt
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    create_engine
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import (
+    relationship,
+    sessionmaker
+)
+
+from netprofile.db.fields import (
+    ASCIIString,
+    UInt32
+)
+from netprofile.db.util import QueryCounter
+from netprofile.ext.data import (
+    ExtModel,
+    clear_descriptors
+)
+
+ModelBase = declarative_base()
+
+
+class Item(ModelBase):
+    __tablename__ = 'test_items'
+    __table_args__ = ({
+        'info': {
+            'default_sort': ({'property': 'name', 'direction': 'ASC'},),
+            'grid_view':    ('itemid', 'name'),
+            'easy_search':  ('name',)
+        }
+    },)
+    id = Column('itemid', UInt32(), primary_key=True)
+    name = Column(ASCIIString(32), nullable=False)
+
+    def __str__(self):
+        return self.name
+
+
+class Group(ModelBase):
+    __tablename__ = 'test_groups'
+    id = Column('groupid', UInt32(), primary_key=True)
+    name = Column(ASCIIString(32), nullable=False)
+
+    def __str__(self):
+        return self.name
+
+
+class Member(ModelBase):
+    __tablename__ = 'test_members'
+    __table_args__ = ({
+        'info': {
+            'grid_view': ('memberid', 'group')
+        }
+    },)
+    id = Column('memberid', UInt32(), primary_key=True)
+    group_id = Column('groupid', UInt32(), ForeignKey(Group.id),
+                      nullable=False)
+
+    group = relationship(Group)
+
+    def __str__(self):
+        return str(self.id)
+
+
+class Code(ModelBase):
+    __tablename__ = 'test_codes'
+    __table_args__ = (
+        Index('test_codes_u_code', 'code', unique=True),
+    )
+    id = Column('codeid', UInt32(), primary_key=True)
+    code = Column(ASCIIString(32), nullable=False)
+
+    def __str__(self):
+        return self.code
+
+
+class Event(ModelBase):
+    __tablename__ = 'test_events'
+    __table_args__ = ({
+        'info': {
+            'grid_view': ('ts', 'name')
+        }
+    },)
+    id = Column('eventid', UInt32(), primary_key=True)
+    ts = Column(DateTime(), nullable=True)
+    name = Column(ASCIIString(32), nullable=False)
+
+    def __str__(self):
+        return self.name
+
+
+class TestExtModelRead(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        ModelBase.metadata.create_all(engine)
+        self.sess = sessionmaker(bind=engine)()
+        for idx in range(1, 11):
+            # Duplicate names to exercise primary key tie-breaking.
+            self.sess.add(Item(id=idx, name='item%02d' % ((idx + 1) // 2)))
+        for idx in range(1, 4):
+            self.sess.add(Group(id=idx, name='group%d' % idx))
+            for midx in range(1, 4):
+                self.sess.add(Member(id=idx * 10 + midx, group_id=idx))
+        self.sess.flush()
+        self.req = testing.DummyRequest()
+        self.req.run_hook = mock.MagicMock()
+        self.req.has_permission = mock.MagicMock(return_value=True)
+        self.extm = ExtModel(Item)
+        patcher = mock.patch('netprofile.ext.data.DBSession',
+                             return_value=self.sess)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.sess.close()
+
+    def _read_all_keyset(self, params):
+        ids = []
+        params = dict(params, __after=None, __limit=3)
+        while True:
+            res = self.extm.read(params, self.req)
+            ids.extend(rec['itemid'] for rec in res['records'])
+            self.assertEqual(res['total'], 10)
+            if res['after'] is None:
+                break
+            params['__after'] = res['after']
+        return ids
+
+    def test_keyset_default_sort(self):
+        self.assertEqual(self._read_all_keyset({}), list(range(1, 11)))
+
+    def test_keyset_desc_sort(self):
+        ids = self._read_all_keyset({
+            '__sort': [{'property': 'name', 'direction': 'DESC'}]
+        })
+        self.assertEqual(ids, list(range(10, 0, -1)))
+
+    def test_keyset_mixed_sort(self):
+        ids = self._read_all_keyset({
+            '__sort': [{'property': 'name', 'direction': 'DESC'},
+                       {'property': 'itemid', 'direction': 'ASC'}]
+        })
+        self.assertEqual(ids, [9, 10, 7, 8, 5, 6, 3, 4, 1, 2])
+
+    def _read_events_keyset(self, direction):
+        extm = ExtModel(Event)
+        params = {'__sort':  [{'property': 'ts', 'direction': direction}],
+                  '__after': None,
+                  '__limit': 2}
+        rows = []
+        while True:
+            res = extm.read(params, self.req)
+            rows.extend((rec['ts'], rec['name']) for rec in res['records'])
+            if res['after'] is None:
+                break
+            params['__after'] = res['after']
+        return rows
+
+    def test_keyset_nullable(self):
+        base = dt.datetime(2017, 3, 26, 1, 30)
+        for idx in range(1, 8):
+            ts = None
+            if idx % 3:
+                ts = base + dt.timedelta(hours=idx // 2)
+            self.sess.add(Event(id=idx, ts=ts, name='event%d' % idx))
+        self.sess.flush()
+        rows = self._read_events_keyset('ASC')
+        self.assertEqual([name for ts, name in rows],
+                         ['event1', 'event2', 'event4', 'event5', 'event7',
+                          'event3', 'event6'])
+        self.assertEqual(rows[0][0], dt.datetime(2017, 3, 26, 1, 30))
+        rows = self._read_events_keyset('DESC')
+        self.assertEqual([name for ts, name in rows],
+                         ['event6', 'event3', 'event7', 'event5', 'event4',
+                          'event2', 'event1'])
+
+    def test_keyset_ignores_offset(self):
+        res = self.extm.read({'__after': None,
+                              '__start': 6,
+                              '__limit': 3}, self.req)
+        self.assertEqual([rec['itemid'] for rec in res['records']],
+                         [1, 2, 3])
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            self.extm.read({'__after': 'garbage', '__limit': 3}, self.req)
+
+    def test_offset_pagination(self):
+        res = self.extm.read({'__start': 3, '__limit': 3}, self.req)
+        self.assertEqual(len(res['records']), 3)
+        self.assertNotIn('after', res)
+
+    def test_total_exact(self):
+        res = self.extm.read({'__limit': 3}, self.req)
+        self.assertEqual(res['total'], 10)
+        self.assertTrue(res['total_exact'])
+
+    def test_filters(self):
+        res = self.extm.read({
+            '__filter': [{'property': 'itemid',
+                          'operator':  'gt',
+                          'value':     4},
+                         {'property': 'name',
+                          'operator':  'nstartswith',
+                          'value':     'item05'}],
+            '__sstr':   'item0'
+        }, self.req)
+        self.assertEqual(res['total'], 4)
+        self.assertEqual(sorted(rec['itemid'] for rec in res['records']),
+                         [5, 6, 7, 8])
+
+    def test_full_rows(self):
+        res = self.extm.read({'__limit': 1}, self.req)
+        self.assertEqual(res['records'],
+                         [{'itemid': 1, 'name': 'item01', '__str__': 'item01'}])
+        self.req.run_hook.assert_called_once()
+
+    def test_columnar_fields(self):
+        res = self.extm.read({'__fields': ['name'], '__limit': 2}, self.req)
+        self.assertEqual(res['records'], [{'name': 'item01'}] * 2)
+        self.req.run_hook.assert_not_called()
+        ids = self._read_all_keyset({'__fields': ['itemid']})
+        self.assertEqual(ids, list(range(1, 11)))
+
+    def test_iter_read(self):
+        params = {'__sort': [{'property': 'itemid', 'direction': 'DESC'}]}
+        rows = list(self.extm.iter_read(params, self.req, batch=3))
+        self.assertEqual(rows, self.extm.read(params, self.req)['records'])
+        rows = list(self.extm.iter_read({'__fields': ['name']}, self.req))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0], {'name': 'item01'})
+        rows = list(ExtModel(Member).iter_read({}, self.req, batch=2))
+        self.assertEqual(rows[0]['group'], 'group1')
+
+    def test_iter_read_eager(self):
+        with QueryCounter(self.sess.connection()) as counter:
+            rows = self.extm.iter_read({}, self.req, batch=3)
+            self.assertEqual(counter.count, 1)
+        self.assertEqual(len(list(rows)), 10)
+
+    def test_read_plan_memoized(self):
+        plan = self.extm._get_read_plan(self.req)
+        self.assertIs(plan, self.extm._get_read_plan(self.req))
+        self.assertEqual([entry[1] for entry in plan], ['itemid', 'name'])
+
+    def _count_member_queries(self):
+        self.sess.expunge_all()
+        with QueryCounter(self.sess.connection()) as counter:
+            res = ExtModel(Member).read({}, self.req)
+        self.assertEqual(len(res['records']), 9)
+        self.assertEqual(res['records'][0]['group'], 'group1')
+        return counter.count
+
+    def test_eager_load(self):
+        self.assertEqual(self._count_member_queries(), 2)
+        with mock.patch.dict(Member.__table__.info, eager_load=False):
+            self.assertEqual(self._count_member_queries(), 5)
+
+    def test_report(self):
+        res = self.extm.report({
+            '__groupby':    ['name'],
+            '__aggregates': [('max', 'itemid', 'maxid')],
+            '__having':     [{'property': 'maxid',
+                              'operator': 'gt',
+                              'value':    4}],
+            '__sort':       [{'property': 'maxid', 'direction': 'DESC'}],
+            '__start':      1,
+            '__limit':      2
+        }, self.req)
+        self.assertEqual(res['total'], 3)
+        self.assertEqual(res['records'], [{'name': 'item04', 'maxid': 8},
+                                          {'name': 'item03', 'maxid': 6}])
+
+    def test_report_total(self):
+        for params in ({}, {'__limit': 0}, {'__start': 0, '__limit': 2}):
+            params['__groupby'] = ['name']
+            res = self.extm.report(params, self.req)
+            self.assertEqual(res['total'], 5)
+            self.assertEqual(res['records'][0], {'name': 'item01', 'cnt': 2})
+
+    def test_iter_report(self):
+        rows = self.extm.iter_report({'__groupby': ['name'],
+                                      '__start':   1,
+                                      '__limit':   3}, self.req, batch=2)
+        rows = list(rows)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(list(rows[0].items()), [('cnt', 2),
+                                                 ('name', 'item02')])
+
+    def test_read_columns_memoized(self):
+        self.assertIs(self.extm.get_read_columns(),
+                      self.extm.get_read_columns())
+        self.assertIs(self.extm._get_read_trans(),
+                      self.extm._get_read_trans())
+
+    def test_descriptors_shared(self):
+        extm2 = ExtModel(Item)
+        self.extm.prepare()
+        self.assertIs(self.extm.get_columns(), extm2.get_columns())
+        self.assertIs(self.extm.get_form_columns(),
+                      extm2.get_form_columns())
+        self.assertIs(self.extm.get_column('name'), extm2.get_column('name'))
+        with self.assertRaises(ValueError):
+            self.extm.get_column('nonexistent')
+
+
+class TestExtModelWrite(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        ModelBase.metadata.create_all(engine)
+        self.sess = sessionmaker(bind=engine)()
+        self.sess.add(Code(id=1, code='existing'))
+        self.sess.flush()
+        self.req = testing.DummyRequest()
+        self.req.run_hook = mock.MagicMock()
+        self.req.has_permission = mock.MagicMock(return_value=True)
+        self.extm = ExtModel(Code)
+        patcher = mock.patch('netprofile.ext.data.DBSession',
+                             return_value=self.sess)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.sess.close()
+
+    def _create(self, codes):
+        return self.extm.create({'records': [
+            {'_clid': 'ext-%d' % idx, 'code': code}
+            for idx, code in enumerate(codes)
+        ]}, self.req)
+
+    def test_create_single(self):
+        res = self._create(['one', 'two'])
+        self.assertEqual(res['total'], 2)
+        self.assertEqual([rec['__str__'] for rec in res['records']],
+                         ['one', 'two'])
+        self.assertNotIn('errors', res)
+
+    def test_create_single_flush(self):
+        # Non-bulk writes flush every record as before, so a duplicate
+        # fails on the database and not in batch validation.
+        with mock.patch.object(self.extm, '_check_records') as check:
+            with self.assertRaises(IntegrityError):
+                self._create(['one', 'existing'])
+            check.assert_not_called()
+
+    def test_bulk_create(self):
+        codes = ['code%02d' % idx for idx in range(30)]
+        with mock.patch.object(self.sess, 'bulk_insert_mappings',
+                               wraps=self.sess.bulk_insert_mappings) as bim:
+            res = self._create(codes)
+            bim.assert_called_once()
+        self.assertTrue(res['success'])
+        self.assertEqual(res['total'], 30)
+        self.assertEqual(res['records'][0]['_clid'], 'ext-0')
+        self.assertEqual(res['records'][0]['__str__'], 'code00')
+        self.assertEqual(self.sess.query(Code).count(), 31)
+
+    def test_bulk_create_invalid(self):
+        codes = ['code%02d' % idx for idx in range(30)]
+        codes[5] = 'existing'
+        codes[7] = 'code06'
+        res = self._create(codes)
+        self.assertFalse(res['success'])
+        self.assertEqual(res['total'], 0)
+        self.assertEqual(sorted(err['_clid'] for err in res['errors']),
+                         ['ext-5', 'ext-6', 'ext-7'])
+        self.assertEqual(self.sess.query(Code).count(), 1)
+
+    def test_bulk_write_disabled(self):
+        codes = ['code%02d' % idx for idx in range(30)]
+        with mock.patch.dict(Code.__table__.info, bulk_write=False):
+            with mock.patch.object(self.sess,
+                                   'bulk_insert_mappings') as bim:
+                res = self._create(codes)
+        bim.assert_not_called()
+        self.assertEqual(res['total'], 30)
+
+    def test_bulk_update_delete(self):
+        res = self._create(['code%02d' % idx for idx in range(25)])
+        ids = [rec['codeid'] for rec in res['records']]
+        records = [{'codeid': pkey, 'code': 'new%02d' % idx}
+                   for idx, pkey in enumerate(ids)]
+        res = self.extm.update({'records': records + [
+            {'codeid': 1000, 'code': 'missing'}
+        ]}, self.req)
+        self.assertFalse(res['success'])
+        self.assertEqual(res['errors'][0]['codeid'], 1000)
+        self.assertEqual(self.sess.query(Code).filter(
+                Code.code.like('new%')).count(), 0)
+        res = self.extm.update({'records': records}, self.req)
+        self.assertEqual(res['total'], 25)
+        self.assertEqual(res['records'][3]['code'], 'new03')
+        res = self.extm.delete({'records': [
+            {'codeid': pkey} for pkey in ids
+        ]}, self.req)
+        self.assertEqual(res['total'], 25)
+        self.assertEqual(self.sess.query(Code).count(), 1)
+
+    def test_update_prefetch(self):
+        self._create(['one', 'two'])
+        self.sess.expunge_all()
+        with QueryCounter(self.sess.connection()) as counter:
+            res = self.extm.update({'records': [
+                {'codeid': 2, 'code': 'uno'},
+                {'codeid': 3, 'code': 'dos'}
+            ]}, self.req)
+        self.assertEqual(res['total'], 2)
+        # Objects are prefetched in one query.
+        self.assertEqual(counter.count, 1)
+
+
+class TestExtColumn(unittest.TestCase):
+    def test_derived_properties(self):
+        col = ExtModel(Item).get_column('name')
+        with self.assertRaises(AttributeError):
+            col.some_attribute = True
+        self.assertEqual(col.length, 32)
+        self.assertEqual(col.pixels, 300)
+        self.assertEqual(col.js_type, 'string')
+        self.assertIsNone(col.bit_length)
+        self.assertIsNone(col.column_xtype)
+        col = ExtModel(Item).get_column('itemid')
+        self.assertEqual(col.length, 10)
+        self.assertEqual(col.pixels, 100)
+        self.assertEqual(col.js_type, 'int')
+        self.assertEqual(col.bit_length, 32)
+        self.assertEqual(col.column_xtype, 'numbercolumn')
+        self.assertEqual(col.name, 'itemid')
+
+    def test_shared_descriptors(self):
+        col = ExtModel(Item).get_column('name')
+        self.assertIs(ExtModel(Item).get_column('name'), col)
+        clear_descriptors((Group,))
+        self.assertIs(ExtModel(Item).get_column('name'), col)
+        clear_descriptors()
+        self.assertIsNot(ExtModel(Item).get_column('name'), col)
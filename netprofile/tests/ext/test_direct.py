@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for ExtDirect router
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+import datetime as dt
+import decimal
+import ipaddress
+import json
+import threading
+import time
+
+from dateutil.tz import tzutc
+from pyramid.events import ContextFound
+from pyramid.threadlocal import get_current_request
+from webob import Request
+
+from netprofile.ext.direct import (
+    ExtDirectRouter,
+    IExtDirectRouter,
+    api_view,
+    json_dumps,
+    register_json_type,
+    set_json_backend
+)
+
+
+class Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class Symbol(decimal.Decimal):
+    def __json__(self):
+        return 'symbol'
+
+
+class TestExtDirectRouter(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+        self.addCleanup(testing.tearDown)
+        # Worker requests get request methods from the registry.
+        self.config.add_request_method(lambda req: None, str('user'),
+                                       reify=True)
+        self.threads = []
+        self.router = ExtDirectRouter(parallel_workers=4)
+        self.addCleanup(self.router.executor.shutdown)
+        self.router.add_action('Test',
+                               method_name='read',
+                               callback=self._callback('read'),
+                               numargs=1,
+                               accepts_files=False,
+                               parallel=True)
+        self.router.add_action('Test',
+                               method_name='update',
+                               callback=self._callback('update'),
+                               numargs=1,
+                               accepts_files=False)
+        patcher = mock.patch('netprofile.ext.direct.DBSession')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _callback(self, name):
+        def _cb(value):
+            self.threads.append((name, value, threading.current_thread()))
+            return '%s:%s' % (name, value)
+        return _cb
+
+    def _route(self, calls, allow=True, session=None, **attrs):
+        req = testing.DummyRequest(body=json.dumps([
+            {'action': 'Test', 'method': meth, 'data': [value], 'tid': tid}
+            for tid, (meth, value) in enumerate(calls, 1)
+        ]).encode())
+        req.get_csrf = mock.MagicMock(return_value='token')
+        req.ext_csrf = 'token'
+        req.user = None
+        if session is not None:
+            req.session = session
+        for attr, value in attrs.items():
+            setattr(req, attr, value)
+        self.request = req
+        self.perm_threads = []
+
+        def _has_permission(perm):
+            self.perm_threads.append(threading.current_thread())
+            return allow
+
+        req.has_permission = _has_permission
+        body, is_form = self.router.route(req)
+        self.assertFalse(is_form)
+        return json.loads(body)
+
+    def test_parallel_order(self):
+        res = self._route([('read', 1), ('read', 2), ('update', 3),
+                           ('read', 4)])
+        self.assertEqual([ret['tid'] for ret in res], [1, 2, 3, 4])
+        self.assertEqual([ret['result'] for ret in res],
+                         ['read:1', 'read:2', 'update:3', 'read:4'])
+        main = threading.current_thread()
+        threads = dict((value, thr) for name, value, thr in self.threads)
+        self.assertIsNot(threads[1], main)
+        self.assertIsNot(threads[2], main)
+        # Calls after a modifying call are run in request thread.
+        self.assertIs(threads[3], main)
+        self.assertIs(threads[4], main)
+
+    def test_parallel_request_state(self):
+        found = []
+        self.config.add_subscriber(
+                lambda ev: found.append(threading.current_thread()),
+                ContextFound)
+
+        def _cb(value, request):
+            self.threads.append(('ctx', value, threading.current_thread()))
+            return [get_current_request() is request,
+                    request.session.get('key')]
+
+        self.router.add_action('Test',
+                               method_name='ctx',
+                               callback=_cb,
+                               numargs=1,
+                               accepts_files=False,
+                               request_as_last_param=True,
+                               parallel=True)
+        res = self._route([('ctx', 1), ('ctx', 2)],
+                          session=testing.DummySession(key='value'))
+        self.assertEqual([ret['result'] for ret in res],
+                         [[True, 'value'], [True, 'value']])
+        main = threading.current_thread()
+        self.assertEqual(len(found), 2)
+        self.assertNotIn(main, found)
+        self.assertIsNone(get_current_request())
+
+    def test_parallel_request_copy(self):
+        requests = []
+
+        def _cb(value, request):
+            requests.append(request)
+            return [request.identity is ident, request.user]
+
+        self.router.add_action('Test',
+                               method_name='ctx',
+                               callback=_cb,
+                               numargs=1,
+                               accepts_files=False,
+                               request_as_last_param=True,
+                               parallel=True)
+        ident = mock.NonCallableMock(sess_timeout=None)
+        res = self._route([('ctx', 1), ('ctx', 2)], identity=ident,
+                          user=mock.sentinel.user)
+        self.assertEqual(len(requests), 2)
+        self.assertIsNot(requests[0], requests[1])
+        self.assertNotIn(self.request, requests)
+        # Identity is shared, but ORM user is not.
+        self.assertEqual([ret['result'] for ret in res],
+                         [[True, None], [True, None]])
+
+    def test_parallel_before_update(self):
+        started = threading.Event()
+
+        def _read(value):
+            started.set()
+            # Update must not start until this read is done.
+            time.sleep(0.05)
+            self.threads.append(('read', value, None))
+            return value
+
+        def _update(value):
+            started.wait(1)
+            self.threads.append(('update', value, None))
+            return value
+
+        self.router.add_action('Test',
+                               method_name='read',
+                               callback=_read,
+                               numargs=1,
+                               accepts_files=False,
+                               parallel=True)
+        self.router.add_action('Test',
+                               method_name='update',
+                               callback=_update,
+                               numargs=1,
+                               accepts_files=False)
+        self._route([('read', 1), ('update', 2), ('read', 3)])
+        self.assertEqual([(name, value) for name, value, thr
+                          in self.threads],
+                         [('read', 1), ('update', 2), ('read', 3)])
+
+    def test_parallel_access_checks(self):
+        res = self._route([('read', 1), ('read', 2)], allow=False)
+        self.assertEqual([ret['type'] for ret in res],
+                         ['exception', 'exception'])
+        self.assertEqual(self.threads, [])
+        # Permissions are checked in request thread only.
+        main = threading.current_thread()
+        self.assertEqual(self.perm_threads, [main, main])
+
+    def test_single_call(self):
+        res = self._route([('read', 1)])
+        self.assertEqual(res['result'], 'read:1')
+        self.assertIs(self.threads[0][2], threading.current_thread())
+
+    def test_api_view(self):
+        config = testing.setUp()
+        self.addCleanup(testing.tearDown)
+        config.registry.registerUtility(self.router, IExtDirectRouter)
+        req = testing.DummyRequest()
+        resp = api_view(req)
+        self.assertIn('"name": "read"', resp.text)
+        with mock.patch.object(self.router, 'dump_api') as dump_api:
+            self.assertEqual(api_view(req).etag, resp.etag)
+            dump_api.assert_not_called()
+        cond = Request.blank('/', headers={'If-None-Match': '"%s"' % (
+                             resp.etag,)}).get_response(resp)
+        self.assertEqual(cond.status_int, 304)
+        self.router.add_action('Test',
+                               method_name='create',
+                               callback=self._callback('create'),
+                               numargs=1,
+                               accepts_files=False)
+        resp2 = api_view(req)
+        self.assertNotEqual(resp2.etag, resp.etag)
+        self.assertIn('"name": "create"', resp2.text)
+
+    def test_api_cache_key(self):
+        req = testing.DummyRequest()
+        body, etag = self.router.get_api(req, [('core', '1.0')])
+        with mock.patch.object(self.router, 'dump_api',
+                               return_value=body) as dump_api:
+            self.assertEqual(self.router.get_api(req, [('core', '1.0')]),
+                             (body, etag))
+            dump_api.assert_not_called()
+            _, etag2 = self.router.get_api(req, [('core', '1.0'),
+                                                 ('stashes', '1.0')])
+            self.assertNotEqual(etag2, etag)
+            self.router.invalidate_api()
+            _, etag3 = self.router.get_api(req, [('core', '1.0')])
+            self.assertNotEqual(etag3, etag)
+            self.assertEqual(dump_api.call_count, 2)
+
+
+class TestJSONEncoding(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        register_json_type(Point, lambda obj: [obj.x, obj.y])
+
+    def setUp(self):
+        self.addCleanup(set_json_backend, 'auto')
+
+    def _check(self):
+        data = [
+            dt.datetime(2017, 1, 2, 3, 4, 5, tzinfo=tzutc()),
+            dt.date(2017, 1, 2),
+            decimal.Decimal('1.50'),
+            ipaddress.IPv4Address('10.0.0.1'),
+            b'\x01\xff',
+            Symbol('1')
+        ]
+        self.assertEqual(json.loads(json_dumps(data)), [
+            '2017-01-02T03:04:05+00:00',
+            '2017-01-02',
+            '1.50',
+            167772161,
+            '01ff',
+            'symbol'
+        ])
+        with self.assertRaises(TypeError):
+            json_dumps(object())
+        self.assertEqual(json.loads(json_dumps({'pt': Point(1, 2)})),
+                         {'pt': [1, 2]})
+
+    def test_stdlib(self):
+        self.assertEqual(set_json_backend('stdlib'), 'stdlib')
+        self._check()
+
+    def test_auto(self):
+        self.assertIn(set_json_backend('auto'), ('orjson', 'stdlib'))
+        self._check()
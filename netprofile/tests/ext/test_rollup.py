@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for report rollup tables
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import datetime as dt
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    create_engine
+)
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from netprofile.db.fields import UInt32
+from netprofile.ext.data import ExtModel
+from netprofile.ext.rollup import Rollup
+
+ModelBase = declarative_base()
+
+
+class Sample(ModelBase):
+    __tablename__ = 'test_samples'
+    __table_args__ = ({
+        'info': {
+            'rollups': (Rollup('ts', 'hour',
+                               dimensions=('hostid',),
+                               measures=(('count', '*'),
+                                         ('sum', 'value'),
+                                         ('max', 'value'))),)
+        }
+    },)
+    id = Column('sampleid', UInt32(), primary_key=True)
+    host_id = Column('hostid', UInt32(), nullable=False)
+    timestamp = Column('ts', DateTime(), nullable=False)
+    value = Column(UInt32(), nullable=False)
+
+
+class TestRollup(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        self.extm = ExtModel(Sample)
+        self.rollup = self.extm.rollups[0]
+        self.rollup._ready.clear()
+        ModelBase.metadata.create_all(engine, tables=(
+            Sample.__table__,
+            self.rollup.get_table(Sample)))
+        self.sess = sessionmaker(bind=engine)()
+        self.start = dt.datetime(2017, 1, 1)
+        self.add_samples(0, 48)
+        self.req = testing.DummyRequest()
+        patcher = mock.patch('netprofile.ext.data.DBSession',
+                             return_value=self.sess)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.sess.close()
+
+    def add_samples(self, start, end):
+        for idx in range(start, end):
+            self.sess.add(Sample(
+                id=idx + 1,
+                host_id=idx % 2,
+                timestamp=self.start + dt.timedelta(minutes=idx * 45),
+                value=idx))
+        self.sess.flush()
+
+    def report(self, params):
+        rollup_res = self.extm.report(params, self.req)
+        raw_res = self.extm.report(dict(params, __raw=True), self.req)
+        self.assertEqual(rollup_res, raw_res)
+        return rollup_res
+
+    def test_unrefreshed_rollup_not_used(self):
+        self.assertFalse(self.rollup.is_ready(self.sess, Sample))
+        self.assertIsNone(self.rollup.get_report_query(
+                self.sess, self.extm, {}))
+        self.assertEqual(self.extm.report({}, self.req)['records'],
+                         [{'cnt': 48}])
+
+    def test_missing_table(self):
+        self.rollup.get_table(Sample).drop(self.sess.connection())
+        self.assertFalse(self.rollup.refresh(self.sess, Sample))
+        self.assertFalse(self.rollup.is_ready(self.sess, Sample))
+
+    def test_late_rows(self):
+        self.assertTrue(self.rollup.refresh(self.sess, Sample))
+        # Older than the latest rolled up period, but within late_window.
+        self.sess.add(Sample(id=100,
+                             host_id=1,
+                             timestamp=self.start + dt.timedelta(hours=30),
+                             value=1000))
+        self.sess.flush()
+        self.rollup.refresh(self.sess, Sample)
+        params = {'__aggregates': [('sum', 'value', 'total')]}
+        self.assertIsNotNone(self.rollup.get_report_query(
+                self.sess, self.extm, params))
+        self.assertEqual(self.report(params)['records'],
+                         [{'total': sum(range(48)) + 1000}])
+
+    def test_refresh_and_report(self):
+        self.rollup.refresh(self.sess, Sample)
+        self.add_samples(48, 60)
+        self.rollup.refresh(self.sess, Sample)
+        self.assertTrue(self.rollup.is_ready(self.sess, Sample))
+
+        params = {
+            '__groupby':    ['hostid', ('day', 'ts')],
+            '__aggregates': [('sum', 'value', 'total'),
+                             ('max', 'value', 'peak')],
+            '__ffilter':    [{'property': 'ts',
+                              'operator': 'ge',
+                              'value':    '2017-01-01T06:00:00'},
+                             {'property': 'ts',
+                              'operator': 'le',
+                              'value':    '2017-01-01T23:59:59'}]
+        }
+        self.assertIsNotNone(self.rollup.get_report_query(
+                self.sess, self.extm, params))
+        res = self.report(params)
+        self.assertEqual(res['total'], 2)
+        self.assertEqual(res['records'][0], {'hostid':  0,
+                                             'ts_day':  1,
+                                             'total':   228,
+                                             'peak':    30})
+        self.assertEqual(self.report({})['records'], [{'cnt': 60}])
+
+    def test_uncovered_report(self):
+        self.rollup.refresh(self.sess, Sample)
+        params = {
+            '__groupby': [('minute', 'ts')],
+            '__ffilter': [{'property': 'ts',
+                           'operator': 'ge',
+                           'value':    '2017-01-01T06:30:00'}]
+        }
+        self.assertIsNone(self.rollup.get_report_query(
+                self.sess, self.extm, params))
+        self.assertIsNone(self.rollup.get_report_query(
+                self.sess, self.extm, {'__sstr': 'x'}))
+        self.assertEqual(self.report(params)['total'], 4)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for quick search token index
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+from sqlalchemy import (
+    Column,
+    create_engine
+)
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from netprofile.db.fields import (
+    ASCIIString,
+    UInt32
+)
+from netprofile.ext import search
+from netprofile.ext.data import ExtModel
+
+ModelBase = declarative_base()
+
+
+class Device(ModelBase):
+    __tablename__ = 'test_devices'
+    __table_args__ = ({
+        'info': {
+            'easy_search':  ('name', 'descr'),
+            'search_index': True
+        }
+    },)
+    id = Column('devid', UInt32(), primary_key=True)
+    name = Column(ASCIIString(32), nullable=False)
+    description = Column('descr', ASCIIString(255), nullable=True)
+
+    def __str__(self):
+        return self.name
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        search._ready.clear()
+        engine = create_engine('sqlite://')
+        ModelBase.metadata.create_all(engine, tables=(Device.__table__,))
+        self.sess = sessionmaker(bind=engine)()
+        self.sess.add_all((
+            Device(id=1, name='core-switch', description='Main building'),
+            Device(id=2, name='edge_router', description='Uplink'),
+            Device(id=3, name='access-switch', description='Building B')
+        ))
+        self.sess.flush()
+        self.req = testing.DummyRequest()
+        self.req.run_hook = mock.MagicMock()
+        self.req.has_permission = mock.MagicMock(return_value=True)
+        self.extm = ExtModel(Device)
+        patcher = mock.patch('netprofile.ext.data.DBSession',
+                             return_value=self.sess)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.sess.close()
+
+    def create_index(self):
+        # Normally done by module migrations.
+        search.get_index_table(Device).create(self.sess.connection())
+        # Don't wait for recheck interval.
+        search._ready.clear()
+
+    def find(self, sstr):
+        res = self.extm.read({'__sstr': sstr}, self.req)
+        return sorted(rec['devid'] for rec in res['records'])
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('Edge_Router, uplink-2'),
+                         {'edge_router', 'uplink', '2'})
+        self.assertEqual(search.tokenize(None), set())
+
+    def test_unindexed_fallback(self):
+        conn = self.sess.connection()
+        self.assertFalse(search.is_ready(conn, Device))
+        self.assertIsNone(search.build_index(self.sess, Device))
+        self.assertEqual(self.find('witch'), [1, 3])
+
+    def test_unbuilt_fallback(self):
+        self.create_index()
+        self.assertFalse(search.is_ready(self.sess.connection(), Device))
+        self.assertEqual(self.find('witch'), [1, 3])
+
+    def test_punctuation_fallback(self):
+        self.create_index()
+        search.build_index(self.sess, Device)
+        self.assertEqual(self.find('-'), [1, 3])
+        self.assertEqual(self.find('!'), [])
+
+    def test_indexed_search(self):
+        self.create_index()
+        self.assertEqual(search.build_index(self.sess, Device), 3)
+        self.assertEqual(self.find('witch'), [])
+        self.assertEqual(self.find('swi'), [1, 3])
+        self.assertEqual(self.find('build swi'), [1, 3])
+        self.assertEqual(self.find('main swi'), [1])
+        self.assertEqual(self.find('edge_'), [2])
+        self.assertEqual(self.find('edg%'), [2])
+
+    def test_index_events(self):
+        self.create_index()
+        search.build_index(self.sess, Device)
+        self.sess.add(Device(id=4, name='spare-switch'))
+        self.sess.flush()
+        self.assertEqual(self.find('spare'), [4])
+        dev = self.sess.query(Device).get(1)
+        dev.name = 'distribution'
+        self.sess.flush()
+        self.assertEqual(self.find('core'), [])
+        self.assertEqual(self.find('distr'), [1])
+        self.sess.delete(dev)
+        self.sess.flush()
+        self.assertEqual(self.find('main'), [])
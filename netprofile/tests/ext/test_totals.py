@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for total row count strategies
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+from netprofile.common import cache
+from netprofile.ext.totals import (
+    CachedTotal,
+    EstimatedTotal,
+    ExactTotal,
+    get_total_strategy,
+    filter_fingerprint
+)
+
+
+class TestTotalStrategies(unittest.TestCase):
+    def setUp(self):
+        self.old_cache = cache.cache
+        cache.cache = cache.configure_cache({
+            'netprofile.cache.backend': 'dogpile.cache.memory'
+        })
+        self.extm = mock.MagicMock()
+        self.extm.model = mock.NonCallableMock(spec=('__table__',))
+        self.extm.model.__table__ = mock.NonCallableMock()
+        self.extm.model.__table__.name = 'test_table'
+
+    def tearDown(self):
+        cache.cache = self.old_cache
+
+    def test_fingerprint(self):
+        f1 = {'property': 'a', 'operator': 'eq', 'value': 1}
+        f2 = {'property': 'b', 'operator': 'gt', 'value': 2}
+        self.assertEqual(
+            filter_fingerprint({'__filter': [f1, f2], '__start': 0}),
+            filter_fingerprint({'__filter': [f2, f1], '__start': 50}))
+        self.assertNotEqual(
+            filter_fingerprint({'__filter': [f1]}),
+            filter_fingerprint({'__filter': [f2]}))
+        self.assertNotEqual(
+            filter_fingerprint({'__sstr': 'abc'}),
+            filter_fingerprint({}))
+
+    def test_exact(self):
+        query = mock.MagicMock()
+        query.scalar.return_value = 42
+        self.assertEqual(ExactTotal().get_total(self.extm, query, {}),
+                         (42, True))
+
+    def test_cached(self):
+        query = mock.MagicMock()
+        query.scalar.return_value = 42
+        strategy = CachedTotal(ttl=60)
+        params = {'__sstr': 'abc'}
+        self.assertEqual(strategy.get_total(self.extm, query, params),
+                         (42, True))
+        query.scalar.return_value = 43
+        self.assertEqual(strategy.get_total(self.extm, query, params),
+                         (42, True))
+        self.assertEqual(strategy.get_total(self.extm, query, {}),
+                         (43, True))
+        self.assertEqual(query.scalar.call_count, 2)
+
+    def test_get_total_strategy(self):
+        self.assertIsInstance(get_total_strategy({}), ExactTotal)
+        strategy = get_total_strategy({'total_strategy': 'cached',
+                                       'total_cache_ttl': 5})
+        self.assertIsInstance(strategy, CachedTotal)
+        self.assertEqual(strategy.ttl, 5)
+        strategy = get_total_strategy({'total_strategy': 'estimate'})
+        self.assertIsInstance(strategy, EstimatedTotal)
+        self.assertIs(get_total_strategy({'total_strategy': strategy}),
+                      strategy)
+        with self.assertRaises(ValueError):
+            get_total_strategy({'total_strategy': 'bogus'})
+
+    def test_estimate_fallback(self):
+        query = mock.MagicMock()
+        query.scalar.return_value = 42
+        query.session.get_bind.return_value.dialect.name = 'sqlite'
+        self.assertEqual(
+            EstimatedTotal().get_total(self.extm, query, {}),
+            (42, True))
+
+    def test_cached_exactness(self):
+        strategy = CachedTotal()
+        with mock.patch.object(ExactTotal, 'get_total',
+                               return_value=(1000, False)) as get_total:
+            self.assertEqual(strategy.get_total(self.extm, None, {}),
+                             (1000, False))
+            self.assertEqual(strategy.get_total(self.extm, None, {}),
+                             (1000, False))
+        get_total.assert_called_once_with(self.extm, None, {})
+
+    def test_query_estimate(self):
+        def _row(**kwargs):
+            return mock.MagicMock(items=mock.MagicMock(
+                    return_value=kwargs.items()))
+
+        sess = mock.MagicMock()
+        sess.execute.return_value = [
+            _row(id=1, select_type='PRIMARY', rows=1000, filtered=50.0),
+            _row(id=1, select_type='PRIMARY', rows=2, filtered=100.0),
+            _row(id=2, select_type='SUBQUERY', rows=10, filtered=10.0)
+        ]
+        strategy = EstimatedTotal()
+        self.assertEqual(strategy.query_estimate(sess, mock.MagicMock()),
+                         1000)
+        sess.execute.return_value = [
+            _row(id=1, select_type='SIMPLE', rows=None, filtered=None)
+        ]
+        self.assertIsNone(strategy.query_estimate(sess, mock.MagicMock()))
+        sess.execute.return_value = []
+        self.assertIsNone(strategy.query_estimate(sess, mock.MagicMock()))
@@ -63,6 +63,7 @@ from babel.core import Locale
 from netprofile import locale_neg
 from netprofile.common.hooks import register_hook
 from netprofile.common.crypto import (
+    HashQueueFull,
     get_salt_string,
     verify_password
 )
@@ -138,6 +139,7 @@ def client_chpass(request):
     min_pwd_len = int(
             cfg.get('netprofile.client.registration.min_password_length', 8))
     errors = {}
+    busy = False
     if 'submit' in request.POST:
         user = request.user
         csrf = request.POST.get('csrf', '')
@@ -154,15 +156,31 @@ def client_chpass(request):
                 errors['pass'] = _('Password is too long')
             if passwd != passwd2:
                 errors['pass2'] = _('Passwords do not match')
-            if not verify_password(user.nick, oldpass, user.password_hashed,
-                                   subject='accounts'):
-                errors['oldpass'] = _('Wrong password')
-        if len(errors) == 0:
-            user.change_password(passwd, request.POST, request)
-            request.session.flash({
-                'text': loc.translate(_('Password successfully changed'))
-            })
-            return HTTPSeeOther(location=request.route_url('access.cl.home'))
+            try:
+                if not verify_password(user.nick, oldpass,
+                                       user.password_hashed,
+                                       subject='accounts'):
+                    errors['oldpass'] = _('Wrong password')
+            except HashQueueFull:
+                busy = True
+        if len(errors) == 0 and not busy:
+            try:
+                user.change_password(passwd, request.POST, request)
+            except HashQueueFull:
+                busy = True
+            else:
+                request.session.flash({
+                    'text': loc.translate(_('Password successfully changed'))
+                })
+                return HTTPSeeOther(
+                        location=request.route_url('access.cl.home'))
+    if busy:
+        request.response.status_int = 503
+        request.session.flash({
+            'text':  loc.translate(
+                    _('Server is busy, please try again later.')),
+            'class': 'warning'
+        })
     tpldef = {
         'errors':      {err: loc.translate(errors[err]) for err in errors},
         'min_pwd_len': min_pwd_len
@@ -284,11 +302,20 @@ def client_login(request):
             q = sess.query(AccessEntity).filter(
                 AccessEntity.nick == login,
                 AccessEntity.access_state != AccessState.block_inactive.value)
-            for user in q:
-                if verify_password(user.nick, passwd, user.password_hashed,
-                                   subject='accounts'):
-                    headers = remember(request, login)
-                    return HTTPSeeOther(location=nxt, headers=headers)
+            try:
+                for user in q:
+                    if verify_password(user.nick, passwd,
+                                       user.password_hashed,
+                                       subject='accounts'):
+                        headers = remember(request, login)
+                        return HTTPSeeOther(location=nxt, headers=headers)
+            except HashQueueFull:
+                request.response.status_int = 503
+                request.session.flash({
+                    'text':  request.localizer.translate(
+                            _('Server is busy, please try again later.')),
+                    'class': 'warning'
+                })
         did_fail = True
 
     tpldef = {
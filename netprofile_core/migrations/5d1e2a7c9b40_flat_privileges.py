@@ -0,0 +1,116 @@
+"""Materialized user privileges
+
+Revision ID: 5d1e2a7c9b40
+Revises: 7e59384af3c9
+Create Date: 2026-10-18 12:04:31.582310
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5d1e2a7c9b40'
+down_revision = '7e59384af3c9'
+branch_labels = None
+depends_on = None
+
+from collections import defaultdict
+from alembic import op
+import sqlalchemy as sa
+from netprofile.db import ddl as npd
+from netprofile.db import fields as npf
+
+# Table definitions as of this revision, used to fill the new table.
+_groups = sa.table('groups',
+                   sa.column('gid'),
+                   sa.column('parentid'))
+_users = sa.table('users',
+                  sa.column('uid'),
+                  sa.column('gid'))
+_users_groups = sa.table('users_groups',
+                         sa.column('ugid'),
+                         sa.column('uid'),
+                         sa.column('gid'))
+_caps_groups = sa.table('capabilities_groups',
+                        sa.column('gid'),
+                        sa.column('privid'),
+                        sa.column('value', npf.NPBoolean()))
+_caps_users = sa.table('capabilities_users',
+                       sa.column('uid'),
+                       sa.column('privid'),
+                       sa.column('value', npf.NPBoolean()))
+_flat = sa.table('privileges_flat_users',
+                 sa.column('uid'),
+                 sa.column('privid'),
+                 sa.column('value', npf.NPBoolean()))
+
+_INSERT_BATCH = 1000
+
+
+def _fill_flat_privileges(conn):
+    parents = dict(conn.execute(
+            sa.select([_groups.c.gid, _groups.c.parentid])).fetchall())
+    gcaps = defaultdict(dict)
+    for gid, privid, value in conn.execute(sa.select([
+            _caps_groups.c.gid, _caps_groups.c.privid,
+            _caps_groups.c.value])):
+        gcaps[gid][privid] = value
+    ucaps = defaultdict(dict)
+    for uid, privid, value in conn.execute(sa.select([
+            _caps_users.c.uid, _caps_users.c.privid,
+            _caps_users.c.value])):
+        ucaps[uid][privid] = value
+    secondary = defaultdict(list)
+    for uid, gid in conn.execute(sa.select([
+            _users_groups.c.uid, _users_groups.c.gid]).order_by(
+                _users_groups.c.ugid)):
+        secondary[uid].append(gid)
+
+    gflat = {}
+
+    def _group_flat(gid):
+        if gid not in gflat:
+            chain = []
+            cur = gid
+            while cur is not None and cur not in chain:
+                chain.append(cur)
+                cur = parents.get(cur)
+            privs = {}
+            for cgid in reversed(chain):
+                privs.update(gcaps.get(cgid, ()))
+            gflat[gid] = privs
+        return gflat[gid]
+
+    rows = []
+    for uid, gid in conn.execute(sa.select([_users.c.uid, _users.c.gid])):
+        privs = dict(_group_flat(gid)) if gid is not None else {}
+        for sgid in secondary.get(uid, ()):
+            if sgid != gid:
+                privs.update(_group_flat(sgid))
+        privs.update(ucaps.get(uid, ()))
+        rows.extend({'uid': uid, 'privid': privid, 'value': value}
+                    for privid, value in privs.items())
+        if len(rows) >= _INSERT_BATCH:
+            conn.execute(_flat.insert(), rows)
+            rows = []
+    if len(rows) > 0:
+        conn.execute(_flat.insert(), rows)
+
+def upgrade():
+    op.create_table('privileges_flat_users',
+    sa.Column('uid', npf.UInt32(), npd.Comment('User ID'), nullable=False),
+    sa.Column('privid', npf.UInt32(), npd.Comment('Privilege ID'), nullable=False),
+    sa.Column('value', npf.NPBoolean(), npd.Comment('Effective capability value'), nullable=False),
+    sa.ForeignKeyConstraint(['privid'], ['privileges.privid'], name='privileges_flat_users_fk_privid', onupdate='CASCADE', ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['uid'], ['users.uid'], name='privileges_flat_users_fk_uid', onupdate='CASCADE', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('uid', 'privid', name=op.f('privileges_flat_users_pk')),
+    mysql_charset='utf8',
+    mysql_engine='InnoDB'
+    )
+    op.set_table_comment('privileges_flat_users', 'Flattened user privileges')
+    op.create_index('privileges_flat_users_i_privid', 'privileges_flat_users', ['privid'], unique=False)
+
+    _fill_flat_privileges(op.get_bind())
+
+
+def downgrade():
+    op.drop_index('privileges_flat_users_i_privid', table_name='privileges_flat_users')
+    op.drop_table('privileges_flat_users')
@@ -128,7 +128,12 @@ class Module(ModuleBase):
     def add_routes(self, config):
         config.add_route('core.noop', '/noop', vhost='MAIN')
         config.add_route('core.about', '/about', vhost='MAIN')
+        config.add_route('core.stats.hashing', '/stats/hashing',
+                         vhost='MAIN')
         config.add_route('core.js.webshell', '/js/webshell', vhost='MAIN')
+        config.add_route('core.js.webshell.schema',
+                         '/js/webshell/schema/{hash:[0-9a-f]+}',
+                         vhost='MAIN')
         config.add_route('core.file.download',
                          '/file/dl/{fileid:\d+}*filename',
                          vhost='MAIN')
@@ -139,6 +144,9 @@ class Module(ModuleBase):
         config.add_route('core.export',
                          '/file/export/{module:[\w_.-]+}/{model:[\w_.-]+}',
                          vhost='MAIN')
+        config.add_route('core.report',
+                         '/report/{module:[\w_.-]+}/{model:[\w_.-]+}',
+                         vhost='MAIN')
 
     @classmethod
     def get_models(cls):
@@ -505,6 +513,9 @@ class Module(ModuleBase):
                      title=loc.translate(_('Administration')), order=50,
                      permission='BASE_ADMIN'))
 
+    def get_task_imports(self):
+        return ('netprofile_core.tasks',)
+
     def get_js(self, request):
         if request.debug_enabled:
             return (
@@ -25,7 +25,12 @@ from __future__ import (unicode_literals, print_function,
 
 import hashlib
 import hmac
+import threading
+import time
+import uuid
 import datetime as dt
+from collections import namedtuple
+from dogpile.cache.api import NO_VALUE
 from six import PY3
 from pyramid.settings import asbool
 from pyramid.security import (
@@ -36,19 +41,32 @@ from pyramid.security import (
     unauthenticated_userid
 )
 from pyramid.events import ContextFound
+from pyramid.httpexceptions import HTTPServiceUnavailable
 from pyramid.authentication import (
     BasicAuthAuthenticationPolicy,
     SessionAuthenticationPolicy
 )
 from pyramid.authorization import ACLAuthorizationPolicy
+from sqlalchemy import event
+from sqlalchemy.orm import (
+    Session,
+    object_session
+)
 from sqlalchemy.orm.exc import NoResultFound
 
+from netprofile.common import (
+    cache,
+    invalidation
+)
 from netprofile.common.auth import (
+    CacheDigestNonceStore,
     DigestAuthenticationPolicy,
+    DigestNonceStore,
     PluginAuthenticationPolicy,
     PluginPolicySelected,
     auth_remove
 )
+from netprofile.common.crypto import HashQueueFull
 from netprofile.common.modules import IModuleManager
 from netprofile.db.connection import DBSession
 from netprofile.db.clauses import (
@@ -56,12 +74,24 @@ from netprofile.db.clauses import (
     SetVariables
 )
 from .models import (
+    Group,
+    GroupACL,
+    GroupCapability,
     NPSession,
     Privilege,
+    SecurityPolicy,
     User,
+    UserACL,
+    UserCapability,
+    UserGroup,
     UserSetting,
     UserState
 )
+from .sessions import (
+    SessionState,
+    get_store as get_session_store,
+    write_back as write_back_sessions
+)
 
 if PY3:
     from urllib.parse import unquote
@@ -69,88 +99,338 @@ else:
     from urllib import unquote
 
 
-def get_user(request):
-    sess = DBSession()
-    userid = unauthenticated_userid(request)
+# Compact snapshot of authenticated user's data, cached between requests.
+Identity = namedtuple('Identity', ('id',
+                                   'login',
+                                   'group_id',
+                                   'group_ids',
+                                   'privileges',
+                                   'acls',
+                                   'settings',
+                                   'policy_id',
+                                   'sess_timeout',
+                                   'version'))
+
+_IDENTITY_KEY = 'auth.identity:%s'
+_VERSION_KEY = 'auth.version:%s'
+_GLOBAL_VERSION_KEY = 'auth.version'
+_GUEST_ACLS_KEY = 'auth.guest_acls'
+
+# Invalidation bus channel for identity changes. Key is user ID, or None
+# if all identities are affected.
+IDENTITY_CHANNEL = 'auth.identity'
+
+# Identities are also kept in process memory while invalidation bus is
+# active. Lifetime (in seconds) is limited in case a message gets lost.
+LOCAL_CACHE_TTL = 300
+LOCAL_CACHE_SIZE = 1000
+
+_local_lock = threading.Lock()
+_local_identities = {}
+_local_guest = {}
+_local_digest = {}
+_local_gen = [0]
+
+# HTTP Digest credentials of a user, kept in process memory.
+DigestCredentials = namedtuple('DigestCredentials', ('id',
+                                                     'login',
+                                                     'ha1',
+                                                     'groups',
+                                                     'version'))
+
+
+def get_identity_version(uid):
+    """
+    Get current version of cached identity data for a user.
 
-    if userid is not None:
-        if userid[:2] == 'u:':
-            userid = userid[2:]
-        try:
-            return sess.query(User).filter(User.state == UserState.active,
-                                           User.enabled.is_(True),
-                                           User.login == userid).one()
-        except NoResultFound:
-            return None
+    Version consists of global part, which changes when groups or
+    privileges are modified, and per-user part.
+    """
+    if cache.cache is None:
+        return None
+    return tuple(None if val is NO_VALUE else val
+                 for val
+                 in cache.cache.get_multi((_GLOBAL_VERSION_KEY,
+                                           _VERSION_KEY % (uid,))))
 
 
-def get_acls(request):
-    # FIXME: implement ACL cache invalidation
-    if 'auth.acls' in request.session:
-        return request.session['auth.acls']
+def bump_identity_version(uid=None):
+    """
+    Invalidate cached identity of a user, or of all users if
+    no user ID was passed.
+    """
+    if cache.cache is None:
+        return
+    key = _GLOBAL_VERSION_KEY if uid is None else _VERSION_KEY % (uid,)
+    cache.cache.set(key, uuid.uuid4().hex)
+
+
+def _get_local(table, key):
+    bus = invalidation.bus
+    if bus is None or not bus.active:
+        return None
+    entry = table.get(key)
+    if entry is None or time.monotonic() >= entry[1]:
+        return None
+    return entry[0]
+
+
+def _set_local(table, key, value, gen):
+    if invalidation.bus is None:
+        return
+    with _local_lock:
+        # Skip values loaded before the latest invalidation.
+        if gen != _local_gen[0]:
+            return
+        if key not in table and len(table) >= LOCAL_CACHE_SIZE:
+            table.pop(next(iter(table)))
+        table[key] = (value, time.monotonic() + LOCAL_CACHE_TTL)
+
+
+def drop_local_identity(uid=None):
+    """
+    Drop identities of a user, or of all users, from process memory.
+    """
+    with _local_lock:
+        _local_gen[0] += 1
+        if uid is None:
+            _local_identities.clear()
+            _local_guest.clear()
+            _local_digest.clear()
+            return
+        for table in (_local_identities, _local_digest):
+            for login, entry in list(table.items()):
+                if entry[0].id == uid:
+                    table.pop(login, None)
+
+
+def _find_user(login):
+    try:
+        return DBSession().query(User).filter(
+                User.state == UserState.active,
+                User.enabled.is_(True),
+                User.login == login).one()
+    except NoResultFound:
+        return None
+
+
+def _get_user_acls(user):
     ret = [(Allow, Authenticated, 'USAGE')]
-    user = request.user
-    if user is None:
-        sess = DBSession()
-        for priv in sess.query(Privilege):
-            if priv.guest_value:
-                right = Allow
-            else:
-                right = Deny
-            ret.append((right, Everyone, priv.code))
-        request.session['auth.acls'] = ret
-        return ret
     for perm, val in user.flat_privileges.items():
         if val:
             right = Allow
         else:
             right = Deny
         ret.append((right, user.login, perm))
-    request.session['auth.acls'] = ret
     return ret
 
 
-def get_settings(request):
-    # FIXME: implement settings cache invalidation
-    if 'auth.settings' in request.session:
-        return request.session['auth.settings']
+def _get_user_settings(user, request):
     mmgr = request.registry.getUtility(IModuleManager)
     all_settings = mmgr.get_settings('user')
-    user = request.user
+    sess = DBSession()
+    ret = dict(
+        (s.name, s.value)
+        for s
+        in sess.query(UserSetting).filter(UserSetting.user == user))
+    for moddef, sections in all_settings.items():
+        for sname, section in sections.items():
+            for setting_name, setting in section.items():
+                fullname = '%s.%s.%s' % (moddef, sname, setting.name)
+                if fullname in ret:
+                    ret[fullname] = setting.parse_param(ret[fullname])
+                elif setting.default is not None:
+                    ret[fullname] = setting.default
+    return ret
 
+
+def make_identity(user, request, version=None):
+    group_ids = []
+    grp = user.group
+    while grp is not None:
+        group_ids.append(grp.id)
+        grp = grp.parent
+    for sgr in user.secondary_groups:
+        if sgr.id not in group_ids:
+            group_ids.append(sgr.id)
+    secpol = user.effective_policy
+    return Identity(id=user.id,
+                    login=user.login,
+                    group_id=user.group_id,
+                    group_ids=tuple(group_ids),
+                    privileges=user.flat_privileges,
+                    acls=tuple(_get_user_acls(user)),
+                    settings=_get_user_settings(user, request),
+                    policy_id=secpol.id if secpol else None,
+                    sess_timeout=user.sess_timeout,
+                    version=version)
+
+
+def get_identity(request):
+    userid = unauthenticated_userid(request)
+    if userid is None:
+        return None
+    if userid[:2] == 'u:':
+        userid = userid[2:]
+    ident = _get_local(_local_identities, userid)
+    if ident is not None:
+        return ident
+    gen = _local_gen[0]
+    ident = _load_identity(userid, request)
+    if ident is not None:
+        _set_local(_local_identities, userid, ident, gen)
+    return ident
+
+
+def _load_identity(userid, request):
+    if cache.cache is None:
+        user = _find_user(userid)
+        if user is None:
+            return None
+        return make_identity(user, request)
+
+    key = _IDENTITY_KEY % (userid,)
+    ident = cache.cache.get(key)
+    if ident is not NO_VALUE:
+        if ident.version == get_identity_version(ident.id):
+            return ident
+    user = _find_user(userid)
     if user is None:
-        ret = {}
-        for moddef, sections in all_settings.items():
-            for sname, section in sections.items():
-                for setting_name, setting in section.items():
-                    if setting.default is None:
-                        continue
-                    ret['%s.%s.%s' % (moddef,
-                                      sname,
-                                      setting_name)] = setting.default
-    else:
-        sess = DBSession()
-        ret = dict(
-            (s.name, s.value)
-            for s
-            in sess.query(UserSetting).filter(UserSetting.user == user))
-        for moddef, sections in all_settings.items():
-            for sname, section in sections.items():
-                for setting_name, setting in section.items():
-                    fullname = '%s.%s.%s' % (moddef, sname, setting.name)
-                    if fullname in ret:
-                        ret[fullname] = setting.parse_param(ret[fullname])
-                    elif setting.default is not None:
-                        ret[fullname] = setting.default
-    request.session['auth.settings'] = ret
+        return None
+    # Version is fetched before loading data, so that concurrent
+    # invalidations are never lost.
+    ident = make_identity(user, request, get_identity_version(user.id))
+    cache.cache.set(key, ident)
+    return ident
+
+
+def get_user(request):
+    """
+    Load User object of the authenticated user.
+
+    Code that runs on every request should use request.identity instead,
+    which is served from cache. Remaining per-request users of this are
+    creation of new UI sessions and password age checks, both of which
+    only run once in a while.
+    """
+    ident = request.identity
+    if ident is None:
+        return None
+    return DBSession().query(User).get(ident.id)
+
+
+def _get_guest_acls():
+    ret = [(Allow, Authenticated, 'USAGE')]
+    sess = DBSession()
+    for priv in sess.query(Privilege):
+        if priv.guest_value:
+            right = Allow
+        else:
+            right = Deny
+        ret.append((right, Everyone, priv.code))
+    return ret
+
+
+def get_acls(request):
+    ident = request.identity
+    if ident is not None:
+        return list(ident.acls)
+    cached = _get_local(_local_guest, _GUEST_ACLS_KEY)
+    if cached is not None:
+        return list(cached)
+    gen = _local_gen[0]
+    ret = _load_guest_acls()
+    _set_local(_local_guest, _GUEST_ACLS_KEY, tuple(ret), gen)
+    return ret
+
+
+def _load_guest_acls():
+    if cache.cache is None:
+        return _get_guest_acls()
+    version = get_identity_version(0)
+    cached = cache.cache.get(_GUEST_ACLS_KEY)
+    if cached is not NO_VALUE and cached[0] == version:
+        return list(cached[1])
+    ret = _get_guest_acls()
+    cache.cache.set(_GUEST_ACLS_KEY, (version, tuple(ret)))
+    return ret
+
+
+def get_settings(request):
+    ident = request.identity
+    if ident is not None:
+        return ident.settings
+    mmgr = request.registry.getUtility(IModuleManager)
+    all_settings = mmgr.get_settings('user')
+    ret = {}
+    for moddef, sections in all_settings.items():
+        for sname, section in sections.items():
+            for setting_name, setting in section.items():
+                if setting.default is None:
+                    continue
+                ret['%s.%s.%s' % (moddef,
+                                  sname,
+                                  setting_name)] = setting.default
     return ret
 
 
+def _identity_changed(tgt, uid):
+    # None stands for all users.
+    sess = object_session(tgt)
+    if sess is not None:
+        sess.info.setdefault('identity_changes', set()).add(uid)
+
+
+def _mod_user(mapper, conn, tgt):
+    _identity_changed(tgt, tgt.id)
+
+
+def _mod_user_data(mapper, conn, tgt):
+    _identity_changed(tgt, tgt.user_id)
+
+
+def _mod_global(mapper, conn, tgt):
+    _identity_changed(tgt, None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _identity_after_commit(sess):
+    uids = sess.info.pop('identity_changes', None)
+    if not uids:
+        return
+    if None in uids:
+        uids = (None,)
+    else:
+        uids = sorted(uids)
+    for uid in uids:
+        bump_identity_version(uid)
+        invalidation.publish(IDENTITY_CHANNEL, uid)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _identity_after_rollback(sess):
+    sess.info.pop('identity_changes', None)
+
+
+for _model, _cb in ((User, _mod_user),
+                    (UserACL, _mod_user_data),
+                    (UserCapability, _mod_user_data),
+                    (UserGroup, _mod_user_data),
+                    (UserSetting, _mod_user_data),
+                    (Group, _mod_global),
+                    (GroupACL, _mod_global),
+                    (GroupCapability, _mod_global),
+                    (Privilege, _mod_global),
+                    (SecurityPolicy, _mod_global)):
+    for _evt in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _evt, _cb)
+
+
 def find_princs(userid, request):
     sess = DBSession()
 
-    user = request.user
-    if user and user.login == userid:
+    ident = request.identity
+    if ident and ident.login == userid:
         return []
     try:
         user = sess.query(User).filter(User.state == UserState.active,
@@ -170,39 +450,67 @@ def find_princs_basic(username, pwd, request):
                                        User.login == username).one()
     except NoResultFound:
         return None
-    if not user.check_password(pwd):
-        return None
+    try:
+        if not user.check_password(pwd):
+            return None
+    except HashQueueFull:
+        raise HTTPServiceUnavailable('Server is busy, '
+                                     'please try again later.')
     return []
 
 
-def find_princs_digest(param, request):
-    sess = DBSession()
-
-    try:
-        user = sess.query(User).filter(User.state == UserState.active,
-                                       User.enabled.is_(True),
-                                       User.login == param['username']).one()
-    except NoResultFound:
-        return None
-    if not user.password_ha1:
+def _get_digest_credentials(login):
+    entry = _local_digest.get(login)
+    if entry is not None and time.monotonic() < entry[1]:
+        creds = entry[0]
+        bus = invalidation.bus
+        if bus is not None and bus.active:
+            return creds
+        if (cache.cache is not None
+                and creds.version == get_identity_version(creds.id)):
+            return creds
+    gen = _local_gen[0]
+    user = _find_user(login)
+    if user is None or not user.password_ha1:
         return None
+    groups = ['g:%s' % (user.group.name,)]
+    for sgr in user.secondary_groups:
+        if sgr == user.group:
+            continue
+        groups.append('g:%s' % (sgr.name,))
+    creds = DigestCredentials(id=user.id,
+                              login=user.login,
+                              ha1=user.password_ha1,
+                              groups=tuple(groups),
+                              version=get_identity_version(user.id))
+    # HA1 is password-equivalent, so it is never put into shared cache.
+    if invalidation.bus is not None or cache.cache is not None:
+        with _local_lock:
+            if gen == _local_gen[0]:
+                if (login not in _local_digest
+                        and len(_local_digest) >= LOCAL_CACHE_SIZE):
+                    _local_digest.pop(next(iter(_local_digest)))
+                _local_digest[login] = (creds,
+                                        time.monotonic() + LOCAL_CACHE_TTL)
+    return creds
+
+
+def find_princs_digest(param, request):
     req_path = unquote(request.path.lower())
     uri_path = unquote(param['uri'].lower())
     if req_path != uri_path:
         return None
+    creds = _get_digest_credentials(param['username'])
+    if creds is None:
+        return None
     ha2 = hashlib.md5(('%s:%s' % (request.method,
                                   param['uri'])).encode()).hexdigest()
     data = '%s:%s:%s:%s:%s' % (param['nonce'], param['nc'],
                                param['cnonce'], 'auth', ha2)
-    resp = hashlib.md5(('%s:%s' % (user.password_ha1,
+    resp = hashlib.md5(('%s:%s' % (creds.ha1,
                                    data)).encode()).hexdigest()
     if hmac.compare_digest(resp, param['response']):
-        groups = ['g:%s' % (user.group.name,)]
-        for sgr in user.secondary_groups:
-            if sgr == user.group:
-                continue
-            groups.append('g:%s' % (sgr.name,))
-        return groups
+        return list(creds.groups)
     return None
 
 
@@ -218,17 +526,17 @@ def _auth_to_db(event):
         return
 
     sess = DBSession()
-    user = request.user
+    ident = request.identity
 
-    if user:
+    if ident:
         try:
-            sess.execute(SetVariables(accessuid=user.id,
-                                      accessgid=user.group_id,
-                                      accesslogin=user.login))
+            sess.execute(SetVariables(accessuid=ident.id,
+                                      accessgid=ident.group_id,
+                                      accesslogin=ident.login))
         except NotImplementedError:
-            sess.execute(SetVariable('accessuid', user.id))
-            sess.execute(SetVariable('accessgid', user.group_id))
-            sess.execute(SetVariable('accesslogin', user.login))
+            sess.execute(SetVariable('accessuid', ident.id))
+            sess.execute(SetVariable('accessgid', ident.group_id))
+            sess.execute(SetVariable('accesslogin', ident.login))
     else:
         try:
             sess.execute(SetVariables(accessuid=0,
@@ -251,7 +559,7 @@ def _check_session(event):
     request = event.request
     if not isinstance(event.policy, SessionAuthenticationPolicy):
         return
-    user = request.user
+    ident = request.identity
     route_name = None
     if request.matched_route:
         route_name = request.matched_route.name
@@ -261,7 +569,7 @@ def _check_session(event):
                           'core.logout.direct',
                           'core.wellknown'}:
             return
-    if not user:
+    if not ident:
         _goto_login(request)
     settings = request.registry.settings
 
@@ -275,16 +583,27 @@ def _check_session(event):
     if sname:
         now = dt.datetime.now()
         oldsess = True
-
-        try:
-            npsess = sess.query(NPSession).filter(
-                    NPSession.session_name == sname).one()
-        except NoResultFound:
-            npsess = user.generate_session(request, sname, now)
-            if npsess is None:
-                _goto_login(request)
-            oldsess = False
-            sess.add(npsess)
+        store = get_session_store(settings)
+        npsess = None
+        if store is not None:
+            npsess = store.get(sname)
+
+        if npsess is None:
+            try:
+                npsess = sess.query(NPSession).filter(
+                        NPSession.session_name == sname).one()
+            except NoResultFound:
+                npsess = request.user.generate_session(request, sname, now)
+                if npsess is None:
+                    _goto_login(request)
+                oldsess = False
+                sess.add(npsess)
+                if store is not None:
+                    # Get session ID for the snapshot.
+                    sess.flush()
+            if store is not None:
+                npsess = SessionState.from_session(npsess)
+                store.put(npsess)
 
         if oldsess and not npsess.check_request(request, now):
             _goto_login(request)
@@ -295,22 +614,49 @@ def _check_session(event):
             if route_name not in {'extrouter',
                                   'extapi',
                                   'core.home',
-                                  'core.js.webshell'}:
+                                  'core.js.webshell',
+                                  'core.js.webshell.schema'}:
                 _goto_login(request)
 
-        npsess.update_time(now)
+        if store is None:
+            npsess.update_time(now)
+        else:
+            npsess = store.touch(npsess, now)
+            if store.flush_due():
+                write_back_sessions(sess, store)
         request.np_session = npsess
     else:
         _goto_login(request)
 
 
+def _make_nonce_store(settings):
+    backend = settings.get('netprofile.auth.digest.nonce_store', 'memory')
+    if backend == 'memory':
+        return DigestNonceStore(int(settings.get(
+            'netprofile.auth.digest.nonce_store_size', 10000)))
+    if backend == 'cache':
+        if cache.cache is None:
+            raise ValueError('Digest nonce store requires cache to be '
+                             'configured')
+        expires = int(settings.get(
+            'netprofile.auth.digest.timestamp_max_behind', 120))
+        expires += int(settings.get(
+            'netprofile.auth.digest.timestamp_max_ahead', 5))
+        return CacheDigestNonceStore(cache.cache, expiration_time=expires)
+    if backend == 'none':
+        return None
+    raise ValueError('Unknown digest nonce store: %s' % (backend,))
+
+
 def includeme(config):
     """
     For inclusion by Pyramid.
     """
+    config.add_request_method(get_identity, str('identity'), reify=True)
     config.add_request_method(get_user, str('user'), reify=True)
     config.add_request_method(get_acls, str('acls'), reify=True)
     config.add_request_method(get_settings, str('settings'), reify=True)
+    invalidation.subscribe(IDENTITY_CHANNEL, drop_local_identity)
 
     settings = config.registry.settings
 
@@ -327,7 +673,8 @@ def includeme(config):
                 timestamp_max_ahead=int(settings.get(
                     'netprofile.auth.digest.timestamp_max_ahead', 5)),
                 timestamp_max_behind=int(settings.get(
-                    'netprofile.auth.digest.timestamp_max_behind', 120))),
+                    'netprofile.auth.digest.timestamp_max_behind', 120)),
+                nonce_store=_make_nonce_store(settings)),
             '/api': BasicAuthAuthenticationPolicy(
                 find_princs_basic,
                 settings.get('netprofile.auth.rpc_realm', 'NetProfile RPC'),
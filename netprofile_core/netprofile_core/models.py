@@ -48,6 +48,7 @@ __all__ = [
     'UserACL',
     'GroupACL',
     'UserGroup',
+    'UserFlatPrivilege',
     'SecurityPolicyOnExpire',
     'SecurityPolicy',
     'FileFolderAccessRule',
@@ -81,7 +82,8 @@ __all__ = [
     'HWAddrUnhexFunction',
 
     'global_setting',
-    'user_setting'
+    'user_setting',
+    'refresh_flat_privileges'
 ]
 
 import base64
@@ -94,6 +96,7 @@ import io
 import ipaddress
 import itertools
 import re
+import time
 import urllib
 import uuid
 from six import PY3
@@ -114,14 +117,17 @@ from sqlalchemy import (
     event,
     func,
     inspect,
+    select,
     text,
     or_,
     and_
 )
 from sqlalchemy.orm import (
+    attributes,
     backref,
     deferred,
     joinedload,
+    object_session,
     relationship,
     validates
 )
@@ -1410,6 +1416,7 @@ class User(Base):
             'mysql_engine':  'InnoDB',
             'mysql_charset': 'utf8',
             'info':          {
+                'bulk_write':    False,
                 'cap_menu':      'BASE_USERS',
                 'cap_read':      'USERS_LIST',
                 'cap_create':    'USERS_CREATE',
@@ -1893,6 +1900,13 @@ class User(Base):
 
     @property
     def flat_privileges(self):
+        sess = object_session(self)
+        if (sess is not None and self.id is not None
+                and not _flat_privileges_pending(sess, self)):
+            conn = sess.connection(mapper=User.__mapper__)
+            privs = get_flat_privileges(conn, self.id)
+            if privs is not None:
+                return privs
         gpriv = self.group.flat_privileges
         for sg in self.secondary_groups:
             if sg == self.group:
@@ -2375,6 +2389,7 @@ class Group(Base):
             'mysql_engine':  'InnoDB',
             'mysql_charset': 'utf8',
             'info':          {
+                'bulk_write':    False,
                 'cap_menu':      'BASE_GROUPS',
                 'cap_read':      'GROUPS_LIST',
                 'cap_create':    'GROUPS_CREATE',
@@ -2874,6 +2889,7 @@ class GroupCapability(Capability, Base):
             'mysql_engine':  'InnoDB',
             'mysql_charset': 'utf8',
             'info':          {
+                'bulk_write':    False,
                 'cap_read':      'GROUPS_GETCAP',
                 'cap_create':    'GROUPS_SETCAP',
                 'cap_edit':      'GROUPS_SETCAP',
@@ -2908,6 +2924,7 @@ class UserCapability(Capability, Base):
             'mysql_engine':  'InnoDB',
             'mysql_charset': 'utf8',
             'info':          {
+                'bulk_write':    False,
                 'cap_read':      'USERS_GETCAP',
                 'cap_create':    'USERS_SETCAP',
                 'cap_edit':      'USERS_SETCAP',
@@ -3059,7 +3076,9 @@ class UserGroup(Base):
         {
             'mysql_engine':  'InnoDB',
             'mysql_charset': 'utf8',
-            'info':          {}
+            'info':          {
+                'bulk_write':    False
+            }
         })
     id = Column(
         'ugid',
@@ -3096,6 +3115,240 @@ class UserGroup(Base):
         return str(self.group)
 
 
+class UserFlatPrivilege(Base):
+    """
+    Materialized effective privilege of a user.
+
+    Rows are maintained from session flush events and contain the
+    result of merging capabilities of primary and secondary groups
+    (with all their parents) and of the user itself. This is an internal
+    table, so it is not exposed to the UI.
+    """
+    __tablename__ = 'privileges_flat_users'
+    __table_args__ = (
+        Comment('Flattened user privileges'),
+        Index('privileges_flat_users_i_privid', 'privid'),
+        {
+            'mysql_engine':  'InnoDB',
+            'mysql_charset': 'utf8'
+        })
+    user_id = Column(
+        'uid',
+        UInt32(),
+        ForeignKey('users.uid', name='privileges_flat_users_fk_uid',
+                   ondelete='CASCADE', onupdate='CASCADE'),
+        Comment('User ID'),
+        primary_key=True,
+        nullable=False,
+        info={
+            'header_string': _('User')
+        })
+    privilege_id = Column(
+        'privid',
+        UInt32(),
+        ForeignKey('privileges.privid',
+                   name='privileges_flat_users_fk_privid',
+                   ondelete='CASCADE', onupdate='CASCADE'),
+        Comment('Privilege ID'),
+        primary_key=True,
+        nullable=False,
+        info={
+            'header_string': _('Privilege')
+        })
+    value = Column(
+        NPBoolean(),
+        Comment('Effective capability value'),
+        nullable=False,
+        info={
+            'header_string': _('Value')
+        })
+
+    user = relationship(
+        'User',
+        innerjoin=True,
+        backref=backref(
+            'flat_privilegemap',
+            cascade='all, delete-orphan',
+            passive_deletes=True))
+    privilege = relationship(
+        'Privilege',
+        innerjoin=True,
+        lazy='joined')
+
+    def __str__(self):
+        return '<%s(%s) = %s>' % (str(self.__class__.__name__),
+                                  str(self.privilege.code),
+                                  str(self.value))
+
+
+# Seconds to wait before re-checking for a missing flat privileges table.
+FLAT_PRIVILEGES_RECHECK = 60
+# Maximum number of IDs passed in a single IN() clause.
+_FLAT_CHUNK = 500
+
+_flat_ready = {}
+
+
+def flat_privileges_ready(conn):
+    """
+    Check if materialized privileges table exists in the database.
+    """
+    state = _flat_ready.get('state')
+    now = time.monotonic()
+    if state is True or (state is not None and now < state):
+        return state is True
+    if conn.dialect.has_table(conn, UserFlatPrivilege.__tablename__):
+        _flat_ready['state'] = True
+        return True
+    _flat_ready['state'] = now + FLAT_PRIVILEGES_RECHECK
+    return False
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    for idx in range(0, len(ids), _FLAT_CHUNK):
+        yield ids[idx:idx + _FLAT_CHUNK]
+
+
+def refresh_flat_privileges(conn, user_ids=None, group_ids=None):
+    """
+    Recalculate materialized privileges.
+
+    If neither user_ids nor group_ids are given, table is rebuilt for
+    all users. Group IDs are expanded to all child groups and to all
+    users having these groups as primary or secondary.
+    """
+    grp = Group.__table__
+    gcap = GroupCapability.__table__
+    ucap = UserCapability.__table__
+    ugrp = UserGroup.__table__
+    usr = User.__table__
+    flat = UserFlatPrivilege.__table__
+
+    parents = dict(conn.execute(
+            select([grp.c.gid, grp.c.parentid])).fetchall())
+    gcaps = defaultdict(dict)
+    for gid, privid, value in conn.execute(
+            select([gcap.c.gid, gcap.c.privid, gcap.c.value])):
+        gcaps[gid][privid] = value
+
+    gflat = {}
+
+    def _group_flat(gid):
+        if gid in gflat:
+            return gflat[gid]
+        chain = []
+        while gid is not None and gid not in gflat and gid not in chain:
+            chain.append(gid)
+            gid = parents.get(gid)
+        privs = dict(gflat.get(gid, ()))
+        for cgid in reversed(chain):
+            privs.update(gcaps.get(cgid, ()))
+            gflat[cgid] = privs.copy()
+        return gflat[chain[0]]
+
+    full = user_ids is None and group_ids is None
+    uids = set(user_ids or ())
+    if full:
+        uids = set(row[0] for row in conn.execute(select([usr.c.uid])))
+    elif group_ids:
+        children = defaultdict(set)
+        for gid, parent in parents.items():
+            if parent is not None:
+                children[parent].add(gid)
+        gids = set()
+        todo = list(group_ids)
+        while len(todo) > 0:
+            gid = todo.pop()
+            if gid in gids:
+                continue
+            gids.add(gid)
+            todo.extend(children.get(gid, ()))
+        for chunk in _chunks(gids):
+            uids.update(row[0] for row in conn.execute(
+                    select([usr.c.uid]).where(usr.c.gid.in_(chunk))))
+            uids.update(row[0] for row in conn.execute(
+                    select([ugrp.c.uid]).where(ugrp.c.gid.in_(chunk))))
+    if len(uids) == 0:
+        return 0
+
+    if full:
+        conn.execute(flat.delete())
+    count = 0
+    for chunk in _chunks(uids):
+        primary = dict(conn.execute(
+                select([usr.c.uid, usr.c.gid]).where(
+                    usr.c.uid.in_(chunk))).fetchall())
+        secondary = defaultdict(list)
+        for uid, gid in conn.execute(
+                select([ugrp.c.uid, ugrp.c.gid]).where(
+                    ugrp.c.uid.in_(chunk)).order_by(ugrp.c.ugid)):
+            secondary[uid].append(gid)
+        ucaps = defaultdict(dict)
+        for uid, privid, value in conn.execute(
+                select([ucap.c.uid, ucap.c.privid, ucap.c.value]).where(
+                    ucap.c.uid.in_(chunk))):
+            ucaps[uid][privid] = value
+
+        rows = []
+        for uid, gid in primary.items():
+            privs = dict(_group_flat(gid)) if gid is not None else {}
+            for sgid in secondary.get(uid, ()):
+                if sgid != gid:
+                    privs.update(_group_flat(sgid))
+            privs.update(ucaps.get(uid, ()))
+            rows.extend({'uid': uid, 'privid': privid, 'value': value}
+                        for privid, value in privs.items())
+        if not full:
+            conn.execute(flat.delete().where(flat.c.uid.in_(chunk)))
+        if len(rows) > 0:
+            conn.execute(flat.insert(), rows)
+            count += len(rows)
+    return count
+
+
+def _flat_privileges_pending(sess, user):
+    """
+    Check if session has unflushed changes which affect materialized
+    privileges of a user.
+
+    Mirrors the checks done when refreshing them on flush.
+    """
+    for obj in itertools.chain(sess.new, sess.dirty, sess.deleted):
+        if isinstance(obj, (UserCapability, UserGroup)):
+            uids = attributes.get_history(obj, 'user_id').sum()
+            if len(uids) == 0 or None in uids or user.id in uids:
+                return True
+        elif isinstance(obj, GroupCapability):
+            return True
+        elif isinstance(obj, User):
+            if obj is user and (obj in sess.new or attributes.get_history(
+                    obj, 'group_id').has_changes()):
+                return True
+        elif isinstance(obj, Group):
+            if (obj in sess.new or obj in sess.deleted
+                    or attributes.get_history(obj,
+                                              'parent_id').has_changes()):
+                return True
+    return False
+
+
+def get_flat_privileges(conn, uid):
+    """
+    Get materialized privileges of a user as a code to value mapping.
+
+    Returns None if materialized table is not available.
+    """
+    if not flat_privileges_ready(conn):
+        return None
+    flat = UserFlatPrivilege.__table__
+    priv = Privilege.__table__
+    return dict(conn.execute(
+            select([priv.c.code, flat.c.value]).select_from(
+                flat.join(priv, flat.c.privid == priv.c.privid)).where(
+                    flat.c.uid == uid)).fetchall())
+
+
 class SecurityPolicyOnExpire(DeclEnum):
     """
     On-password-expire security policy action.
@@ -3523,6 +3776,8 @@ class SecurityPolicy(Base):
             req.session['sess.nextcheck'] = nextcheck
         if nextcheck < ts:
             # Expensive checks
+            if user is None:
+                user = req.user
             if not self.check_password_age(req, user, npsess, ts):
                 return False
             req.session['sess.nextcheck'] = _sess_nextcheck(req, ts)
@@ -4441,6 +4696,7 @@ class FileFolder(Base):
             'mysql_engine':  'InnoDB',
             'mysql_charset': 'utf8',
             'info':          {
+                'bulk_write':    False,
                 'cap_read':      'FILES_LIST',
                 'cap_create':    'FILES_UPLOAD',
                 'cap_edit':      'FILES_EDIT',
@@ -5320,6 +5576,7 @@ class File(Base):
             'mysql_engine':  'InnoDB',
             'mysql_charset': 'utf8',
             'info':          {
+                'bulk_write':    False,
                 'cap_read':      'FILES_LIST',
                 'cap_create':    'FILES_UPLOAD',
                 'cap_edit':      'FILES_EDIT',
@@ -6898,17 +7155,27 @@ class NPSession(Base):
         self.last_time = upt
 
     def check_request(self, req, ts=None):
-        user = req.user
-        if user != self.user:
-            return False
-        if not user.enabled:
-            return False
-        if user.state != UserState.active:
-            return False
-        secpol = user.effective_policy
-        if secpol and not secpol.check_old_session(req, user, self, ts):
-            return False
+        return check_session_request(self, req, ts)
+
+
+def check_session_request(npsess, req, ts=None):
+    """
+    Check if request is allowed to continue an existing session.
+
+    Accepts NPSession objects as well as their cached snapshots.
+    """
+    # Cached identity is only built for active users, and is rebuilt
+    # whenever user or group data changes, so the User object is not
+    # needed here.
+    ident = req.identity
+    if ident is None or ident.id != npsess.user_id:
+        return False
+    if ident.policy_id is None:
         return True
+    secpol = DBSession().query(SecurityPolicy).get(ident.policy_id)
+    if secpol and not secpol.check_old_session(req, None, npsess, ts):
+        return False
+    return True
 
 
 class PasswordHistory(Base):
@@ -7835,6 +8102,7 @@ class AddressBook(Base):
             'mysql_engine':  'InnoDB',
             'mysql_charset': 'utf8',
             'info':          {
+                'bulk_write':    False,
                 'menu_name':     _('Address Books'),
                 'default_sort':  ({'property': 'name', 'direction': 'ASC'},),
                 'grid_view':     ('abookid', 'name', 'user', 'group',
@@ -8321,6 +8589,7 @@ class AddressBookCard(Base):
             'mysql_engine':  'InnoDB',
             'mysql_charset': 'utf8',
             'info':          {
+                'bulk_write':    False,
                 'menu_name':     _('Address Cards'),
                 'default_sort':  ({'property': 'name', 'direction': 'ASC'},),
                 'grid_view':     ('abookid', 'address_book', 'name',
@@ -8774,6 +9043,8 @@ HWAddrUnhexFunction = SQLFunction(
     writes_sql=False)
 
 
+# Models handled by these hooks have 'bulk_write' set to False in their
+# table info, so that ExtJS data API never writes them bypassing the session.
 @event.listens_for(DBSession, 'before_flush')
 def _core_before_flush(sess, flush_ctx, instances):
     add_history = set()
@@ -8807,3 +9078,59 @@ def _core_before_flush(sess, flush_ctx, instances):
                 sess.add(dh)
         for folder in update_synctoken:
             folder.sync_token = token.integer_value
+
+
+@event.listens_for(DBSession, 'before_flush')
+def _flat_before_flush(sess, flush_ctx, instances):
+    # Memberships of deleted groups are removed and their child groups
+    # are detached by database cascades, which fire no ORM events. So
+    # users and groups affected by these deletions are collected
+    # before the rows are gone.
+    gids = set(obj.id for obj in sess.deleted
+               if isinstance(obj, Group) and obj.id is not None)
+    if len(gids) == 0:
+        return
+    conn = sess.connection(mapper=User.__mapper__)
+    if not flat_privileges_ready(conn):
+        return
+    grp = Group.__table__
+    ugrp = UserGroup.__table__
+    usr = User.__table__
+    user_ids, group_ids = sess.info.setdefault('flat_privileges',
+                                               (set(), set()))
+    for chunk in _chunks(gids):
+        user_ids.update(row[0] for row in conn.execute(
+                select([usr.c.uid]).where(usr.c.gid.in_(chunk))))
+        user_ids.update(row[0] for row in conn.execute(
+                select([ugrp.c.uid]).where(ugrp.c.gid.in_(chunk))))
+        group_ids.update(row[0] for row in conn.execute(
+                select([grp.c.gid]).where(grp.c.parentid.in_(chunk))))
+    group_ids.difference_update(gids)
+
+
+@event.listens_for(DBSession, 'after_flush')
+def _core_after_flush(sess, flush_ctx):
+    user_ids, group_ids = sess.info.pop('flat_privileges', (set(), set()))
+    for obj in itertools.chain(sess.new, sess.dirty, sess.deleted):
+        if isinstance(obj, (UserCapability, UserGroup)):
+            user_ids.add(obj.user_id)
+            if isinstance(obj, UserGroup):
+                user_ids.update(
+                    attributes.get_history(obj, 'user_id').deleted or ())
+        elif isinstance(obj, GroupCapability):
+            group_ids.add(obj.group_id)
+        elif isinstance(obj, User):
+            if obj in sess.new or attributes.get_history(
+                    obj, 'group_id').has_changes():
+                user_ids.add(obj.id)
+        elif isinstance(obj, Group):
+            if obj in sess.new or attributes.get_history(
+                    obj, 'parent_id').has_changes():
+                group_ids.add(obj.id)
+    user_ids.discard(None)
+    group_ids.discard(None)
+    if len(user_ids) == 0 and len(group_ids) == 0:
+        return
+    conn = sess.connection(mapper=User.__mapper__)
+    if flat_privileges_ready(conn):
+        refresh_flat_privileges(conn, user_ids, group_ids)
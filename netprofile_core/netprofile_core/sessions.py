@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Core module - UI session state stores
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import ipaddress
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import namedtuple
+from dateutil.parser import parse as dparse
+from sqlalchemy import (
+    and_,
+    bindparam,
+    event,
+    or_
+)
+from sqlalchemy.orm import object_session
+
+from netprofile.common import invalidation
+from netprofile.common.util import make_config_dict
+from netprofile.db.connection import DBSession
+
+from .models import (
+    NPSession,
+    check_session_request
+)
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of sessions updated by a single statement.
+WRITE_BACK_BATCH = 500
+
+# Invalidation bus channel for sessions evicted from in-process stores.
+SESSION_CHANNEL = 'core.sessions'
+
+_store = {}
+
+
+class SessionState(namedtuple('SessionState', ('id',
+                                               'session_name',
+                                               'user_id',
+                                               'login',
+                                               'start_time',
+                                               'last_time',
+                                               'ip_address',
+                                               'ipv6_address'))):
+    """
+    Snapshot of NPSession row, kept in a session store.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_session(cls, npsess):
+        return cls(id=npsess.id,
+                   session_name=npsess.session_name,
+                   user_id=npsess.user_id,
+                   login=npsess.login,
+                   start_time=npsess.start_time,
+                   last_time=npsess.last_time,
+                   ip_address=npsess.ip_address,
+                   ipv6_address=npsess.ipv6_address)
+
+    @classmethod
+    def loads(cls, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        data = json.loads(data)
+        for key in ('start_time', 'last_time'):
+            if data.get(key):
+                data[key] = dparse(data[key])
+        for key in ('ip_address', 'ipv6_address'):
+            if data.get(key):
+                data[key] = ipaddress.ip_address(data[key])
+        return cls(**data)
+
+    def dumps(self):
+        data = self._asdict()
+        for key in ('start_time', 'last_time'):
+            if data[key] is not None:
+                data[key] = data[key].isoformat()
+        for key in ('ip_address', 'ipv6_address'):
+            if data[key] is not None:
+                data[key] = str(data[key])
+        return json.dumps(data)
+
+    def __str__(self):
+        return str(self.session_name)
+
+    def check_request(self, req, ts=None):
+        return check_session_request(self, req, ts)
+
+
+class SessionStore(object):
+    """
+    Base class for UI session state stores.
+
+    Stores keep session snapshots and accumulate last activity times,
+    which are periodically written back to NPSession table.
+    """
+    def __init__(self, ttl=7200, flush_interval=None):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._next_flush = None
+        self._flush_lock = threading.Lock()
+
+    def get(self, sname):
+        raise NotImplementedError
+
+    def put(self, state):
+        raise NotImplementedError
+
+    def touch(self, state, ts):
+        raise NotImplementedError
+
+    def remove(self, sname):
+        raise NotImplementedError
+
+    def pop_activity(self):
+        """
+        Get and reset accumulated activity as a mapping of session
+        names to last activity times.
+        """
+        raise NotImplementedError
+
+    def flush_due(self):
+        """
+        Check if inline write-back should be done by current request.
+        """
+        if not self.flush_interval:
+            return False
+        now = time.monotonic()
+        with self._flush_lock:
+            if self._next_flush is None:
+                self._next_flush = now + self.flush_interval
+                return False
+            if now < self._next_flush:
+                return False
+            self._next_flush = now + self.flush_interval
+            return True
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process session store. Only useful for single-process servers.
+    """
+    def __init__(self, ttl=7200, flush_interval=60):
+        super(MemorySessionStore, self).__init__(ttl, flush_interval)
+        self._lock = threading.Lock()
+        self._states = {}
+        self._activity = {}
+
+    def get(self, sname):
+        entry = self._states.get(sname)
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[1]:
+            with self._lock:
+                self._states.pop(sname, None)
+            return None
+        return entry[0]
+
+    def put(self, state):
+        with self._lock:
+            self._states[state.session_name] = (state,
+                                                time.monotonic() + self.ttl)
+
+    def touch(self, state, ts):
+        state = state._replace(last_time=ts)
+        with self._lock:
+            self._states[state.session_name] = (state,
+                                                time.monotonic() + self.ttl)
+            self._activity[state.session_name] = ts
+        return state
+
+    def remove(self, sname):
+        with self._lock:
+            self._states.pop(sname, None)
+            self._activity.pop(sname, None)
+
+    def clear(self):
+        """
+        Drop all session snapshots, keeping accumulated activity.
+        """
+        with self._lock:
+            self._states = {}
+
+    def pop_activity(self):
+        with self._lock:
+            ret = self._activity
+            self._activity = {}
+        return ret
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Session store shared by all processes via redis.
+    """
+    def __init__(self, ttl=7200, flush_interval=None,
+                 prefix='npsess', **conf):
+        super(RedisSessionStore, self).__init__(ttl, flush_interval)
+        self.prefix = prefix
+        self.conf = conf
+        self.activity_key = '%s.activity' % (prefix,)
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+
+            self._client = redis.Redis(**self.conf)
+        return self._client
+
+    def _key(self, sname):
+        return '%s:%s' % (self.prefix, sname)
+
+    def get(self, sname):
+        data = self.client.get(self._key(sname))
+        if data is None:
+            return None
+        try:
+            return SessionState.loads(data)
+        except (ValueError, TypeError):
+            logger.warning('Malformed session state for %s', sname)
+            return None
+
+    def put(self, state):
+        self.client.setex(self._key(state.session_name), self.ttl,
+                          state.dumps())
+
+    def touch(self, state, ts):
+        state = state._replace(last_time=ts)
+        pipe = self.client.pipeline()
+        pipe.setex(self._key(state.session_name), self.ttl, state.dumps())
+        pipe.hset(self.activity_key, state.session_name, ts.isoformat())
+        pipe.execute()
+        return state
+
+    def remove(self, sname):
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(sname))
+        pipe.hdel(self.activity_key, sname)
+        pipe.execute()
+
+    def pop_activity(self):
+        import redis
+
+        # Renaming is atomic, so activity recorded meanwhile is never lost.
+        tmpkey = '%s:%s' % (self.activity_key, uuid.uuid4().hex)
+        try:
+            self.client.rename(self.activity_key, tmpkey)
+        except redis.ResponseError:
+            # Nothing was recorded since last write-back.
+            return {}
+        pipe = self.client.pipeline()
+        pipe.hgetall(tmpkey)
+        pipe.delete(tmpkey)
+        data = pipe.execute()[0]
+        ret = {}
+        for sname, ts in data.items():
+            if isinstance(sname, bytes):
+                sname = sname.decode('utf-8')
+            if isinstance(ts, bytes):
+                ts = ts.decode('utf-8')
+            ret[sname] = dparse(ts)
+        return ret
+
+
+def configure_store(settings):
+    cfg = make_config_dict(settings, 'netprofile.auth.session_store.')
+    backend = cfg.pop('backend', None)
+    if not backend:
+        return None
+    opts = {}
+    if 'ttl' in cfg:
+        opts['ttl'] = int(cfg['ttl'])
+    if 'flush_interval' in cfg:
+        opts['flush_interval'] = int(cfg['flush_interval'])
+    if backend == 'memory':
+        return MemorySessionStore(**opts)
+    if backend == 'redis':
+        if 'prefix' in cfg:
+            opts['prefix'] = cfg['prefix']
+        opts.update(make_config_dict(cfg, 'redis.'))
+        return RedisSessionStore(**opts)
+    raise ValueError('Unknown session store backend: %s' % (backend,))
+
+
+def get_store(settings=None):
+    """
+    Get session store configured for this process, or None if session
+    state is kept in database only.
+    """
+    if 'store' not in _store:
+        if settings is None:
+            return None
+        store = configure_store(settings)
+        if isinstance(store, MemorySessionStore):
+            if invalidation.bus is None:
+                logger.warning('In-process session store is not shared '
+                               'between workers, configure invalidation '
+                               'bus if running more than one')
+            invalidation.subscribe(SESSION_CHANNEL, _drop_local_session)
+        _store['store'] = store
+    return _store['store']
+
+
+def write_back(sess, store):
+    """
+    Write accumulated session activity to NPSession table.
+
+    Sessions that were deleted from the table in the meantime are
+    not recreated.
+    """
+    activity = store.pop_activity()
+    if len(activity) == 0:
+        return 0
+    tbl = NPSession.__table__
+    upd = tbl.update().where(and_(
+        tbl.c.sname == bindparam('b_sname'),
+        or_(tbl.c.lastts.is_(None),
+            tbl.c.lastts < bindparam('b_ts')))).values(
+                lastts=bindparam('b_ts'))
+    rows = [{'b_sname': sname, 'b_ts': ts}
+            for sname, ts in sorted(activity.items())]
+    for idx in range(0, len(rows), WRITE_BACK_BATCH):
+        sess.execute(upd, rows[idx:idx + WRITE_BACK_BATCH])
+    logger.debug('Wrote back activity of %d sessions', len(rows))
+    return len(rows)
+
+
+def _drop_local_session(sname):
+    store = get_store()
+    if not isinstance(store, MemorySessionStore):
+        return
+    if sname is None:
+        store.clear()
+    else:
+        store.remove(sname)
+
+
+def _evict_sessions(snames):
+    store = get_store()
+    if store is None:
+        return
+    # Other processes keep their own copies of in-process stores.
+    notify = (isinstance(store, MemorySessionStore)
+              and invalidation.bus is not None)
+    for sname in sorted(snames):
+        if notify:
+            invalidation.publish(SESSION_CHANNEL, sname)
+        else:
+            store.remove(sname)
+
+
+def _del_session(mapper, conn, tgt):
+    if tgt.session_name:
+        sess = object_session(tgt)
+        sess.info.setdefault('deleted_sessions', set()).add(
+                tgt.session_name)
+
+
+@event.listens_for(DBSession, 'after_commit')
+def _sessions_after_commit(sess):
+    snames = sess.info.pop('deleted_sessions', None)
+    if snames:
+        _evict_sessions(snames)
+
+
+@event.listens_for(DBSession, 'after_rollback')
+def _sessions_after_rollback(sess):
+    sess.info.pop('deleted_sessions', None)
+
+
+event.listen(NPSession, 'after_delete', _del_session)
@@ -3,6 +3,9 @@ Ext.define('NetProfile.controller.DataStores', {
 	requires: [
 		'Ext.data.operation.Read'
 	],
+	bgExportTitleText: 'Export',
+	bgExportStartedText: 'Export started. You will be notified when the file is ready.',
+	bgExportErrorText: 'Unable to start export.',
 	init: function()
 	{
 		this.stores = {};
@@ -43,6 +46,18 @@ Ext.define('NetProfile.controller.DataStores', {
 		form_params = form.getValues();
 		if(form_params)
 			Ext.apply(params, form_params);
+		if(params.__background)
+		{
+			delete params.__background;
+			NetProfile.api.Export.start(grid.apiModule, grid.apiClass, format, params, function(data, res)
+			{
+				if(data && data.success)
+					NetProfile.msg.notify(this.bgExportTitleText, this.bgExportStartedText);
+				else
+					NetProfile.msg.err(this.bgExportTitleText, this.bgExportErrorText);
+			}, this);
+			return;
+		}
 		Ext.getCmp('npws_filedl').loadExport(grid.apiModule, grid.apiClass, format, params);
 	},
 	onBeforeLoad: function(store, op)
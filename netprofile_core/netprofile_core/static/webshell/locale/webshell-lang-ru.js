@@ -182,6 +182,13 @@ Ext.onReady(function()
 		}
 	});
 
+	Ext.define('Ext.locale.ru.NetProfile.controller.DataStores', {
+		override: 'NetProfile.controller.DataStores',
+		bgExportTitleText: 'Экспорт',
+		bgExportStartedText: 'Экспорт запущен. Вы получите уведомление, когда файл будет готов.',
+		bgExportErrorText: 'Не удалось запустить экспорт.'
+	});
+
 	Ext.define('Ext.locale.ru.NetProfile.controller.SettingsForm', {
 		override: 'NetProfile.controller.SettingsForm',
 		btnResetText: 'Сбросить',
@@ -296,6 +303,10 @@ Ext.onReady(function()
 		clientInvalidMsg: 'Форма содержит некорректные данные и не может быть отправлена.',
 		connectFailureMsg: 'Ошибка соединения с сервером.',
 	});
+	Ext.define('Ext.locale.ru.NetProfile.view.FileDownload', {
+		override: 'NetProfile.view.FileDownload',
+		errorText: 'Ошибка'
+	});
 	Ext.define('Ext.locale.ru.NetProfile.view.FileIconView', {
 		override: 'NetProfile.view.FileIconView',
 		sizeText: 'Размер: {0}',
@@ -18,11 +18,39 @@ Ext.define('NetProfile.view.FileDownload', {
 	hidden: true,
 	stateful: false,
 
+	errorText: 'Error',
+
 	initComponent: function()
 	{
 		this.form = null;
 		this.callParent(arguments);
 	},
+	afterRender: function()
+	{
+		this.callParent(arguments);
+		this.getEl().on('load', this.onFrameLoad, this);
+	},
+	onFrameLoad: function()
+	{
+		var doc = null,
+			text;
+
+		// Downloaded files don't replace frame contents, so anything
+		// loaded into it is an error page.
+		try
+		{
+			doc = this.getEl().dom.contentDocument;
+		}
+		catch(e)
+		{
+			return;
+		}
+		if(!doc || !doc.body)
+			return;
+		text = Ext.String.trim(doc.body.textContent || '');
+		if(text)
+			NetProfile.msg.err(this.errorText, '{0}', text);
+	},
 	getForm: function()
 	{
 		var me = this;
@@ -23,16 +23,40 @@
 from __future__ import (unicode_literals, print_function,
                         absolute_import, division)
 
+import datetime as dt
+import hashlib
+import json
+import re
+import transaction
+from dateutil.tz import tzlocal
+from pyramid.authentication import RemoteUserAuthenticationPolicy
 from pyramid.i18n import TranslationStringFactory
+from pyramid.request import Request
+from pyramid.scripting import prepare
 from pyramid.settings import asbool
 from repoze.sendmail.queue import QueueProcessor
 from repoze.sendmail.mailer import SMTPMailer
+from six.moves.urllib.parse import unquote
 
 from netprofile.celery import (
     app,
     task_meta
 )
 from netprofile.common.util import make_config_dict
+from netprofile.db.connection import DBSession
+
+from .auth import find_princs
+from .models import (
+    File,
+    FileFolder,
+    User,
+
+    F_DEFAULT_FILES
+)
+from .sessions import (
+    get_store as get_session_store,
+    write_back as write_back_sessions
+)
 
 _ = TranslationStringFactory('netprofile_core')
 
@@ -57,3 +81,157 @@ def task_send_queued_mail():
 
     qp = QueueProcessor(mailer, maildir, ignore_transient=True)
     qp.send_messages()
+
+
+@task_meta(cap='BASE_ADMIN',
+           title=_('Refresh report rollup tables'))
+@app.task
+def task_refresh_rollups():
+    sess = DBSession()
+    try:
+        for moddef, models in app.mmgr.models.items():
+            for model in models.values():
+                for rollup in model.__table__.info.get('rollups', ()):
+                    rollup.refresh(sess, model)
+    except Exception:
+        transaction.abort()
+        raise
+    transaction.commit()
+
+
+@task_meta(cap='BASE_ADMIN',
+           title=_('Write back UI session activity'))
+@app.task
+def task_write_back_sessions():
+    store = get_session_store(app.settings)
+    if store is None:
+        return 0
+    sess = DBSession()
+    try:
+        count = write_back_sessions(sess, store)
+    except Exception:
+        transaction.abort()
+        raise
+    transaction.commit()
+    return count
+
+
+# Report export progress every this many bytes.
+_EXPORT_PROGRESS_STEP = 1024 * 1024
+
+_FILENAME_RE = re.compile(r"filename\*=UTF-8''([^;]+)")
+
+
+def _notify_user(uid, msg):
+    cfg = make_config_dict(app.settings, 'netprofile.rt.redis.')
+    if len(cfg) == 0:
+        return
+    import redis
+
+    msg.update({
+        'type':    'direct',
+        'msgtype': 'system',
+        'fromid':  'log',
+        'ts':      dt.datetime.now().replace(tzinfo=tzlocal()).isoformat()
+    })
+    redis.Redis(**cfg).publish('direct.%d' % (uid,), json.dumps(msg))
+
+
+def _make_request(user, locale):
+    req = Request.blank('/', environ={'REMOTE_USER': user.login})
+    # Authenticate as the task owner, so that identity, ACLs and
+    # permission checks are the same as in the owner's own requests.
+    req.auth_policy = RemoteUserAuthenticationPolicy(callback=find_princs)
+    if locale:
+        req.locale_name = locale
+    return prepare(request=req, registry=app.config.registry)
+
+
+@task_meta(cap='BASE_ADMIN',
+           title=_('Export data'))
+@app.task(bind=True)
+def task_export(self, uid, moddef, model, fmt, params,
+                locale=None, ffid=None):
+    sess = DBSession()
+    user = sess.query(User).get(uid)
+    if user is None:
+        raise ValueError('Unknown user ID: %r' % (uid,))
+    folder = None
+    if ffid:
+        folder = sess.query(FileFolder).get(ffid)
+        if folder is None or not folder.can_write(user):
+            raise ValueError('Folder access denied')
+    elif not user.root_writable:
+        raise ValueError('Folder access denied')
+    env = _make_request(user, locale)
+    try:
+        extm = app.mmgr.get_module_browser()[moddef][model]
+        if extm.export_view is None:
+            raise ValueError('Export is not allowed for this model')
+        if extm.cap_read and not env['request'].has_permission(extm.cap_read):
+            raise ValueError('Access denied')
+        resp = app.mmgr.get_export_format(fmt).export(extm, params,
+                                                       env['request'])
+        fname = '%s-%s' % (model, dt.date.today().isoformat())
+        match = _FILENAME_RE.search(resp.content_disposition or '')
+        if match:
+            fname = unquote(match.group(1))
+        obj = File(user_id=user.id,
+                   user=user,
+                   group_id=user.group.id,
+                   group=user.group,
+                   rights=F_DEFAULT_FILES)
+        obj.name = obj.filename = fname
+        obj.folder = folder
+        obj.mime_type = resp.content_type
+        obj.size = 0
+        sess.add(obj)
+        ctx = hashlib.md5()
+        size = 0
+        next_update = _EXPORT_PROGRESS_STEP
+        app_iter = resp.app_iter
+        try:
+            with obj.open('w+', user, sess) as fd:
+                for chunk in app_iter:
+                    ctx.update(chunk)
+                    fd.write(chunk)
+                    size += len(chunk)
+                    if size >= next_update:
+                        next_update = size + _EXPORT_PROGRESS_STEP
+                        self.update_state(state='PROGRESS', meta={
+                            'uid':  uid,
+                            'size': size
+                        })
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if callable(close):
+                close()
+        obj.etag = ctx.hexdigest()
+        obj.data = None
+        sess.flush()
+        ret = {
+            'uid':  uid,
+            'size': size,
+            'id':   obj.id,
+            'name': obj.filename,
+            'mime': obj.plain_mime_type
+        }
+    except Exception as e:
+        transaction.abort()
+        _notify_user(uid, {
+            'bodytype': 'task_error',
+            'msg':      [500, str(e)]
+        })
+        raise
+    finally:
+        env['closer']()
+    transaction.commit()
+    _notify_user(uid, {
+        'bodytype': 'file',
+        'msg':      {
+            'id':    ret['id'],
+            'fname': ret['name'],
+            'mime':  ret['mime']
+        }
+    })
+    return ret
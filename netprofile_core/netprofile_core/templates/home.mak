@@ -22,6 +22,9 @@
 <%inherit file="netprofile_core:templates/base.mak"/>
 <%block name="head">
 	<script type="text/javascript" src="${req.route_url('extapi')}" charset="UTF-8"></script>
+% if schema_url:
+	<script type="text/javascript" src="${schema_url}" charset="UTF-8"></script>
+% endif
 	<script type="text/javascript" src="${req.route_url('core.js.webshell')}" charset="UTF-8"></script>
 </%block>
 
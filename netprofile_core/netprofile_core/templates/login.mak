@@ -29,7 +29,11 @@
 <div id="login_outer" role="presentation">
 	<img alt="NetProfile" src="${req.static_url('netprofile_core:static/img/nplogo.png')}" draggable="false" role="banner" />
 	<input type="hidden" id="csrf" name="csrf" value="${req.get_csrf() | h}" />
-% if failed:
+% if busy:
+	<div class="elem errmsg" role="alert">
+		${_('Server is busy, please try again later.') | h}
+	</div>
+% elif failed:
 	<div class="elem errmsg" role="alert">
 		${_('Authentication failed.') | h}
 	</div>
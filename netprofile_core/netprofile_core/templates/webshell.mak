@@ -1100,91 +1100,9 @@ Ext.require([
 </%np:limit>\
 % endfor
 
-% for module in modules:
-% for model in modules[module]:
-<% mod = modules[module][model] %>
-	Ext.define('NetProfile.proxy.${module}.${model}', {
-		extend: 'Ext.data.proxy.Direct',
-		alias: 'proxy.${module}_${model}',
-		api: {
-			create:  NetProfile.api.${model}['create'],
-			read:    NetProfile.api.${model}['read'],
-			update:  NetProfile.api.${model}['update'],
-			destroy: NetProfile.api.${model}['delete']
-		},
-		simpleSortMode: false,
-		filterParam: '__filter',
-		sortParam: '__sort',
-		startParam: '__start',
-		limitParam: '__limit',
-		pageParam: '__page',
-		groupParam: '__group',
-		reader: {
-			type: 'json',
-			idProperty: '${mod.pk}',
-			messageProperty: 'message',
-			rootProperty: 'records',
-			successProperty: 'success',
-			totalProperty: 'total'
-		},
-		writer: {
-			type: 'json',
-			rootProperty: 'records',
-			writeAllFields: false,
-			clientIdProperty: '_clid',
-			allowSingle: false
-		}
-	});
-	Ext.define('NetProfile.model.${module}.${model}', {
-		extend: 'NetProfile.data.BaseModel',
-		fields: ${mod.get_reader_cfg(req) | n,jsone},
-		idProperty: '${mod.pk}',
-		proxy: {
-			type: '${module}_${model}'
-		}
-	});
-	Ext.define('NetProfile.store.${module}.${model}', {
-		alias: 'store.${module}_${model}',
-		extend: 'Ext.data.Store',
-		requires: 'NetProfile.model.${module}.${model}',
-		model: 'NetProfile.model.${module}.${model}',
-		sorters: ${mod.default_sort | n,jsone},
-		pageSize: NetProfile.userSettings['core.ui.datagrid_perpage'],
-		remoteFilter: true,
-		remoteSort: true,
-		storeId: 'npstore_${module}_${model}',
-		autoLoad: false,
-		autoSync: true
-	});
-	Ext.define('NetProfile.view.grid.${module}.${model}', {
-		extend: 'NetProfile.grid.ModelGrid',
-		alias: 'widget.grid_${module}_${model}',
-		columns: ${mod.get_column_cfg(req) | n,jsone},
-		apiModule: '${module}',
-		apiClass: '${model}',
-		stateId: 'npgrid_${module}_${model}',
-		stateful: true,
-		simpleSearch: ${'true' if mod.easy_search else 'false'},
-		extraSearch: ${mod.get_extra_search_cfg(req) | n,jsone},
-		extraActions: ${mod.get_extra_actions(req) | n,jsone},
-		detailPane: ${mod.get_detail_pane(req) | n,jsone},
-% if mod.row_class_field:
-		rowClassField: ${mod.row_class_field | n,jsone},
-% endif
-% if mod.create_wizard:
-		canCreate: <%np:jscap code="${mod.cap_create}" />,
-% else:
-		canCreate: false,
-% endif
-		canEdit: <%np:jscap code="${mod.cap_edit}" />,
-		canDelete: <%np:jscap code="${mod.cap_delete}" />,
-		canShowReports: true,
-		reportAggregates: ${mod.get_aggregates(req) | n,jsone},
-		reportGroupBy: ${mod.get_groupby_groups(req) | n,jsone},
-		canExport: ${'false' if (mod.export_view is None) else 'true'}
-	});
-% endfor
-% endfor
+	// Schema script is only included for logged in users.
+	if(NetProfile.defineSchema)
+		NetProfile.defineSchema();
 
 	// Choose supported state storage
 	if(Ext.util.LocalStorage.supported)
@@ -0,0 +1,118 @@
+## -*- coding: utf-8 -*-
+##
+## NetProfile: JavaScript template for model schema of administrative UI
+## Copyright © 2017 Alex Unigovsky
+##
+## This file is part of NetProfile.
+## NetProfile is free software: you can redistribute it and/or
+## modify it under the terms of the GNU Affero General Public
+## License as published by the Free Software Foundation, either
+## version 3 of the License, or (at your option) any later
+## version.
+##
+## NetProfile is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+## GNU Affero General Public License for more details.
+##
+## You should have received a copy of the GNU Affero General
+## Public License along with NetProfile. If not, see
+## <http://www.gnu.org/licenses/>.
+##
+<%!
+
+from netprofile.tpl.filters import jsone
+
+%>\
+<%namespace name="np" file="netprofile_core:templates/np.mak" />\
+Ext.ns('NetProfile');
+
+NetProfile.defineSchema = function()
+{
+% for module in modules:
+% for model in modules[module]:
+<% mod = modules[module][model] %>
+	Ext.define('NetProfile.proxy.${module}.${model}', {
+		extend: 'Ext.data.proxy.Direct',
+		alias: 'proxy.${module}_${model}',
+		api: {
+			create:  NetProfile.api.${model}['create'],
+			read:    NetProfile.api.${model}['read'],
+			update:  NetProfile.api.${model}['update'],
+			destroy: NetProfile.api.${model}['delete']
+		},
+		simpleSortMode: false,
+		filterParam: '__filter',
+		sortParam: '__sort',
+		startParam: '__start',
+		limitParam: '__limit',
+		pageParam: '__page',
+		groupParam: '__group',
+		reader: {
+			type: 'json',
+			idProperty: '${mod.pk}',
+			messageProperty: 'message',
+			rootProperty: 'records',
+			successProperty: 'success',
+			totalProperty: 'total'
+		},
+		writer: {
+			type: 'json',
+			rootProperty: 'records',
+			writeAllFields: false,
+			clientIdProperty: '_clid',
+			allowSingle: false
+		}
+	});
+	Ext.define('NetProfile.model.${module}.${model}', {
+		extend: 'NetProfile.data.BaseModel',
+		fields: ${mod.get_reader_cfg(req) | n,jsone},
+		idProperty: '${mod.pk}',
+		proxy: {
+			type: '${module}_${model}'
+		}
+	});
+	Ext.define('NetProfile.store.${module}.${model}', {
+		alias: 'store.${module}_${model}',
+		extend: 'Ext.data.Store',
+		requires: 'NetProfile.model.${module}.${model}',
+		model: 'NetProfile.model.${module}.${model}',
+		sorters: ${mod.default_sort | n,jsone},
+		pageSize: NetProfile.userSettings['core.ui.datagrid_perpage'],
+		remoteFilter: true,
+		remoteSort: true,
+		storeId: 'npstore_${module}_${model}',
+		autoLoad: false,
+		autoSync: true
+	});
+	Ext.define('NetProfile.view.grid.${module}.${model}', {
+		extend: 'NetProfile.grid.ModelGrid',
+		alias: 'widget.grid_${module}_${model}',
+		columns: ${mod.get_column_cfg(req) | n,jsone},
+		apiModule: '${module}',
+		apiClass: '${model}',
+		stateId: 'npgrid_${module}_${model}',
+		stateful: true,
+		simpleSearch: ${'true' if mod.easy_search else 'false'},
+		extraSearch: ${mod.get_extra_search_cfg(req) | n,jsone},
+		extraActions: ${mod.get_extra_actions(req) | n,jsone},
+		detailPane: ${mod.get_detail_pane(req) | n,jsone},
+% if mod.row_class_field:
+		rowClassField: ${mod.row_class_field | n,jsone},
+% endif
+% if mod.create_wizard:
+		canCreate: <%np:jscap code="${mod.cap_create}" />,
+% else:
+		canCreate: false,
+% endif
+		canEdit: <%np:jscap code="${mod.cap_edit}" />,
+		canDelete: <%np:jscap code="${mod.cap_delete}" />,
+		canShowReports: true,
+		reportAggregates: ${mod.get_aggregates(req) | n,jsone},
+		reportGroupBy: ${mod.get_groupby_groups(req) | n,jsone},
+		canExport: ${'false' if (mod.export_view is None) else 'true'}
+	});
+% endfor
+% endfor
+};
+
@@ -26,16 +26,20 @@ from __future__ import (unicode_literals, print_function,
 import json
 import logging
 import datetime as dt
+import hashlib
 import os
 import pkg_resources
+import uuid
 from collections import (
     defaultdict,
     Iterable
 )
 from six import PY3
 from dateutil.parser import parse as dparse
+from dogpile.cache.api import NO_VALUE
 from pyramid.response import Response
 from pyramid.i18n import get_locale_name
+from pyramid.renderers import render
 from pyramid.view import (
     forbidden_view_config,
     notfound_view_config,
@@ -62,14 +66,28 @@ from sqlalchemy.orm import (
 )
 
 from netprofile import locale_neg
+from netprofile.common import cache
 from netprofile.common.auth import (
     auth_add,
     auth_remove
 )
+from netprofile.common.crypto import (
+    HashQueueFull,
+    get_hash_stats
+)
 from netprofile.common.util import make_config_dict
 from netprofile.common.modules import IModuleManager
 from netprofile.common.hooks import register_hook
-from netprofile.db.connection import DBSession
+from netprofile.common.jsonutil import json_default
+from netprofile.db.connection import (
+    DBSession,
+    get_detached_session
+)
+from netprofile.export import (
+    ExportLimitExceeded,
+    close_after
+)
+from netprofile.export.cache import cached_export
 from netprofile.ext.data import ExtModel
 from netprofile.ext.direct import extdirect_method
 from netprofile.ext.wizards import (
@@ -107,6 +125,8 @@ else:
 
 logger = logging.getLogger(__name__)
 
+_SCHEMA_VERSION_KEY = 'core.webshell.schema.version'
+
 
 @view_config(route_name='core.home',
              renderer='netprofile_core:templates/home.mak',
@@ -115,11 +135,16 @@ def home_screen(request):
     mmgr = request.registry.getUtility(IModuleManager)
     lang = get_locale_name(request)
     tpldef = {
-        'res_css': mmgr.get_css(request),
-        'res_js':  mmgr.get_js(request),
-        'res_ljs': mmgr.get_local_js(request, lang),
-        'cur_loc': lang
+        'res_css':    mmgr.get_css(request),
+        'res_js':     mmgr.get_js(request),
+        'res_ljs':    mmgr.get_local_js(request, lang),
+        'cur_loc':    lang,
+        'schema_url': None
     }
+    if request.user:
+        tpldef['schema_url'] = request.route_url(
+                'core.js.webshell.schema',
+                hash=get_webshell_schema(request)[0])
     return tpldef
 
 
@@ -158,6 +183,7 @@ def do_login(request):
         return HTTPFound(location=request.route_url('core.home'))
     login = ''
     did_fail = False
+    busy = False
     cur_locale = locale_neg(request)
     if 'submit' in request.POST:
         login = request.POST.get('user', '')
@@ -171,14 +197,19 @@ def do_login(request):
                     User.enabled.is_(True),
                     User.login == login)
             login_allowed = global_setting('core.admin.login_allowed')
-            for user in q:
-                if user.check_password(passwd):
-                    user_privs = user.flat_privileges
-                    # XXX: maybe make override privilege set configurable?
-                    if (login_allowed
-                            or user_privs.get('ADMIN_DEV', False)
-                            or user_privs.get('ADMIN_SECURITY', False)):
-                        return auth_add(request, login, 'core.home')
+            try:
+                for user in q:
+                    if user.check_password(passwd):
+                        user_privs = user.flat_privileges
+                        # XXX: maybe make override privilege set
+                        #      configurable?
+                        if (login_allowed
+                                or user_privs.get('ADMIN_DEV', False)
+                                or user_privs.get('ADMIN_SECURITY', False)):
+                            return auth_add(request, login, 'core.home')
+            except HashQueueFull:
+                busy = True
+                request.response.status_int = 503
         did_fail = True
 
     mmgr = request.registry.getUtility(IModuleManager)
@@ -186,6 +217,7 @@ def do_login(request):
     return {
         'login':   login,
         'failed':  did_fail,
+        'busy':    busy,
         'res_css': mmgr.get_css(request),
         'res_js':  mmgr.get_js(request),
         'res_ljs': mmgr.get_local_js(request, cur_locale),
@@ -226,6 +258,63 @@ def js_webshell(request):
     }
 
 
+def bump_schema_version():
+    """
+    Invalidate cached model schema scripts of all users.
+
+    Needs to be called when data rendered into the schema changes
+    without changing loaded modules, locale or user privileges, like
+    dynamic column choices or hook-provided grid actions.
+    """
+    if cache.cache is None:
+        return
+    cache.cache.set(_SCHEMA_VERSION_KEY, uuid.uuid4().hex)
+
+
+def get_webshell_schema(request):
+    """
+    Get a tuple of content hash and source of model schema script.
+
+    The script is cached for every combination of loaded modules, locale,
+    user privileges and schema data version.
+    """
+    mmgr = request.registry.getUtility(IModuleManager)
+
+    def _render():
+        body = render('netprofile_core:templates/webshell_schema.mak',
+                      {'modules': mmgr.get_module_browser()},
+                      request=request)
+        return hashlib.sha1(body.encode()).hexdigest(), body
+
+    if cache.cache is None:
+        return _render()
+    key = hashlib.sha1()
+    version = cache.cache.get(_SCHEMA_VERSION_KEY)
+    if version is not NO_VALUE:
+        key.update(('%s;' % (version,)).encode())
+    for moddef, mod in sorted(mmgr.loaded.items()):
+        key.update(('%s=%s;' % (moddef, mod.version())).encode())
+    key.update(('%s;' % (get_locale_name(request),)).encode())
+    for code, value in sorted(request.identity.privileges.items()):
+        key.update(('%s=%d;' % (code, bool(value))).encode())
+    return cache.cache.get_or_create('core.webshell.schema:%s' % (
+                                     key.hexdigest(),), _render)
+
+
+@view_config(route_name='core.js.webshell.schema', permission='USAGE')
+def js_webshell_schema(request):
+    schema_hash, body = get_webshell_schema(request)
+    resp = Response(body,
+                    content_type=str('text/javascript'),
+                    charset=str('UTF-8'))
+    if request.matchdict.get('hash') == schema_hash:
+        # URL changes along with content, so it can be cached forever.
+        resp.cache_control = 'private, max-age=31536000, immutable'
+    else:
+        resp.cache_control = 'no-cache'
+    return resp
+
+
 # No authentication!
 @view_config(route_name='core.wellknown')
 def wellknown_redirect(request):
@@ -324,24 +413,36 @@ def file_mnt(request):
     return resp
 
 
-@view_config(route_name='core.export', permission='USAGE')
-def data_export(request):
-    moddef = request.matchdict.get('module')
-    objcls = request.matchdict.get('model')
+def _get_export_model(request, moddef, objcls):
     if not moddef or not objcls:
-        return HTTPNotFound()
+        return None
     mmgr = request.registry.getUtility(IModuleManager)
     mb = mmgr.get_module_browser()
     if moddef not in mb:
-        return HTTPNotFound()
+        return None
     mod = mb[moddef]
     if objcls not in mod:
-        return HTTPNotFound()
-    model = mod[objcls]
+        return None
+    return mod[objcls]
+
+
+def _can_export(request, model):
     if model.export_view is None:
-        return HTTPForbidden()
+        return False
     rcap = model.cap_read
     if rcap and not request.has_permission(rcap):
+        return False
+    return True
+
+
+@view_config(route_name='core.export', permission='USAGE')
+def data_export(request):
+    model = _get_export_model(request,
+                              request.matchdict.get('module'),
+                              request.matchdict.get('model'))
+    if model is None:
+        return HTTPNotFound()
+    if not _can_export(request, model):
         return HTTPForbidden()
     csrf = request.POST.get('csrf')
     fmt = request.POST.get('format')
@@ -350,8 +451,154 @@ def data_export(request):
         return HTTPForbidden()
     if not fmt:
         raise ValueError('No export format specified')
-    fmt = mmgr.get_export_format(fmt)
-    return fmt.export(model, json.loads(params), request)
+    mmgr = request.registry.getUtility(IModuleManager)
+    try:
+        return cached_export(mmgr.get_export_format(fmt), fmt,
+                             model, json.loads(params), request)
+    except ExportLimitExceeded as e:
+        # Shown to the user by the download frame in webshell.
+        return Response(text=str(e), status=400,
+                        content_type='text/plain', charset='UTF-8')
+
+
+def _report_generator(rows, batch=500):
+    buf = []
+    for row in rows:
+        buf.append(json.dumps(row, default=json_default,
+                              ensure_ascii=False, separators=(',', ':')))
+        if len(buf) >= batch:
+            buf.append('')
+            yield '\n'.join(buf).encode('utf-8')
+            buf = []
+    if len(buf) > 0:
+        buf.append('')
+        yield '\n'.join(buf).encode('utf-8')
+
+
+@view_config(route_name='core.report', permission='USAGE')
+def data_report(request):
+    """
+    Streaming variant of ExtDirect report API.
+
+    Takes the same parameters as report() as JSON in "params" request
+    parameter, and returns report rows as JSON Lines.
+    """
+    model = _get_export_model(request,
+                              request.matchdict.get('module'),
+                              request.matchdict.get('model'))
+    if model is None:
+        return HTTPNotFound()
+    rcap = model.cap_read
+    if rcap and not request.has_permission(rcap):
+        return HTTPForbidden()
+    params = json.loads(request.params.get('params') or '{}')
+    if not isinstance(params, dict):
+        raise ValueError('Invalid report parameters')
+    # Response body is generated after the request transaction has
+    # ended, so rows are streamed using a separate session.
+    sess = get_detached_session()
+    try:
+        # Query errors are raised here, before the response is sent.
+        rows = model.iter_report(params, request, sess=sess)
+    except Exception:
+        sess.close()
+        raise
+    res = Response(content_type='application/x-ndjson', charset='UTF-8')
+    res.cache_control.no_cache = True
+    res.cache_control.no_store = True
+    res.cache_control.private = True
+    res.app_iter = close_after(_report_generator(rows), sess)
+    return res
+
+
+@extdirect_method('Export', 'start',
+                  request_as_last_param=True, permission='USAGE')
+def export_start(moddef, objcls, fmt, params, request):
+    """
+    ExtDirect method to start exporting data in background.
+
+    Resulting file is saved to user's VFS and the user is notified
+    via RT when it is ready.
+    """
+    from .tasks import task_export
+
+    model = _get_export_model(request, moddef, objcls)
+    if model is None:
+        raise KeyError('Unknown model: %s.%s' % (moddef, objcls))
+    if not _can_export(request, model):
+        raise ValueError('Access denied')
+    mmgr = request.registry.getUtility(IModuleManager)
+    # Fail early on unknown formats, or ones that can't run in background.
+    if not mmgr.get_export_format(fmt).background:
+        raise ValueError('Background export is not supported '
+                         'for this format')
+    if not isinstance(params, dict):
+        params = {}
+    ffid = params.pop('__ffid', None)
+    if ffid:
+        ffid = int(ffid)
+        folder = DBSession().query(FileFolder).get(ffid)
+        if folder is None or not folder.can_write(request.user):
+            raise ValueError('Folder access denied')
+    elif not request.user.root_writable:
+        raise ValueError('Folder access denied')
+    # Task IDs carry owner's UID to check access on status and cancel.
+    res = task_export.apply_async(args=(request.user.id, moddef, objcls,
+                                        fmt, params),
+                                  kwargs={'locale': request.locale_name,
+                                          'ffid': ffid},
+                                  task_id='export-%d-%s' % (request.user.id,
+                                                            uuid.uuid4()))
+    return {'success': True, 'task_id': res.task_id}
+
+
+def _get_export_task(task_id, request):
+    from .tasks import task_export
+
+    if not task_id.startswith('export-%d-' % (request.user.id,)):
+        return None, None
+    res = task_export.AsyncResult(task_id)
+    info = res.info
+    if not isinstance(info, dict):
+        info = {}
+    return res, info
+
+
+@extdirect_method('Export', 'status',
+                  request_as_last_param=True, permission='USAGE')
+def export_status(task_id, request):
+    """
+    ExtDirect method to query background export progress.
+    """
+    res, info = _get_export_task(task_id, request)
+    if res is None:
+        return {'success': False}
+    ret = {
+        'success': True,
+        'state':   res.state,
+        'size':    info.get('size', 0)
+    }
+    if res.failed():
+        ret['message'] = str(res.result)
+    elif res.successful():
+        ret.update({
+            'file_id': info['id'],
+            'name':    info['name']
+        })
+    return ret
+
+
+@extdirect_method('Export', 'cancel',
+                  request_as_last_param=True, permission='USAGE')
+def export_cancel(task_id, request):
+    """
+    ExtDirect method to cancel running background export.
+    """
+    res, info = _get_export_task(task_id, request)
+    if res is None or res.ready():
+        return {'success': False}
+    res.revoke(terminate=True)
+    return {'success': True}
 
 
 @view_config(route_name='core.about', permission='USAGE', renderer='json')
@@ -377,6 +624,17 @@ def about(request):
     return {'license': license, 'modules': modules}
 
 
+@view_config(route_name='core.stats.hashing', permission='ADMIN_DEV',
+             renderer='json')
+def hashing_stats(request):
+    """
+    Password hashing queue metrics of the current worker process.
+    """
+    stats = get_hash_stats()
+    stats['pid'] = os.getpid()
+    return stats
+
+
 @extdirect_method('User', 'get_chpass_wizard',
                   request_as_last_param=True, permission='USAGE',
                   session_checks=False)
@@ -432,16 +690,20 @@ def dyn_user_chpass_submit(values, request):
     old_pass = values.get('oldpass')
     new_pass1 = values.get('newpass1')
     new_pass2 = values.get('newpass2')
-    if not old_pass or not user.check_password(old_pass):
-        raise ValueError('Old password is invalid')
-    if not new_pass1 or not new_pass2 or new_pass1 != new_pass2:
-        raise ValueError('New password is invalid')
-    secpol = user.effective_policy
-    if secpol:
-        if secpol.check_new_password(request, user, new_pass1,
-                                     dt.datetime.now()) is not True:
+    try:
+        if not old_pass or not user.check_password(old_pass):
+            raise ValueError('Old password is invalid')
+        if not new_pass1 or not new_pass2 or new_pass1 != new_pass2:
             raise ValueError('New password is invalid')
-    user.change_password(new_pass1, values, request)
+        secpol = user.effective_policy
+        if secpol:
+            if secpol.check_new_password(request, user, new_pass1,
+                                         dt.datetime.now()) is not True:
+                raise ValueError('New password is invalid')
+        user.change_password(new_pass1, values, request)
+    except HashQueueFull:
+        raise ValueError(request.localizer.translate(
+                _('Server is busy, please try again later.')))
 
     return {'success': True, 'action': {'exec': 'afterSubmit'}}
 
@@ -454,8 +716,15 @@ def dyn_user_chpass_validate(ret, values, request):
     old_pass = values.get('oldpass')
     new_pass1 = values.get('newpass1')
     new_pass2 = values.get('newpass2')
-    if not old_pass or not user.check_password(old_pass):
-        errors['oldpass'].append(loc.translate(_('Old password is invalid.')))
+    try:
+        if not old_pass or not user.check_password(old_pass):
+            errors['oldpass'].append(loc.translate(
+                    _('Old password is invalid.')))
+    except HashQueueFull:
+        errors['oldpass'].append(loc.translate(
+                _('Server is busy, please try again later.')))
+        ret['errors'].update(errors)
+        return
     if not new_pass1:
         errors['newpass1'].append(loc.translate(
                 _('New password can\'t be empty.')))
@@ -931,9 +1200,6 @@ def dyn_usersettings_submit(param, request):
 
     sess = DBSession()
     mmgr = request.registry.getUtility(IModuleManager)
-    cached = None
-    if 'auth.settings' in request.session:
-        cached = request.session['auth.settings']
 
     all_settings = mmgr.get_settings('user')
     values = dict((s.name, s)
@@ -965,8 +1231,6 @@ def dyn_usersettings_submit(param, request):
                     if fullname in values:
                         sess.delete(values[fullname])
                         del values[fullname]
-                    if cached:
-                        cached[fullname] = setting.default
                     continue
                 if new_value != old_value:
                     if fullname in values:
@@ -978,11 +1242,7 @@ def dyn_usersettings_submit(param, request):
                             name=fullname,
                             value=setting.format_param(new_value))
                         sess.add(values[fullname])
-                    if cached:
-                        cached[fullname] = new_value
 
-    if cached:
-        request.session['auth.settings'] = cached
     return {'success': True}
 
 
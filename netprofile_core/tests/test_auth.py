@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for cached user identities
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+from netprofile.common import (
+    cache,
+    invalidation
+)
+
+if cache.cache is None:
+    cache.cache = cache.configure_cache({
+        'netprofile.cache.backend': 'dogpile.cache.memory'
+    })
+
+from netprofile_core import auth  # noqa: E402
+from netprofile_core.auth import (  # noqa: E402
+    IDENTITY_CHANNEL,
+    Identity,
+    bump_identity_version,
+    drop_local_identity,
+    get_identity,
+    get_identity_version,
+    make_identity
+)
+
+
+def _identity(uid, version=None):
+    return Identity(id=uid,
+                    login='user%d' % (uid,),
+                    group_id=1,
+                    group_ids=(1,),
+                    privileges={'BASE_ADMIN': True},
+                    acls=(),
+                    settings={},
+                    policy_id=None,
+                    sess_timeout=None,
+                    version=version)
+
+
+class IdentityTestCase(unittest.TestCase):
+    def setUp(self):
+        region = cache.configure_cache({
+            'netprofile.cache.backend': 'dogpile.cache.memory'
+        })
+        patcher = mock.patch.object(cache, 'cache', region)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        drop_local_identity()
+        self.addCleanup(drop_local_identity)
+        self.req = testing.DummyRequest()
+        self.users = {}
+        patcher = mock.patch.object(auth, '_find_user',
+                                    side_effect=self.users.get)
+        self.find_user = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(
+                auth, 'make_identity',
+                side_effect=lambda user, req, ver=None: _identity(user.id,
+                                                                  ver))
+        self.make_identity = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(auth, 'unauthenticated_userid',
+                                    return_value='u:user1')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.users['user1'] = mock.MagicMock(id=1)
+        self.users['user2'] = mock.MagicMock(id=2)
+
+
+class TestIdentityVersion(IdentityTestCase):
+    def test_versions(self):
+        self.assertEqual(get_identity_version(1), (None, None))
+        bump_identity_version(1)
+        ver = get_identity_version(1)
+        self.assertIsNone(ver[0])
+        self.assertIsNotNone(ver[1])
+        self.assertEqual(get_identity_version(2), (None, None))
+        bump_identity_version()
+        self.assertNotEqual(get_identity_version(1)[0], None)
+        self.assertEqual(get_identity_version(1)[1], ver[1])
+        self.assertEqual(get_identity_version(2)[0],
+                         get_identity_version(1)[0])
+
+    def test_no_cache(self):
+        with mock.patch.object(cache, 'cache', None):
+            self.assertIsNone(get_identity_version(1))
+            bump_identity_version(1)
+            self.assertEqual(get_identity(self.req).id, 1)
+            self.assertEqual(get_identity(self.req).id, 1)
+        self.assertEqual(self.find_user.call_count, 2)
+
+
+class TestIdentityCache(IdentityTestCase):
+    def test_shared_cache(self):
+        ident = get_identity(self.req)
+        self.assertEqual(ident.id, 1)
+        self.assertEqual(ident.version, (None, None))
+        self.assertEqual(get_identity(self.req), ident)
+        self.assertEqual(self.find_user.call_count, 1)
+        bump_identity_version(2)
+        self.assertEqual(get_identity(self.req), ident)
+        self.assertEqual(self.find_user.call_count, 1)
+        bump_identity_version(1)
+        ident = get_identity(self.req)
+        self.assertEqual(ident.version, get_identity_version(1))
+        self.assertEqual(self.find_user.call_count, 2)
+        bump_identity_version()
+        get_identity(self.req)
+        self.assertEqual(self.find_user.call_count, 3)
+
+    def test_missing_user(self):
+        del self.users['user1']
+        self.assertIsNone(get_identity(self.req))
+        with mock.patch.object(auth, 'unauthenticated_userid',
+                               return_value=None):
+            self.assertIsNone(get_identity(self.req))
+
+    def test_local_cache(self):
+        bus = invalidation.LocalInvalidationBus()
+        bus.subscribe(IDENTITY_CHANNEL, drop_local_identity)
+        with mock.patch.object(invalidation, 'bus', bus):
+            ident = get_identity(self.req)
+            with mock.patch.object(cache, 'cache', None):
+                # Served from process memory only.
+                self.assertIs(get_identity(self.req), ident)
+            bus.publish(IDENTITY_CHANNEL, 2)
+            self.assertIs(get_identity(self.req), ident)
+            bus.publish(IDENTITY_CHANNEL, 1)
+            with mock.patch.object(auth, '_load_identity',
+                                   return_value=None) as load:
+                self.assertIsNone(get_identity(self.req))
+            load.assert_called_once_with('user1', self.req)
+
+    def test_local_cache_race(self):
+        bus = invalidation.LocalInvalidationBus()
+
+        def _load(userid, req):
+            # Invalidation arrives while identity is being loaded.
+            drop_local_identity(1)
+            return _identity(1)
+
+        with mock.patch.object(invalidation, 'bus', bus):
+            with mock.patch.object(auth, '_load_identity',
+                                   side_effect=_load) as load:
+                get_identity(self.req)
+                get_identity(self.req)
+        self.assertEqual(load.call_count, 2)
+
+
+class TestIdentityChanges(unittest.TestCase):
+    def setUp(self):
+        self.sess = mock.MagicMock(info={})
+        patcher = mock.patch.object(auth, 'object_session',
+                                    return_value=self.sess)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(invalidation, 'publish')
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(auth, 'bump_identity_version')
+        self.bump = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_after_commit(self):
+        for uid in (2, 1, 2, 1):
+            auth._mod_user_data(None, None, mock.MagicMock(user_id=uid))
+        auth._mod_user(None, None, mock.MagicMock(id=1))
+        self.publish.assert_not_called()
+        auth._identity_after_commit(self.sess)
+        self.assertEqual(self.publish.call_args_list,
+                         [mock.call(IDENTITY_CHANNEL, 1),
+                          mock.call(IDENTITY_CHANNEL, 2)])
+        self.assertEqual(self.bump.call_args_list,
+                         [mock.call(1), mock.call(2)])
+        self.assertEqual(self.sess.info, {})
+
+    def test_global(self):
+        auth._mod_user(None, None, mock.MagicMock(id=1))
+        auth._mod_global(None, None, mock.MagicMock())
+        auth._identity_after_commit(self.sess)
+        self.publish.assert_called_once_with(IDENTITY_CHANNEL, None)
+        self.bump.assert_called_once_with(None)
+
+    def test_rollback(self):
+        auth._mod_user(None, None, mock.MagicMock(id=1))
+        auth._identity_after_rollback(self.sess)
+        auth._identity_after_commit(self.sess)
+        self.publish.assert_not_called()
+
+
+class TestMakeIdentity(unittest.TestCase):
+    def test_fields(self):
+        # "parent" is a constructor argument of mocks, so it is set
+        # separately.
+        parent = mock.MagicMock(id=1)
+        parent.parent = None
+        group = mock.MagicMock(id=2)
+        group.parent = parent
+        user = mock.MagicMock(id=10,
+                              login='admin',
+                              group_id=2,
+                              group=group,
+                              secondary_groups=[mock.MagicMock(id=1),
+                                                mock.MagicMock(id=3)],
+                              flat_privileges={'BASE_ADMIN': True},
+                              sess_timeout=600)
+        user.effective_policy.id = 5
+        with mock.patch.object(auth, '_get_user_settings',
+                               return_value={'a.b.c': 1}):
+            ident = make_identity(user, testing.DummyRequest(), ('a', 'b'))
+        self.assertEqual(ident.group_ids, (2, 1, 3))
+        self.assertEqual(ident.privileges, {'BASE_ADMIN': True})
+        self.assertEqual(ident.policy_id, 5)
+        self.assertEqual(ident.sess_timeout, 600)
+        self.assertEqual(ident.settings, {'a.b.c': 1})
+        self.assertEqual(ident.version, ('a', 'b'))
+        self.assertIn(('Allow', 'admin', 'BASE_ADMIN'), ident.acls)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for core module models
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+
+# Test body begins here
+
+import transaction
+from sqlalchemy import (
+    create_engine,
+    event
+)
+from sqlalchemy.orm import (
+    Session,
+    make_transient_to_detached
+)
+from sqlalchemy.schema import CreateTable
+
+from netprofile.common import cache
+from netprofile.db.connection import DBSession
+
+if cache.cache is None:
+    cache.cache = cache.configure_cache({
+        'netprofile.cache.backend': 'dogpile.cache.memory'
+    })
+
+from netprofile_core import models  # noqa: E402
+from netprofile_core.models import (  # noqa: E402
+    Group,
+    GroupCapability,
+    User,
+    UserCapability,
+    _flat_privileges_pending,
+    get_flat_privileges,
+    refresh_flat_privileges
+)
+
+
+class TestFlatPrivilegesPending(unittest.TestCase):
+    def setUp(self):
+        self.sess = Session()
+        self.user = User(id=1, login='user1')
+
+    def test_unrelated(self):
+        self.assertFalse(_flat_privileges_pending(self.sess, self.user))
+        self.sess.add(User(id=2, login='user2'))
+        self.sess.add(UserCapability(user_id=2, privilege_id=1))
+        self.assertFalse(_flat_privileges_pending(self.sess, self.user))
+
+    def test_own_changes(self):
+        self.sess.add(UserCapability(user_id=1, privilege_id=1))
+        self.assertTrue(_flat_privileges_pending(self.sess, self.user))
+
+    def test_unknown_user(self):
+        self.sess.add(UserCapability(privilege_id=1))
+        self.assertTrue(_flat_privileges_pending(self.sess, self.user))
+
+    def test_new_user(self):
+        self.sess.add(self.user)
+        self.assertTrue(_flat_privileges_pending(self.sess, self.user))
+
+    def test_group_changes(self):
+        self.sess.add(GroupCapability(group_id=5, privilege_id=1))
+        self.assertTrue(_flat_privileges_pending(self.sess, self.user))
+
+    def test_group_deleted(self):
+        group = Group(id=5, name='group5')
+        make_transient_to_detached(group)
+        self.sess.add(group)
+        self.assertFalse(_flat_privileges_pending(self.sess, self.user))
+        self.sess.delete(group)
+        self.assertTrue(_flat_privileges_pending(self.sess, self.user))
+
+
+def _enable_foreign_keys(dbapi_conn, conn_record):
+    dbapi_conn.execute('PRAGMA foreign_keys=ON')
+
+
+class TestFlatPrivilegesRefresh(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        event.listen(engine, 'connect', _enable_foreign_keys)
+        # Plain CREATE TABLE statements, as triggers of these models are
+        # not available for SQLite.
+        for model in (models.NPModule, models.SecurityPolicy, models.Group,
+                      models.FileFolder, models.User, models.File,
+                      models.UserGroup, models.Privilege,
+                      models.GroupCapability, models.UserCapability,
+                      models.UserACL, models.GroupACL,
+                      models.UserFlatPrivilege):
+            engine.execute(CreateTable(model.__table__))
+        DBSession.configure(bind=engine)
+        self.addCleanup(DBSession.configure, bind=None)
+        self.addCleanup(DBSession.remove)
+        self.addCleanup(transaction.abort)
+        self.sess = DBSession()
+        self.conn = self.sess.connection()
+        for model, rows in (
+                (models.NPModule, ({'npmodid': 1, 'name': 'core'},)),
+                (models.Group, ({'gid': 1, 'name': 'main',
+                                 'parentid': None},
+                                {'gid': 2, 'name': 'extra',
+                                 'parentid': None},
+                                {'gid': 3, 'name': 'child',
+                                 'parentid': 2})),
+                (models.User, ({'uid': 1, 'gid': 1, 'login': 'user1',
+                                'pwd_hashed': False},
+                               {'uid': 2, 'gid': 3, 'login': 'user2',
+                                'pwd_hashed': False})),
+                (models.UserGroup, ({'uid': 1, 'gid': 2},)),
+                (models.Privilege, ({'privid': 1, 'npmodid': 1,
+                                     'code': 'A', 'name': 'A'},)),
+                (models.GroupCapability, ({'gid': 2, 'privid': 1,
+                                           'value': True},))):
+            self.conn.execute(model.__table__.insert(), rows)
+        refresh_flat_privileges(self.conn)
+
+    def test_delete_group(self):
+        self.assertEqual(get_flat_privileges(self.conn, 1), {'A': True})
+        self.assertEqual(get_flat_privileges(self.conn, 2), {'A': True})
+        self.sess.delete(self.sess.query(Group).get(2))
+        self.sess.flush()
+        # Secondary group membership and parent group are gone.
+        self.assertEqual(get_flat_privileges(self.conn, 1), {})
+        self.assertEqual(get_flat_privileges(self.conn, 2), {})
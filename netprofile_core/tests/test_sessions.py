@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for UI session state stores
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+import datetime as dt
+import ipaddress
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from netprofile.common import (
+    cache,
+    invalidation
+)
+
+if cache.cache is None:
+    cache.cache = cache.configure_cache({
+        'netprofile.cache.backend': 'dogpile.cache.memory'
+    })
+
+from netprofile_core import sessions  # noqa: E402
+from netprofile_core.auth import Identity  # noqa: E402
+from netprofile_core.sessions import (  # noqa: E402
+    MemorySessionStore,
+    RedisSessionStore,
+    SessionState,
+    configure_store,
+    write_back
+)
+
+_TS = dt.datetime(2017, 3, 4, 5, 6, 7)
+
+
+def _state(**kwargs):
+    data = dict(id=1,
+                session_name='sess1',
+                user_id=10,
+                login='admin',
+                start_time=_TS,
+                last_time=_TS,
+                ip_address=ipaddress.ip_address('10.0.0.1'),
+                ipv6_address=None)
+    data.update(kwargs)
+    return SessionState(**data)
+
+
+def _identity(uid=10, policy_id=None):
+    return Identity(id=uid,
+                    login='admin',
+                    group_id=1,
+                    group_ids=(1,),
+                    privileges={},
+                    acls=(),
+                    settings={},
+                    policy_id=policy_id,
+                    sess_timeout=None,
+                    version=None)
+
+
+class TestSessionState(unittest.TestCase):
+    def test_str(self):
+        self.assertEqual(str(_state()), 'sess1')
+        self.assertEqual('%s' % (_state(session_name='abc'),), 'abc')
+
+    def test_serialize(self):
+        state = _state()
+        self.assertEqual(SessionState.loads(state.dumps()), state)
+        self.assertEqual(SessionState.loads(state.dumps().encode()), state)
+        state = _state(last_time=None, ip_address=None,
+                       ipv6_address=ipaddress.ip_address('fe80::1'))
+        self.assertEqual(SessionState.loads(state.dumps()), state)
+
+    def test_from_session(self):
+        npsess = mock.MagicMock(**_state()._asdict())
+        self.assertEqual(SessionState.from_session(npsess), _state())
+
+    def test_check_request(self):
+        req = testing.DummyRequest(identity=_identity())
+        self.assertTrue(_state().check_request(req, _TS))
+        req.identity = _identity(uid=11)
+        self.assertFalse(_state().check_request(req, _TS))
+        req.identity = None
+        self.assertFalse(_state().check_request(req, _TS))
+
+    def test_check_request_policy(self):
+        req = testing.DummyRequest(identity=_identity(policy_id=5))
+        secpol = mock.MagicMock()
+        secpol.check_old_session.return_value = False
+        with mock.patch('netprofile_core.models.DBSession') as dbs:
+            dbs.return_value.query.return_value.get.return_value = secpol
+            self.assertFalse(_state().check_request(req, _TS))
+        dbs.return_value.query.return_value.get.assert_called_once_with(5)
+        secpol.check_old_session.assert_called_once_with(
+                req, None, _state(), _TS)
+
+
+class TestMemorySessionStore(unittest.TestCase):
+    def setUp(self):
+        self.store = MemorySessionStore(ttl=10, flush_interval=60)
+
+    def test_get_put(self):
+        self.assertIsNone(self.store.get('sess1'))
+        self.store.put(_state())
+        self.assertEqual(self.store.get('sess1'), _state())
+        self.store.remove('sess1')
+        self.assertIsNone(self.store.get('sess1'))
+
+    def test_expiry(self):
+        with mock.patch('time.monotonic', return_value=100.0):
+            self.store.put(_state())
+        with mock.patch('time.monotonic', return_value=109.0):
+            self.assertIsNotNone(self.store.get('sess1'))
+        with mock.patch('time.monotonic', return_value=110.0):
+            self.assertIsNone(self.store.get('sess1'))
+
+    def test_activity(self):
+        later = _TS + dt.timedelta(minutes=1)
+        state = self.store.touch(_state(), later)
+        self.assertEqual(state.last_time, later)
+        self.assertEqual(self.store.get('sess1'), state)
+        self.assertEqual(self.store.pop_activity(), {'sess1': later})
+        self.assertEqual(self.store.pop_activity(), {})
+
+    def test_flush_due(self):
+        with mock.patch('time.monotonic', return_value=100.0):
+            self.assertFalse(self.store.flush_due())
+        with mock.patch('time.monotonic', return_value=159.0):
+            self.assertFalse(self.store.flush_due())
+        with mock.patch('time.monotonic', return_value=160.0):
+            self.assertTrue(self.store.flush_due())
+            self.assertFalse(self.store.flush_due())
+        self.assertFalse(MemorySessionStore(flush_interval=0).flush_due())
+
+
+class TestRedisSessionStore(unittest.TestCase):
+    def setUp(self):
+        self.store = RedisSessionStore(ttl=10, prefix='test')
+        self.store._client = mock.MagicMock()
+
+    def test_get(self):
+        client = self.store._client
+        client.get.return_value = _state().dumps().encode()
+        self.assertEqual(self.store.get('sess1'), _state())
+        client.get.assert_called_once_with('test:sess1')
+        client.get.return_value = b'garbage'
+        self.assertIsNone(self.store.get('sess1'))
+        client.get.return_value = None
+        self.assertIsNone(self.store.get('sess1'))
+
+    def test_touch(self):
+        later = _TS + dt.timedelta(minutes=1)
+        state = self.store.touch(_state(), later)
+        self.assertEqual(state.last_time, later)
+        pipe = self.store._client.pipeline.return_value
+        pipe.setex.assert_called_once_with('test:sess1', 10, state.dumps())
+        pipe.hset.assert_called_once_with('test.activity', 'sess1',
+                                          later.isoformat())
+        pipe.execute.assert_called_once_with()
+
+    @unittest.skipIf(redis is None, 'redis is not installed')
+    def test_pop_activity(self):
+        pipe = self.store._client.pipeline.return_value
+        pipe.execute.return_value = [{b'sess1': _TS.isoformat().encode()}]
+        self.assertEqual(self.store.pop_activity(), {'sess1': _TS})
+        tmpkey = self.store._client.rename.call_args[0][1]
+        self.assertTrue(tmpkey.startswith('test.activity:'))
+        pipe.delete.assert_called_once_with(tmpkey)
+
+
+class TestWriteBack(unittest.TestCase):
+    def test_batches(self):
+        store = MemorySessionStore()
+        for idx in range(5):
+            store.touch(_state(session_name='sess%d' % (idx,)), _TS)
+        sess = mock.MagicMock()
+        with mock.patch.object(sessions, 'WRITE_BACK_BATCH', 2):
+            self.assertEqual(write_back(sess, store), 5)
+        self.assertEqual([len(call[0][1])
+                          for call
+                          in sess.execute.call_args_list], [2, 2, 1])
+        self.assertEqual(sess.execute.call_args_list[0][0][1][0],
+                         {'b_sname': 'sess0', 'b_ts': _TS})
+        sess.reset_mock()
+        self.assertEqual(write_back(sess, store), 0)
+        sess.execute.assert_not_called()
+
+
+class TestConfigureStore(unittest.TestCase):
+    def test_backends(self):
+        self.assertIsNone(configure_store({}))
+        store = configure_store({
+            'netprofile.auth.session_store.backend': 'memory',
+            'netprofile.auth.session_store.ttl': '60'
+        })
+        self.assertIsInstance(store, MemorySessionStore)
+        self.assertEqual(store.ttl, 60)
+        store = configure_store({
+            'netprofile.auth.session_store.backend': 'redis',
+            'netprofile.auth.session_store.prefix': 'np',
+            'netprofile.auth.session_store.redis.host': 'example.com',
+            'netprofile.auth.session_store.redis.db': '2'
+        })
+        self.assertIsInstance(store, RedisSessionStore)
+        self.assertEqual(store.prefix, 'np')
+        self.assertEqual(store.conf, {'host': 'example.com', 'db': 2})
+        with self.assertRaises(ValueError):
+            configure_store({'netprofile.auth.session_store.backend': 'x'})
+
+
+class TestSessionEviction(unittest.TestCase):
+    def setUp(self):
+        self.store = MemorySessionStore()
+        self.store.put(_state())
+        patcher = mock.patch.dict(sessions._store, {'store': self.store})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sess = mock.MagicMock(info={})
+        patcher = mock.patch.object(sessions, 'object_session',
+                                    return_value=self.sess)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _delete(self):
+        sessions._del_session(None, None,
+                              mock.MagicMock(session_name='sess1'))
+
+    def test_after_commit(self):
+        self._delete()
+        self.assertIsNotNone(self.store.get('sess1'))
+        sessions._sessions_after_commit(self.sess)
+        self.assertIsNone(self.store.get('sess1'))
+        self.assertEqual(self.sess.info, {})
+
+    def test_rollback(self):
+        self._delete()
+        sessions._sessions_after_rollback(self.sess)
+        sessions._sessions_after_commit(self.sess)
+        self.assertIsNotNone(self.store.get('sess1'))
+
+    def test_bus(self):
+        bus = invalidation.LocalInvalidationBus()
+        with mock.patch.object(invalidation, 'bus', bus), \
+                mock.patch.object(bus, 'publish',
+                                  wraps=bus.publish) as publish:
+            invalidation.subscribe(sessions.SESSION_CHANNEL,
+                                   sessions._drop_local_session)
+            self._delete()
+            sessions._sessions_after_commit(self.sess)
+            publish.assert_called_once_with(sessions.SESSION_CHANNEL, 'sess1')
+            self.assertIsNone(self.store.get('sess1'))
+            self.store.put(_state())
+            self.store.touch(_state(session_name='sess2'), _TS)
+            bus.dispatch_all()
+        self.assertIsNone(self.store.get('sess1'))
+        self.assertEqual(self.store.pop_activity(), {'sess2': _TS})
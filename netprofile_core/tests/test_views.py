@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# NetProfile: Tests for core module views
+# Copyright © 2017 Alex Unigovsky
+#
+# This file is part of NetProfile.
+# NetProfile is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either
+# version 3 of the License, or (at your option) any later
+# version.
+#
+# NetProfile is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General
+# Public License along with NetProfile. If not, see
+# <http://www.gnu.org/licenses/>.
+
+from __future__ import (unicode_literals, print_function,
+                        absolute_import, division)
+
+import unittest
+import mock
+from pyramid import testing
+
+# Test body begins here
+
+from netprofile.common import cache
+
+if cache.cache is None:
+    cache.cache = cache.configure_cache({
+        'netprofile.cache.backend': 'dogpile.cache.memory'
+    })
+
+from netprofile.common.crypto import HashQueueFull  # noqa: E402
+from netprofile.common.modules import IModuleManager  # noqa: E402
+from netprofile.export import ExportLimitExceeded  # noqa: E402
+from netprofile_core import views  # noqa: E402
+from netprofile_core.views import (  # noqa: E402
+    bump_schema_version,
+    data_export,
+    data_report,
+    do_login,
+    dyn_user_chpass_submit,
+    dyn_user_chpass_validate,
+    get_webshell_schema,
+    hashing_stats
+)
+
+
+class TestWebshellSchema(unittest.TestCase):
+    def setUp(self):
+        region = cache.configure_cache({
+            'netprofile.cache.backend': 'dogpile.cache.memory'
+        })
+        patcher = mock.patch.object(cache, 'cache', region)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.config = testing.setUp()
+        self.addCleanup(testing.tearDown)
+        mmgr = mock.MagicMock()
+        mmgr.loaded = {'core': mock.MagicMock()}
+        mmgr.loaded['core'].version.return_value = '1.0'
+        self.config.registry.registerUtility(mmgr, IModuleManager)
+        self.req = testing.DummyRequest()
+        self.req.identity = mock.MagicMock(privileges={'BASE_ADMIN': True})
+        patcher = mock.patch.object(views, 'render',
+                                    side_effect=['body0', 'body1'])
+        self.render = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        schema = get_webshell_schema(self.req)
+        self.assertEqual(schema[1], 'body0')
+        self.assertEqual(get_webshell_schema(self.req), schema)
+        self.req.identity.privileges = {'BASE_ADMIN': False}
+        self.assertEqual(get_webshell_schema(self.req)[1], 'body1')
+        self.assertEqual(self.render.call_count, 2)
+
+    def test_data_version(self):
+        schema = get_webshell_schema(self.req)
+        bump_schema_version()
+        self.assertNotEqual(get_webshell_schema(self.req), schema)
+        self.assertEqual(self.render.call_count, 2)
+
+    def test_no_cache(self):
+        with mock.patch.object(cache, 'cache', None):
+            bump_schema_version()
+            self.assertEqual(get_webshell_schema(self.req)[1], 'body0')
+            self.assertEqual(get_webshell_schema(self.req)[1], 'body1')
+
+
+class TestDataExport(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+        self.addCleanup(testing.tearDown)
+        self.config.registry.registerUtility(mock.MagicMock(),
+                                             IModuleManager)
+        for name in ('_get_export_model', '_can_export'):
+            patcher = mock.patch.object(views, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.req = testing.DummyRequest(post={
+            'csrf':   'token',
+            'format': 'pdf',
+            'params': '{}'
+        })
+        self.req.matchdict = {'module': 'core', 'model': 'User'}
+        self.req.get_csrf = mock.MagicMock(return_value='token')
+
+    def test_limit_exceeded(self):
+        with mock.patch.object(views, 'cached_export',
+                               side_effect=ExportLimitExceeded('Too many')):
+            res = data_export(self.req)
+        self.assertEqual(res.status_int, 400)
+        self.assertEqual(res.content_type, 'text/plain')
+        self.assertEqual(res.text, 'Too many')
+
+
+class TestDataReport(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+        self.addCleanup(testing.tearDown)
+        self.model = mock.MagicMock(cap_read='BASE_ADMIN')
+        self.model.iter_report.return_value = iter(({'cnt': 2, 'name': 'a'},
+                                                    {'cnt': 1, 'name': 'b'}))
+        patcher = mock.patch.object(views, '_get_export_model',
+                                    return_value=self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(views, 'get_detached_session')
+        self.sess = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.req = testing.DummyRequest(params={
+            'params': '{"__groupby": ["name"]}'
+        })
+        self.req.matchdict = {'module': 'core', 'model': 'User'}
+        self.req.has_permission = mock.MagicMock(return_value=True)
+
+    def test_stream(self):
+        res = data_report(self.req)
+        self.model.iter_report.assert_called_once_with(
+                {'__groupby': ['name']}, self.req, sess=self.sess)
+        self.sess.close.assert_not_called()
+        self.assertEqual(res.content_type, 'application/x-ndjson')
+        body = b''.join(res.app_iter)
+        self.assertEqual(body.decode().splitlines(),
+                         ['{"cnt":2,"name":"a"}', '{"cnt":1,"name":"b"}'])
+        self.sess.close.assert_called_once_with()
+
+    def test_forbidden(self):
+        self.req.has_permission.return_value = False
+        self.assertEqual(data_report(self.req).status_int, 403)
+        self.model.iter_report.assert_not_called()
+
+
+class TestHashQueueFull(unittest.TestCase):
+    def setUp(self):
+        self.config = testing.setUp()
+        self.addCleanup(testing.tearDown)
+        self.config.registry.registerUtility(mock.MagicMock(),
+                                             IModuleManager)
+        self.user = mock.MagicMock()
+        self.user.check_password.side_effect = HashQueueFull('Too many')
+        for name, value in (('authenticated_userid', None),
+                            ('locale_neg', 'en'),
+                            ('global_setting', True)):
+            patcher = mock.patch.object(views, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(views, 'DBSession')
+        sess = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        sess.query.return_value.filter.return_value = [self.user]
+        self.req = testing.DummyRequest(post={
+            'submit': '1',
+            'csrf':   'token',
+            'user':   'admin',
+            'pass':   'secret'
+        })
+        self.req.get_csrf = mock.MagicMock(return_value='token')
+        self.req.user = self.user
+        self.values = {
+            'oldpass':  'secret',
+            'newpass1': 'secret2',
+            'newpass2': 'secret2'
+        }
+
+    def test_login(self):
+        res = do_login(self.req)
+        self.assertTrue(res['busy'])
+        self.assertEqual(self.req.response.status_int, 503)
+
+    def test_change_password(self):
+        with self.assertRaisesRegex(ValueError, 'try again later'):
+            dyn_user_chpass_submit(self.values, self.req)
+        self.user.change_password.assert_not_called()
+
+    def test_validate_password(self):
+        ret = {'errors': {}}
+        dyn_user_chpass_validate(ret, self.values, self.req)
+        self.assertEqual(ret['errors'],
+                         {'oldpass': ['Server is busy, '
+                                      'please try again later.']})
+
+    def test_stats(self):
+        stats = hashing_stats(self.req)
+        self.assertIn('rejected', stats)
+        self.assertIn('pid', stats)
@@ -0,0 +1,39 @@
+"""Quick search token index
+
+Revision ID: e17b5d0c3f84
+Revises: 16be1c0cddd0
+Create Date: 2026-10-18 14:53:02.417359
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e17b5d0c3f84'
+down_revision = '16be1c0cddd0'
+branch_labels = None
+depends_on = None
+
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+from netprofile.db import fields as npf
+
+def upgrade():
+    op.create_table('entities_def_search',
+    sa.Column('objid', npf.UInt32(), nullable=False),
+    sa.Column('token', sa.Unicode(length=64), nullable=False),
+    sa.PrimaryKeyConstraint('token', 'objid', name=op.f('entities_def_search_pk')),
+    mysql_charset='utf8',
+    mysql_engine='InnoDB'
+    )
+    op.create_index('entities_def_search_i_objid', 'entities_def_search', ['objid'], unique=False)
+
+    # Filled by "npctl search index entities" command. Until then quick search
+    # falls back to plain column matching.
+    logging.getLogger('alembic.runtime.migration').warning(
+        'Run "npctl search index entities" to build quick search index.')
+
+
+def downgrade():
+    op.drop_index('entities_def_search_i_objid', table_name='entities_def_search')
+    op.drop_table('entities_def_search')
@@ -395,6 +395,7 @@ class Entity(Base):
                                   'state'),
                 'grid_hidden':   ('entityid',),
                 'easy_search':   ('nick',),
+                'search_index':  True,
                 'extra_data':    ('data', 'grid_icon'),
                 'detail_pane':   ('netprofile_core.views', 'dpane_simple'),
                 'extra_search':  (TextFilter('phone', _filter_phone,
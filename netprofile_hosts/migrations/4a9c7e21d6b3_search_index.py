@@ -0,0 +1,39 @@
+"""Quick search token index
+
+Revision ID: 4a9c7e21d6b3
+Revises: 7829ac7b5ad0
+Create Date: 2026-10-18 14:52:13.804116
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4a9c7e21d6b3'
+down_revision = '7829ac7b5ad0'
+branch_labels = None
+depends_on = None
+
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+from netprofile.db import fields as npf
+
+def upgrade():
+    op.create_table('hosts_def_search',
+    sa.Column('objid', npf.UInt32(), nullable=False),
+    sa.Column('token', sa.Unicode(length=64), nullable=False),
+    sa.PrimaryKeyConstraint('token', 'objid', name=op.f('hosts_def_search_pk')),
+    mysql_charset='utf8',
+    mysql_engine='InnoDB'
+    )
+    op.create_index('hosts_def_search_i_objid', 'hosts_def_search', ['objid'], unique=False)
+
+    # Filled by "npctl search index hosts" command. Until then quick search
+    # falls back to plain column matching.
+    logging.getLogger('alembic.runtime.migration').warning(
+        'Run "npctl search index hosts" to build quick search index.')
+
+
+def downgrade():
+    op.drop_index('hosts_def_search_i_objid', table_name='hosts_def_search')
+    op.drop_table('hosts_def_search')
@@ -146,6 +146,7 @@ class Host(Base):
                                   'ctime', 'cby',
                                   'mtime', 'mby'),
                 'easy_search':   ('name',),
+                'search_index':  True,
                 'detail_pane':   ('netprofile_core.views', 'dpane_simple'),
                 'create_wizard': Wizard(
                                     Step('name', 'domain', 'entity',
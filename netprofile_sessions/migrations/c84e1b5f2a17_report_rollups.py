@@ -0,0 +1,47 @@
+"""Report rollup tables
+
+Revision ID: c84e1b5f2a17
+Revises: a026b610c23c
+Create Date: 2026-10-18 14:21:09.310472
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c84e1b5f2a17'
+down_revision = 'a026b610c23c'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from netprofile.db import fields as npf
+
+def upgrade():
+    op.create_table('sessions_history_rollup_day',
+    sa.Column('period', sa.DateTime(), nullable=False),
+    sa.Column('nasid', npf.UInt32(), nullable=True),
+    sa.Column('entityid', npf.UInt32(), nullable=True),
+    sa.Column('count_all', npf.UInt64(), nullable=True),
+    sa.Column('sum_ut_ingress', npf.Traffic(precision=16, scale=0), nullable=True),
+    sa.Column('sum_ut_egress', npf.Traffic(precision=16, scale=0), nullable=True),
+    mysql_charset='utf8',
+    mysql_engine='InnoDB'
+    )
+    op.create_index('sessions_history_rollup_day_i_period', 'sessions_history_rollup_day', ['period'], unique=False)
+    op.create_table('sessions_history_rollup_hour',
+    sa.Column('period', sa.DateTime(), nullable=False),
+    sa.Column('nasid', npf.UInt32(), nullable=True),
+    sa.Column('count_all', npf.UInt64(), nullable=True),
+    sa.Column('sum_ut_ingress', npf.Traffic(precision=16, scale=0), nullable=True),
+    sa.Column('sum_ut_egress', npf.Traffic(precision=16, scale=0), nullable=True),
+    mysql_charset='utf8',
+    mysql_engine='InnoDB'
+    )
+    op.create_index('sessions_history_rollup_hour_i_period', 'sessions_history_rollup_hour', ['period'], unique=False)
+
+
+def downgrade():
+    op.drop_index('sessions_history_rollup_hour_i_period', table_name='sessions_history_rollup_hour')
+    op.drop_table('sessions_history_rollup_hour')
+    op.drop_index('sessions_history_rollup_day_i_period', table_name='sessions_history_rollup_day')
+    op.drop_table('sessions_history_rollup_day')
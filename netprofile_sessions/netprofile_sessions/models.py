@@ -69,6 +69,7 @@ from netprofile.db.ddl import (
     SQLFunction,
     Trigger
 )
+from netprofile.ext.rollup import Rollup
 
 _ = TranslationStringFactory('netprofile_sessions')
 
@@ -363,7 +364,17 @@ class AccessSessionHistory(Base):
                                   'startts', 'endts',
                                   'pol_ingress', 'pol_egress'),
                 'easy_search':   ('name', 'csid'),
-                'detail_pane':   ('netprofile_core.views', 'dpane_simple')
+                'detail_pane':   ('netprofile_core.views', 'dpane_simple'),
+                'rollups':       (Rollup('endts', 'day',
+                                         dimensions=('nasid', 'entityid'),
+                                         measures=(('count', '*'),
+                                                   ('sum', 'ut_ingress'),
+                                                   ('sum', 'ut_egress'))),
+                                  Rollup('endts', 'hour',
+                                         dimensions=('nasid',),
+                                         measures=(('count', '*'),
+                                                   ('sum', 'ut_ingress'),
+                                                   ('sum', 'ut_egress'))))
             }
         })
     id = Column(
@@ -0,0 +1,37 @@
+"""Report rollup tables
+
+Revision ID: 6b0f93d4e5a2
+Revises: 2e190ad964b4
+Create Date: 2026-10-18 14:23:40.127935
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6b0f93d4e5a2'
+down_revision = '2e190ad964b4'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from netprofile.db import fields as npf
+
+def upgrade():
+    op.create_table('stashes_io_def_rollup_day',
+    sa.Column('period', sa.DateTime(), nullable=False),
+    sa.Column('siotypeid', npf.UInt32(), nullable=True),
+    sa.Column('currid', npf.UInt32(), nullable=True),
+    sa.Column('count_all', npf.UInt64(), nullable=True),
+    sa.Column('sum_diff', npf.Money(precision=20, scale=8), nullable=True),
+    sa.Column('count_diff', npf.UInt64(), nullable=True),
+    sa.Column('min_diff', npf.Money(precision=20, scale=8), nullable=True),
+    sa.Column('max_diff', npf.Money(precision=20, scale=8), nullable=True),
+    mysql_charset='utf8',
+    mysql_engine='InnoDB'
+    )
+    op.create_index('stashes_io_def_rollup_day_i_period', 'stashes_io_def_rollup_day', ['period'], unique=False)
+
+
+def downgrade():
+    op.drop_index('stashes_io_def_rollup_day_i_period', table_name='stashes_io_def_rollup_day')
+    op.drop_table('stashes_io_def_rollup_day')
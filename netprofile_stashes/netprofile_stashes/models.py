@@ -80,6 +80,7 @@ from netprofile.db.ddl import (
     SQLFunction,
     Trigger
 )
+from netprofile.ext.rollup import Rollup
 from netprofile.ext.wizards import (
     SimpleWizard,
     Step,
@@ -775,6 +776,13 @@ class StashIO(Base):
                                   'user', 'ts', 'diff', 'descr'),
                 'extra_data':    ('formatted_difference',),
                 'detail_pane':   ('netprofile_core.views', 'dpane_simple'),
+                'rollups':       (Rollup('ts', 'day',
+                                         dimensions=('siotypeid', 'currid'),
+                                         measures=(('count', '*'),
+                                                   ('sum', 'diff'),
+                                                   ('count', 'diff'),
+                                                   ('min', 'diff'),
+                                                   ('max', 'diff'))),),
 
                 'create_wizard': Wizard(
                                     Step('stash', 'type', 'diff', 'descr',
@@ -0,0 +1,39 @@
+"""Quick search token index
+
+Revision ID: 9d2f6a81c5e0
+Revises: 3f17706add0f
+Create Date: 2026-10-18 14:53:48.260991
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9d2f6a81c5e0'
+down_revision = '3f17706add0f'
+branch_labels = None
+depends_on = None
+
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+from netprofile.db import fields as npf
+
+def upgrade():
+    op.create_table('tickets_def_search',
+    sa.Column('objid', npf.UInt32(), nullable=False),
+    sa.Column('token', sa.Unicode(length=64), nullable=False),
+    sa.PrimaryKeyConstraint('token', 'objid', name=op.f('tickets_def_search_pk')),
+    mysql_charset='utf8',
+    mysql_engine='InnoDB'
+    )
+    op.create_index('tickets_def_search_i_objid', 'tickets_def_search', ['objid'], unique=False)
+
+    # Filled by "npctl search index tickets" command. Until then quick search
+    # falls back to plain column matching.
+    logging.getLogger('alembic.runtime.migration').warning(
+        'Run "npctl search index tickets" to build quick search index.')
+
+
+def downgrade():
+    op.drop_index('tickets_def_search_i_objid', table_name='tickets_def_search')
+    op.drop_table('tickets_def_search')
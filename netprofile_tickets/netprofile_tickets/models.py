@@ -859,6 +859,7 @@ class Ticket(Base):
                                   'mtime', 'modified_by',
                                   'ttime', 'transition_by'),
                 'easy_search':   ('name',),
+                'search_index':  True,
                 'extra_data':    ('row_class',),
                 'detail_pane':   ('netprofile_tickets.views', 'dpane_tickets'),
                 'row_class_field': 'row_class',